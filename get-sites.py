@@ -5,6 +5,7 @@ authors: cklewar
 """
 
 import argparse
+import json
 import logging
 import os
 import sys
@@ -13,13 +14,72 @@ from pathlib import Path
 
 from coloredlogs import ColoredFormatter
 
-from lib.api import Api
+import lib.const as c
+from lib.api import Api, NamespaceError
+from lib.distributed import Coordinator, DirectoryQueue, Worker
+from lib.tenants import Tenants, tenant_file, tenant_name
 
 # Configure the logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+def split(value: str = None) -> list | None:
+    """
+    Split comma separated command line value
+    :param value: comma separated names
+    :return: list of names or None if value is empty
+    """
+
+    names = [name.strip() for name in value.split(",") if name.strip()]
+
+    return names if names else None
+
+
+def timeout(value: str = None) -> tuple[str, tuple[float, float]]:
+    """
+    Parse --timeout value
+    :param value: FAMILY=CONNECT:READ e.g. sites=5:60
+    :return: endpoint family and (connect, read) timeout in seconds
+    """
+
+    family, _, timeouts = value.partition("=")
+    families = list(c.ENDPOINT_FAMILIES) + [c.ENDPOINT_FAMILY_DEFAULT]
+
+    if family not in families:
+        raise argparse.ArgumentTypeError(f"<{value}>: endpoint family must be one of {', '.join(families)} as FAMILY=CONNECT:READ")
+
+    try:
+        connect, read = (float(t) for t in timeouts.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"<{value}>: timeouts must be given as FAMILY=CONNECT:READ seconds e.g. sites=5:60")
+
+    if connect <= 0 or read <= 0:
+        raise argparse.ArgumentTypeError(f"<{value}>: timeouts must be greater than 0")
+
+    return family, (connect, read)
+
+
+def cache_ttl(value: str = None) -> tuple[str, float]:
+    """
+    Parse --cache-ttl value
+    :param value: KIND=SECONDS e.g. http_loadbalancers=600
+    :return: collection name or "default" and ttl in seconds
+    """
+
+    kind, _, ttl = value.partition("=")
+
+    try:
+        seconds = float(ttl)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"<{value}>: ttl must be given as KIND=SECONDS e.g. http_loadbalancers=600 or default=60")
+
+    if not kind or seconds < 0:
+        raise argparse.ArgumentTypeError(f"<{value}>: ttl must be given as KIND=SECONDS with SECONDS >= 0")
+
+    return kind, seconds
+
+
 def main():
     # Create the parser
     parser = argparse.ArgumentParser(description="Get F5 XC Sites command line arguments")
@@ -31,8 +91,52 @@ def main():
     parser.add_argument('-n', '--namespace', type=str, help='namespace (not setting this option will process all namespaces)', required=False, default="")
     parser.add_argument('-q', '--query', help='run site query', action='store_true')
     parser.add_argument('-s', '--site', type=str, help='site to be processed', required=False, default="")
-    parser.add_argument('-t', '--token', type=str, help='F5 XC API Token', required=False, default="")
+    parser.add_argument('-t', '--token', type=str, help='F5 XC API Token. Several tokens of the same tenant can be given comma separated to spread requests across them', required=False, default="")
     parser.add_argument('-w', '--workers', type=int, help='maximum number of worker for concurrent processing (default 10)', required=False, default=10)
+    parser.add_argument('--session-mode', type=str, help='per worker thread sessions or one shared session (default thread)', required=False, default="thread", choices=["thread", "shared"])
+    parser.add_argument('--transport', type=str, help='http transport backend. httpx and http2 send requests from the event loop without a thread per request and need '
+                                                      'httpx / httpx[http2] installed (default requests)', required=False, default="requests", choices=c.TRANSPORTS)
+    parser.add_argument('--prewarm', type=int, help='number of keep-alive connections to open before querying (default 0)', required=False, default=0)
+    parser.add_argument('--rate-limit', type=float, help='maximum requests per second sent per api token (default 0 = unlimited)', required=False, default=0)
+    parser.add_argument('--burst', type=int, help='maximum number of requests sent back to back (default number of workers)', required=False, default=None)
+    parser.add_argument('--retries', type=int, help='number of retries for throttled or failed requests (default 3)', required=False, default=3)
+    parser.add_argument('--adaptive', help='adapt concurrency per endpoint family starting at --workers', action='store_true')
+    parser.add_argument('--max-workers', type=int, help='upper bound of concurrency in adaptive mode (default 4 x workers)', required=False, default=None)
+    parser.add_argument('--max-pending', type=int, help='maximum number of requests outstanding per processor fan-out (default 4 x workers)', required=False, default=None)
+    parser.add_argument('--timeout', type=timeout, help='connect and read timeout in seconds per endpoint family as FAMILY=CONNECT:READ e.g. sites=5:60 or default=5:30. Can be repeated', required=False, action='append', default=[])
+    parser.add_argument('--hedge', type=float, help='maximum ratio of slow requests to duplicate after p95 latency of their endpoint family e.g. 0.05 (default 0 = disabled)', required=False, default=0)
+    parser.add_argument('--breaker-threshold', type=int, help='consecutive failures after which requests to a collection in a namespace are skipped (default 5, 0 = disabled)', required=False, default=5)
+    parser.add_argument('--breaker-cooldown', type=float, help='seconds until a skipped collection is probed again (default 30)', required=False, default=30)
+    parser.add_argument('--bulk', help='fetch full objects with list requests instead of one request per object', action='store_true')
+    parser.add_argument('--cache-dir', type=str, help='directory of persistent response cache (not setting this option disables caching)', required=False, default="")
+    parser.add_argument('--cache-size', type=int, help='maximum size of response cache in MB (default 512)', required=False, default=512)
+    parser.add_argument('--cache-ttl', type=cache_ttl, help='seconds cached responses are used without revalidation as KIND=SECONDS e.g. http_loadbalancers=600 or default=60. Can be repeated', required=False, action='append', default=[])
+    parser.add_argument('--previous', type=str, help='previous json file. Objects which referred to --site in it are fetched first, lists are only read to catch new references', required=False, default="")
+    parser.add_argument('--incremental', help='refresh data of previous run read from --file. Only objects changed since are queried. Implies --bulk', action='store_true')
+    parser.add_argument('--watch', type=float, help='run query every WATCH seconds and rewrite --file and --inventory-file-csv if they changed (default 0 = run once)', required=False, default=0)
+    parser.add_argument('--watch-jitter', type=float, help='maximum deviation of watch interval as ratio of interval (default 0.1)', required=False, default=0.1)
+    parser.add_argument('--watch-cycles', type=int, help='number of watch runs (default 0 = until interrupted)', required=False, default=0)
+    parser.add_argument('--journal', type=str, nargs='?', const="", help='record progress of a query in a journal file (default FILE.journal)', required=False, default=None)
+    parser.add_argument('--resume', help='resume interrupted query from journal. Responses and processors recorded are not queried again. Implies --journal', action='store_true')
+    parser.add_argument('--coordinator', type=str, help='run namespace scoped processors (lb, proxy, originpool) on workers sharing this queue directory', required=False, default="")
+    parser.add_argument('--worker', type=str, help='run as worker processing partitions queued in this directory by a coordinator', required=False, default="")
+    parser.add_argument('--worker-idle', type=float, help='seconds a worker waits for partitions before it exits (default 0 = until interrupted)', required=False, default=0)
+    parser.add_argument('--partitions', type=int, help='number of partitions namespaces are split into by coordinator (default 8)', required=False, default=c.PARTITION_COUNT)
+    parser.add_argument('--partition-timeout', type=float, help='seconds coordinator waits for workers before running remaining partitions itself (default 600)', required=False, default=c.PARTITION_TIMEOUT)
+    parser.add_argument('--partition-claim-wait', type=float, help='seconds after which coordinator runs partitions no worker claimed itself (default 10)', required=False,
+                        default=c.PARTITION_CLAIM_WAIT)
+    parser.add_argument('--tenant', type=str, help='query tenant given as URL=TOKEN instead of --apiurl and --token. Can be repeated to query several tenants concurrently within --workers. '
+                                                   'Every tenant is written to FILE-TENANT.json', required=False, action='append', default=[])
+    parser.add_argument('--tenant-index', type=str, help='write index of all tenants queried with --tenant to this file', required=False, default="")
+    parser.add_argument('--time-budget', type=float, help='seconds after which outstanding requests are cancelled and data collected so far is written. '
+                                                         'Incomplete sections are listed in key "sections" (default 0 = unlimited)', required=False, default=0)
+    parser.add_argument('--processors', type=str, help=f'comma separated processors to run out of {",".join(c.API_PROCESSORS)}. Processors they depend on run as well (default all)', required=False, default="")
+    parser.add_argument('--skip-processors', type=str, help='comma separated processors not to run unless another processor depends on them', required=False, default="")
+    parser.add_argument('--site-processors', type=str, help=f'comma separated site object processors to run out of {",".join(c.SITE_OBJECT_PROCESSORS)} '
+                                                           f'(default all if site processor has been selected else none)', required=False, default="")
+    parser.add_argument('--skip-site-processors', type=str, help='comma separated site object processors not to run', required=False, default="")
+    parser.add_argument('--plan', help='send list requests only and predict detail requests, bytes and wall time of a query per processor from the profile of the last query (FILE.profile)', action='store_true')
+    parser.add_argument('--plan-file', type=str, help='write plan to this json file', required=False, default="")
     parser.add_argument('--old-site', help='old site name to compare with', required=False, default="")
     parser.add_argument('--new-site', help='new site name to compare with', required=False, default="")
     parser.add_argument('--old-site-file', help='new site file to compare with', required=False, default="")
@@ -57,6 +161,8 @@ def main():
     if not isinstance(level, int):
         raise ValueError('Invalid log level: %s' % os.environ.get('GET-SITES-LOG-LEVEL').upper())
 
+    # Messages below level are dropped by the logger already, debug bodies are not decoded unless logged
+    logger.setLevel(level=level)
     formatter = ColoredFormatter('%(asctime)s - %(levelname)s - %(message)s')
 
     if args.log_stdout:
@@ -74,7 +180,7 @@ def main():
     api_url = args.apiurl if args.apiurl else os.environ.get('f5xc_api_url')
     api_token = args.token if args.token else os.environ.get('f5xc_api_token')
 
-    if not api_url or not api_token:
+    if not args.tenant and (not api_url or not api_token):
         logger.info("\n\n\n")
         logger.info(38 * "#")
         logger.info("api_url and api_token must be provided")
@@ -84,12 +190,83 @@ def main():
         sys.exit(1)
 
     logger.info(f"Application {os.path.basename(__file__)} started...")
+    journal = None
+
+    if args.query and (args.journal is not None or args.resume) and (args.journal or args.file not in ['stdout', '-', '']):
+        journal = args.journal if args.journal else args.file + c.JOURNAL_SUFFIX
+
     start_time = time.perf_counter()
-    q = Api(logger=logger, api_url=api_url, api_token=api_token, namespace=args.namespace, site=args.site, workers=args.workers)
+    options = dict(namespace=args.namespace, site=args.site, session_mode=args.session_mode, prewarm=args.prewarm, rate_limit=args.rate_limit, burst=args.burst,
+                   retries=args.retries, adaptive=args.adaptive, max_workers=args.max_workers, cache_dir=args.cache_dir, cache_size=args.cache_size * 1024 * 1024,
+                   cache_ttl=dict(args.cache_ttl), bulk=args.bulk,
+                   max_pending=args.max_pending, timeouts=dict(args.timeout),
+                   hedge=args.hedge, breaker_threshold=args.breaker_threshold, breaker_cooldown=args.breaker_cooldown, transport=args.transport,
+                   time_budget=args.time_budget, processors=split(args.processors), skip_processors=split(args.skip_processors),
+                   site_processors=split(args.site_processors), skip_site_processors=split(args.skip_site_processors))
+
+    if args.tenant and not (args.query or args.plan):
+        logger.info("--tenant needs -q or --plan")
+        logger.info(f"Application {os.path.basename(__file__)} finished")
+        return
+
+    if args.tenant:
+        tenants = list()
+
+        for item in args.tenant:
+            url, token = item.split("=", 1)
+            name = tenant_name(url)
+            name = f"{name}-{len(tenants)}" if name in [tenant["name"] for tenant in tenants] else name
+            tenants.append({"name": name, "api_url": url, "api_token": token, "file": tenant_file(args.file, name)})
+
+        t = Tenants(logger=logger, tenants=tenants, workers=args.workers, options=options, journal=args.journal is not None or args.resume, resume=args.resume, incremental=args.incremental,
+                    plan=args.plan)
+        t.run()
+        t.write_index(args.tenant_index) if args.tenant_index else None
+        logger.info(f'Query time: {int(time.perf_counter() - start_time)} seconds for {len(tenants)} tenants with {args.workers} workers')
+        logger.info(f"Application {os.path.basename(__file__)} finished")
+        return
+
+    if args.plan:
+        # Lists are read without full objects. Bulk mode is predicted only
+        try:
+            q = Api(logger=logger, api_url=api_url, api_token=api_token, workers=args.workers, **dict(options, bulk=False))
+        except (NamespaceError, ValueError) as exc:
+            logger.info(f"Plan failed: {exc}")
+            sys.exit(1)
+        plan = q.plan(bulk=args.bulk or args.incremental, profile=args.file + c.PROFILE_SUFFIX)
+        q.write_string_file(args.plan_file, json.dumps(plan, indent=2)) if args.plan_file else None
+        q.close()
+        logger.info(f'Plan time: {int(time.perf_counter() - start_time)} seconds')
+        logger.info(f"Application {os.path.basename(__file__)} finished")
+        return
+
+    try:
+        q = Api(logger=logger, api_url=api_url, api_token=api_token, workers=args.workers, previous=args.previous,
+                incremental=args.file if args.incremental else None, journal=journal, resume=args.resume,
+                coordinator=Coordinator(queue=DirectoryQueue(args.coordinator), partitions=args.partitions, timeout=args.partition_timeout,
+                                        claim_wait=args.partition_claim_wait, logger=logger) if args.coordinator else None,
+                **options)
+    except (NamespaceError, ValueError) as exc:
+        logger.info(f"Query failed: {exc}")
+        sys.exit(1)
+
+    if args.worker:
+        try:
+            processed = Worker(queue=DirectoryQueue(args.worker), process=q.run_partition, logger=logger).serve(idle=args.worker_idle)
+            logger.info(f"Worker processed {processed} partitions")
+        except KeyboardInterrupt:
+            logger.info("Worker interrupted")
 
-    if args.query:
+    if args.query and args.watch:
+        try:
+            written = q.watch(args.file, interval=args.watch, jitter=args.watch_jitter, cycles=args.watch_cycles, inventory_csv=args.inventory_file_csv)
+            logger.info(f"Watch finished. Output changed {written} times")
+        except KeyboardInterrupt:
+            logger.info("Watch interrupted")
+    elif args.query:
         q.run()
         q.write_json_file(args.file)
+        q.write_profile(args.file + c.PROFILE_SUFFIX) if args.file not in ['stdout', '-', ''] else None
         end_time = time.perf_counter()
         elapsed_time = end_time - start_time
         logger.info(f'Query time: {int(elapsed_time)} seconds with {args.workers} workers')
@@ -107,6 +284,7 @@ def main():
     if data:
         q.write_string_file(args.inventory_file_csv, data.get_csv_string()) if args.inventory_file_csv and data else None
         logger.info(f"\n\n{data.get_formatted_string('text')}\n") if args.inventory_table else None
+    q.close()
     logger.info(f"Application {os.path.basename(__file__)} finished")
 
 
@@ -2,11 +2,15 @@
 authors: cklewar
 """
 
+import copy
 import json
 import logging
 import os
+import random
 import re
-import sys
+import tempfile
+import threading
+import time
 from logging import Logger
 from typing import Any
 
@@ -17,7 +21,25 @@ from prettytable import PrettyTable, TableStyle
 from requests import Response
 
 import lib.const as c
+from lib.cache import ResponseCache
+from lib.distributed import Coordinator
+from lib.engine import Engine
+from lib.journal import Journal
 from lib.loader import load_module
+from lib.planner import Planner
+from lib.scheduler import Scheduler, merge
+from lib.snapshot import Snapshot
+from lib.stream import debug_body, iter_items
+
+
+class NamespaceError(Exception):
+    """
+    Raised when the list of namespaces can not be read or the given namespace does not exist.
+    """
+
+    def __init__(self, namespace: str = None):
+        super().__init__(f"validating namespace <{namespace}> failed" if namespace else "reading namespaces failed")
+        self.namespace = namespace
 
 
 class Api(object):
@@ -33,6 +55,8 @@ class Api(object):
         F5XC API token
     _session: request.Session
         http session
+    _engine: Engine
+        shared fetch engine. All processors run their requests through this engine
     _workers: int
        maximum number of workers
     _data: dict
@@ -89,7 +113,7 @@ class Api(object):
                                 metadata
                                 system_metadata
         namespaces [list of namespace names]
-        failed_sites { <site_name>: <site_status> } e.g. "ce-ga-singlenic-azure": "FAILED"
+        failed_sites { <site_name>: <site_status> } e.g. "ce-ga-singlenic-azure": "FAILED". Site filtered runs hold the named site only
 
     Methods
     -------
@@ -99,25 +123,81 @@ class Api(object):
         http get request
     read_json_file(name: str = None)
         read json data from file name
+    discover_namespaces(namespace: str = None)
+        read namespaces to be processed
+    previous_references(name: str = None)
+        objects which referred to site in a previous get-sites.json
     write_string_file(name=None, data=None)
         writes data string to file
     write_json_file(name=None)
         writes data to json file
+    write_profile(name: str = None)
+        writes request profile of last run to json file
     run()
         run the specific processor and build ds
+    plan(bulk: bool = False, profile: str = None)
+        predict requests, bytes and wall time of a run sending list requests only
+    resolve_processors(processors: list = None, skip: list = None)
+        resolve processors and site object processors to run including their requirements
+    run_partition(task: dict = None)
+        run namespace scoped processors for a partition dispatched by a coordinator
+    reset()
+        clear data to run again on the same session
+    watch(name: str = None, interval: float = 0)
+        run again every interval seconds and write changed data to file
+    changes(old: dict = None, new: dict = None)
+        summarize differences between two runs
     compare()
         compare any previous data set with current data set
+    close()
+        stop shared fetch engine
     """
 
-    def __init__(self, logger: Logger = None, api_url: str = None, api_token: str = None, namespace: str = None, site: str = None, workers: int = 10):
+    def __init__(self, logger: Logger = None, api_url: str = None, api_token: str = None, namespace: str = None, site: str = None, workers: int = 10,
+                 session_mode: str = c.SESSION_MODE_THREAD, prewarm: int = 0, rate_limit: float = 0, burst: int = None, retries: int = 3,
+                 adaptive: bool = False, max_workers: int = None, cache_dir: str = None, cache_size: int = c.CACHE_MAX_BYTES,
+                 cache_ttl: dict = None, bulk: bool = False, max_pending: int = None, timeouts: dict = None, hedge: float = 0,
+                 breaker_threshold: int = c.BREAKER_THRESHOLD, breaker_cooldown: float = c.BREAKER_COOLDOWN, transport: str = c.TRANSPORT_REQUESTS,
+                 previous: str = None, incremental: str = None, journal: str = None, resume: bool = False, coordinator: Coordinator = None,
+                 budget: threading.Semaphore = None, time_budget: float = 0, processors: list = None, skip_processors: list = None,
+                 site_processors: list = None, skip_site_processors: list = None):
         """
         Initialize API object. Stores session state and allows to run data processing methods.
 
         :param api_url: F5XC API URL
-        :param api_token: F5XC API token
+        :param api_token: F5XC API token. Several tokens of the same tenant can be given comma separated to spread requests across them
         :param namespace: F5XC namespace
         :param site: F5XC site
         :param workers: Maximum number of workers for concurrent processing
+        :param session_mode: per worker thread sessions ("thread") or one shared session ("shared")
+        :param prewarm: number of keep-alive connections to open before the first processor runs
+        :param rate_limit: maximum requests per second sent per api token. 0 disables rate limiting
+        :param burst: maximum number of requests sent back to back
+        :param retries: number of retries for throttled or failed requests
+        :param adaptive: adapt concurrency per endpoint family starting at workers
+        :param max_workers: upper bound of concurrency in adaptive mode
+        :param cache_dir: directory of persistent response cache. Not setting this disables caching
+        :param cache_size: maximum size of response cache in bytes
+        :param cache_ttl: object kind -> seconds cached responses are used without revalidation. Key "default" sets default ttl
+        :param bulk: fetch full objects with list requests instead of one request per object
+        :param max_pending: maximum number of requests outstanding per processor fan-out
+        :param timeouts: endpoint family -> (connect, read) timeout in seconds
+        :param hedge: maximum ratio of requests hedged after p95 latency of their endpoint family. 0 disables hedging
+        :param breaker_threshold: consecutive failures opening circuit breaker of a collection in a namespace. 0 disables breakers
+        :param breaker_cooldown: seconds until an open circuit breaker sends a probe request
+        :param transport: http transport backend. One of c.TRANSPORTS
+        :param previous: previous get-sites.json. Objects which referred to site last time are fetched first
+        :param incremental: get-sites.json of previous run. Only objects changed since are queried. Implies bulk
+        :param journal: journal file recording fetched responses and finished processors. None disables journaling
+        :param resume: continue run recorded in journal. Recorded responses and processor results are not queried again
+        :param coordinator: run namespace scoped processors (c.PARTITION_PROCESSORS) on workers. None runs all processors locally
+        :param budget: concurrency budget shared with other tenants collected in the same process
+        :param time_budget: seconds after which outstanding requests are cancelled and run finishes with what it has. 0 disables
+        :param processors: processors to run out of c.API_PROCESSORS. Processors they require are added. None runs all
+        :param skip_processors: processors not to run unless required by another processor
+        :param site_processors: site object processors to run out of c.SITE_OBJECT_PROCESSORS. None runs all if site processor
+                                has been selected and none if it only runs as requirement of other processors
+        :param skip_site_processors: site object processors not to run unless required by another site object processor
         """
 
         self._logger = logger
@@ -127,34 +207,47 @@ class Api(object):
         self._api_url = api_url
         self._api_token = api_token
         self._site = site
+        self._namespace = namespace
+        self._previous = previous
+        self._coordinator = coordinator
+        self._time_budget = time_budget
+        self._rate_limit = rate_limit
+        self._interrupted = False
+        self._ran = False
+        self._processors, self._site_processors = self.resolve_processors(processors=processors, skip=skip_processors, site_processors=site_processors,
+                                                                          skip_site=skip_site_processors)
+        self._snapshot = Snapshot(data=self.read_json_file(incremental)) if incremental else None
+        bulk = bulk or bool(incremental)
         self._workers = workers
         self._session = requests.Session()
-        self._session.headers.update({"content-type": "application/json", "Authorization": f"APIToken {api_token}"})
+        tokens = [token.strip() for token in api_token.split(",") if token.strip()] if api_token else list()
+
+        if not tokens:
+            raise ValueError("api_token must be given")
+
+        self._session.headers.update({"content-type": "application/json", "Authorization": f"APIToken {tokens[0]}"})
+        self._journal = Journal(path=journal, run={"api_url": api_url, "namespace": namespace, "site": site}, resume=resume,
+                                logger=logger) if journal else None
+        cache_ttl = dict(cache_ttl) if cache_ttl else dict()
+        self._cache = ResponseCache(path=cache_dir, max_bytes=cache_size, ttl=cache_ttl.pop("default", c.CACHE_TTL_DEFAULT), ttl_by_kind=cache_ttl,
+                                    logger=logger) if cache_dir else None
+        self._engine = Engine(session=self._session, workers=workers, logger=logger, session_mode=session_mode, rate_limit=rate_limit, burst=burst, retries=retries,
+                              adaptive=adaptive, max_workers=max_workers, cache=self._cache, bulk=bulk,
+                              max_pending=max_pending, timeouts=timeouts, hedge=hedge,
+                              breaker_threshold=breaker_threshold, breaker_cooldown=breaker_cooldown, transport=transport,
+                              tokens=tokens if len(tokens) > 1 else None, journal=self._journal, budget=budget)
         self.must_break = False
 
         self.logger.info(f"API URL: {self.api_url} -- Processing Namespace: {namespace if namespace else 'ALL'}")
 
-        if not namespace:
-            # get list of all namespaces
-            response = self.get(self.build_url(c.URI_F5XC_NAMESPACE))
-
-            if response:
-                self.logger.debug(json.dumps(response.json(), indent=2))
-                namespaces = response.json()
-                self._data['namespaces'] = [item['name'] for item in namespaces['items']]
-                self.logger.info(f"Processing {len(self.data['namespaces'])} available namespaces")
-            else:
-                sys.exit(1)
-
-        else:
-            # check api url and validate given namespace
-            response = self.get(self.build_url(f"{c.URI_F5XC_NAMESPACE}/{namespace}"))
+        if prewarm:
+            self.engine.prewarm(self.build_url(c.URI_F5XC_NAMESPACE), prewarm)
 
-            if response:
-                self.logger.debug(json.dumps(response.json(), indent=2))
-                self._data['namespaces'] = [namespace]
-            else:
-                sys.exit(1)
+        try:
+            self.discover_namespaces(namespace)
+        except NamespaceError:
+            self.close()
+            raise
 
     @property
     def logger(self):
@@ -180,6 +273,10 @@ class Api(object):
     def session(self):
         return self._session
 
+    @property
+    def engine(self):
+        return self._engine
+
     @property
     def workers(self):
         return self._workers
@@ -198,15 +295,7 @@ class Api(object):
         :param url: Actual URL to run GET request on
         :return: requests.Response
         """
-        r = self.session.get(url)
-
-        if 200 != r.status_code:
-            if r.status_code == 401 or r.status_code == 403:
-                self.logger.info("get failed for {} with authentication error: <{}>".format(url, r.status_code))
-            self.logger.debug("get failed for {} with {}".format(url, r.status_code))
-            return False
-
-        return r if r else False
+        return self.engine.get(url)
 
     def read_json_file(self, name: str = None) -> Any | None:
         """
@@ -223,39 +312,136 @@ class Api(object):
             self.logger.info(f"Reading file {name} failed with error: {e}")
             return None
 
-    def write_json_file(self, name: str = None):
+    def previous_references(self, name: str = None) -> dict | None:
+        """
+        Read objects which referred to the site given with -s from a previous get-sites.json. References are returned in the
+        form of referring objects returned by the api: site type -> site name -> list of {"kind", "namespace", "name"}.
+        :param name: file name of previous snapshot
+        :return: references by site type or None if file can not be read
+        """
+
+        snapshot = self.read_json_file(name)
+
+        if not snapshot:
+            return None
+
+        previous = dict()
+
+        for site_type in c.F5XC_SITE_TYPES:
+            if site_type not in snapshot:
+                continue
+
+            site = snapshot[site_type].get(self.site, dict())
+            refs = list()
+
+            for namespace, objects in site.get("namespaces", dict()).items():
+                for lb_type, lbs in objects.get("loadbalancer", dict()).items():
+                    refs.extend({"kind": f"{lb_type}_loadbalancer", "namespace": namespace, "name": lb} for lb in lbs)
+
+                for key, kind in c.SNAPSHOT_NAMESPACE_KINDS.items():
+                    refs.extend({"kind": kind, "namespace": namespace, "name": obj} for obj in objects.get(key, dict()))
+
+            refs.extend({"kind": "bgp", "namespace": c.F5XC_NAMESPACE_SYSTEM, "name": bgp} for bgp in site.get("bgp", dict()))
+            previous[site_type] = {self.site: refs}
+            self.logger.info(f"{len(refs)} objects referred to {site_type} <{self.site}> in {name}")
+
+        return previous
+
+    @staticmethod
+    def _replace_file(name: str = None, data: str = None, only_changed: bool = False) -> bool:
+        """
+        Atomically replace file content. Data is written to a temporary file in the same directory which is renamed to name,
+        so readers never see a partially written file.
+        :param name: the file name
+        :param data: str data to write to file
+        :param only_changed: leave file untouched if it already holds data
+        :return: True if file has been written
+        """
+
+        if only_changed and os.path.exists(name):
+            with open(name, 'r') as fd:
+                if fd.read() == data:
+                    return False
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(name)), prefix=f".{os.path.basename(name)}.")
+
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(data)
+            os.replace(tmp, name)
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+        return True
+
+    def write_json_file(self, name: str = None, only_changed: bool = False) -> bool:
         """
         Write json to file
         :param name: The file name to write json into
-        :return:
+        :param only_changed: leave file untouched if content did not change. Keys are sorted, so content does not depend on
+                             the order processors finished in
+        :return: True if file has been written
         """
         if name not in ['stdout', '-', '']:
             try:
-                with open(name, 'w') as fd:
-                    fd.write(json.dumps(self.data, indent=2))
+                written = self._replace_file(name, json.dumps(self.data, indent=2, sort_keys=only_changed), only_changed=only_changed)
+
+                # Data reached disk. Nothing left to resume unless sections are incomplete
+                if self._journal and all(self.data.get(c.SECTIONS_KEY, dict()).values()):
+                    self._journal.clear()
+
+                if written:
                     self.logger.info(f"{len(self.data['site'])} {'sites' if len(self.data['site']) > 1 else 'site'} and {len(self.data['virtual_site'])} virtual {'sites' if len(self.data['virtual_site']) > 1 else 'site'} written to {name}")
+                    return True
+                self.logger.info(f"{name} unchanged")
             except OSError as e:
                 self.logger.info(f"Writing file {name} failed with error: {e}")
         else:
             self.logger.info(json.dumps(self.data, indent=2))
+            return True
 
-    def write_string_file(self, name: str = None, data: str = None):
+        return False
+
+    def write_profile(self, name: str = None) -> bool:
+        """
+        Write requests, bytes and seconds per collection of the last run to json file. Read by plans of later runs.
+        :param name: profile file
+        :return: True if file has been written
+        """
+
+        try:
+            self._replace_file(name, json.dumps(self.engine.profile, indent=2))
+            self.logger.info(f"Request profile of {len(self.engine.profile)} collections written to {name}")
+            return True
+        except OSError as e:
+            self.logger.info(f"Writing file {name} failed with error: {e}")
+
+        return False
+
+    def write_string_file(self, name: str = None, data: str = None, only_changed: bool = False) -> bool:
         """
         Write string to file
         :param name: the file name
         :param data: str data to write to file
-        :return:
+        :param only_changed: leave file untouched if content did not change
+        :return: True if file has been written
         """
 
         if name not in ['stdout', '-', '']:
             try:
-                with open(name, 'w') as fd:
-                    fd.write(data)
+                if self._replace_file(name, data, only_changed=only_changed):
                     self.logger.info(f"wrote {len(data.encode('utf-8'))} bytes to file {name}")
+                    return True
+                self.logger.info(f"{name} unchanged")
             except OSError as e:
                 self.logger.info(f"Writing file {name} failed with error: {e}")
         else:
             self.logger.info(json.dumps(self.data, indent=2))
+            return True
+
+        return False
 
     def build_inventory(self, json_file: str = None) -> PrettyTable | None:
         """
@@ -569,17 +755,418 @@ class Api(object):
         - process_origin_pools for each namespace
         - process site labels only if referenced by a load balancer/ origin pool / proxy
         - process site details to get hw info
+        Processors run concurrently as soon as everything listed in their requires has been provided by other processors.
         :return: processed data
         """
 
-        _processors = dict()
-        _processor = None
+        if self._time_budget:
+            self.engine.set_deadline(self._time_budget)
+
+        scheduler = Scheduler(logger=self.logger)
+        unfiltered = list()
+        available = ["namespaces"]
+        restored = dict(self._journal.processors) if self._journal else dict()
+        remote = dict()
+
+        # Results of processors finished by an interrupted run are merged in the order they finished
+        for processor, data in restored.items():
+            self.logger.info(f"Restoring processor <{processor}> from journal...")
+            merge(self.data, data)
+
+        for processor in self._processors:
+            cls = self._load_processor(processor)
+
+            if processor in restored:
+                available.extend(cls.provides)
+                continue
+
+            if not cls.site_filter:
+                unfiltered.append(processor)
+
+            if self._coordinator and processor in c.PARTITION_PROCESSORS:
+                remote[processor] = cls
+                continue
+
+            scheduler.add(name=processor, requires=cls.requires, provides=cls.provides, prepare=lambda cls=cls: cls.workspace(self.data),
+                          func=lambda workspace, cls=cls: self._run_processor(cls, workspace=workspace, site=self.site))
+
+        if remote:
+            # Namespace scoped processors run on workers as one task. Tenant wide processors keep running locally meanwhile
+            requires = set().union(*[cls.requires for cls in remote.values()])
+            scheduler.add(name=c.PARTITION_TASK, requires=requires, provides=set().union(*[cls.provides for cls in remote.values()]),
+                          func=lambda: self._dispatch(processors=list(remote), requires=requires))
+
+        if self.site and unfiltered:
+            self.logger.info(f"Site filter <{self.site}> not supported by processors {', '.join(unfiltered)}. These list all objects")
+
+        if self.site and self._previous:
+            previous = self.previous_references(self._previous)
+
+            if previous:
+                self.data["previous"] = previous
+
+        # Every processor works on its own workspace taken from data when it starts. Only what it produced is merged back,
+        # before dependent processors start.
+        scheduler.run(available=available, complete=self._complete, interrupt=self._interrupt)
+        # Objects referring to the site given with -s are only used to narrow requests
+        self.data.pop("referring", None)
+        self.data.pop("previous", None)
+
+        if self.engine.deadline is not None or self.engine.expired:
+            # Processors finished before deadline or interrupt did not record their section
+            sections = self.data.setdefault(c.SECTIONS_KEY, dict())
+
+            for processor in self._processors:
+                sections.setdefault(processor, True)
+
+            incomplete = [processor for processor, complete in sections.items() if not complete]
+            self.logger.info(f"{'Interrupted' if self._interrupted else 'Time budget'}: {len(self.engine.cancelled)} requests cancelled. "
+                             f"Incomplete sections: {', '.join(incomplete) if incomplete else 'none'}")
 
-        for index, processor in enumerate(c.API_PROCESSORS):
-            self.logger.info(f"Loading processor <{processor}>...")
-            package = load_module(c.PROCESSOR_PACKAGE, processor.lower())
-            _processor = getattr(package, processor.capitalize())(session=self.session, api_url=self.api_url, data=self.data, site=self.site, workers=self.workers, logger=self.logger)
-            _processors[processor] = _processor
-            _processor.run()
+        if self.engine.degraded:
+            # Parts of the inventory skipped because of open circuit breakers
+            self.data["degraded"] = self.engine.degraded
+            self.logger.info(f"Degraded collections: {', '.join(f'{namespace}/{collection}' for namespace, collections in self.engine.degraded.items() for collection in collections)}")
+
+        if self._snapshot is not None:
+            stats = self._snapshot.stats
+            self.logger.info(f"Incremental run: {stats['reused']} unchanged objects served from snapshot, {stats['skipped']} unchanged objects skipped, "
+                             f"{stats['sites']} unchanged sites reused")
+
+        if self._journal:
+            self.logger.info(f"Journal: {self._journal.stats['replayed']} responses replayed, {self._journal.stats['recorded']} responses recorded, "
+                             f"{len(restored)} processors restored")
+
+        if self.engine.dropped:
+            self.logger.info(f"Dropped {len(self.engine.dropped)} requests after retries: {self.engine.dropped}")
+
+        self.engine.report()
+        self._ran = True
 
         return self.data
+
+    def plan(self, bulk: bool = False, profile: str = None) -> dict:
+        """
+        Predict requests, bytes and wall time of a run with the selected processors at the configured workers and rate limit.
+        Only list requests are sent, no object is fetched. Site filter and incremental mode are not taken into account,
+        plan covers a full run. Api should be created without bulk, so lists are read without full objects.
+        :param bulk: predict run fetching full objects with list requests
+        :param profile: profile file written by the last run. Predicts bytes and latency per collection
+        :return: plan (see Planner)
+        """
+
+        last = None
+
+        if profile and os.path.exists(profile):
+            try:
+                with open(profile, "r") as fd:
+                    last = json.load(fp=fd)
+            except (OSError, ValueError) as e:
+                self.logger.info(f"Reading file {profile} failed with error: {e}")
+
+        planner = Planner(engine=self.engine, api_url=self.api_url, namespaces=self.data["namespaces"],
+                          processors={processor: self._load_processor(processor) for processor in self._processors}, site_processors=self._site_processors,
+                          bulk=bulk, profile=last, workers=self.workers, rate=self._rate_limit * len(self.engine.credentials.credentials), logger=self.logger)
+        plan = planner.run()
+        self.logger.info(f"\n\n{planner.table().get_formatted_string('text')}\n")
+
+        return plan
+
+    def _complete(self, name: str = None, data: dict = None):
+        """
+        Merge result of finished processor into data and record it in journal.
+        :param name: processor name
+        :param data: processor result
+        :return:
+        """
+
+        merge(self.data, data)
+
+        # Results cut short by deadline or interrupt are run again on resume
+        if self._journal and data.get(c.SECTIONS_KEY, dict()).get(name, True):
+            self._journal.milestone(name, data)
+
+    def _interrupt(self):
+        """
+        Cancel outstanding requests on Ctrl-C. Processors finish with data collected so far.
+        :return:
+        """
+
+        self._interrupted = True
+        self.engine.expire()
+
+    def discover_namespaces(self, namespace: str = None):
+        """
+        Get list of all namespaces or validate given namespace and store namespaces in data.
+        :param namespace: namespace to validate. Not set lists all namespaces
+        :raises NamespaceError: namespaces could not be read or namespace does not exist
+        :return:
+        """
+
+        if not namespace:
+            # get list of all namespaces
+            response = self.get(self.build_url(c.URI_F5XC_NAMESPACE))
+
+            if response:
+                debug_body(self.logger, response)
+                self._data['namespaces'] = [item['name'] for item in iter_items(response)]
+                self.logger.info(f"Processing {len(self.data['namespaces'])} available namespaces")
+                return
+
+        else:
+            # check api url and validate given namespace
+            response = self.get(self.build_url(f"{c.URI_F5XC_NAMESPACE}/{namespace}"))
+
+            if response:
+                debug_body(self.logger, response)
+                self._data['namespaces'] = [namespace]
+                return
+
+        raise NamespaceError(namespace)
+
+    def reset(self):
+        """
+        Prepare next run on the same session and engine. Data is cleared and namespaces are read again. Previous namespaces
+        are kept if reading them fails.
+        :return:
+        """
+
+        namespaces = self._data.get('namespaces', list())
+        self._interrupted = False
+        self._data = dict()
+        for key in c.F5XC_SITE_TYPES:
+            self._data[key] = dict()
+        self._data['namespaces'] = namespaces
+        self.engine.reset()
+
+        if self._journal:
+            self._journal.clear()
+
+        try:
+            self.discover_namespaces(self._namespace)
+        except NamespaceError as exc:
+            self.logger.info(f"{str(exc).capitalize()}. Keeping {len(namespaces)} namespaces of previous run")
+
+    def changes(self, old: dict = None, new: dict = None) -> str:
+        """
+        Compact summary of differences between two data sets. Lists added (+), removed (-) and changed (~) sites, virtual sites
+        and failed sites.
+        :param old: data of previous run
+        :param new: data of current run
+        :return: summary string
+        """
+
+        parts = list()
+
+        for key in c.F5XC_SITE_TYPES + ["failed"]:
+            _old = old.get(key, dict())
+            _new = new.get(key, dict())
+            items = [f"+{name}" for name in sorted(_new.keys() - _old.keys())] + [f"-{name}" for name in sorted(_old.keys() - _new.keys())] + \
+                    [f"~{name}" for name in sorted(_new.keys() & _old.keys()) if _new[name] != _old[name]]
+
+            if items:
+                more = f" (+{len(items) - c.WATCH_SUMMARY_MAX_ITEMS} more)" if len(items) > c.WATCH_SUMMARY_MAX_ITEMS else ""
+                parts.append(f"{key}: {' '.join(items[:c.WATCH_SUMMARY_MAX_ITEMS])}{more}")
+
+        return "; ".join(parts) if parts else "no changes"
+
+    def watch(self, name: str = None, interval: float = 0, jitter: float = c.WATCH_JITTER, cycles: int = 0, inventory_csv: str = None) -> int:
+        """
+        Run queries every interval seconds keeping session, connection pools, concurrency windows and circuit breakers alive.
+        Runs start interval +/- jitter seconds after the start of the previous run. Output file and inventory csv are
+        replaced atomically and only if their content changed. In incremental mode every run starts from data of the
+        previous run.
+        :param name: output json file
+        :param interval: seconds between start of two runs
+        :param jitter: maximum deviation of interval as ratio of interval e.g. 0.1
+        :param cycles: number of runs. 0 runs until interrupted
+        :param inventory_csv: inventory csv file written together with output file
+        :return: number of runs which changed output file
+        """
+
+        cycle = 0
+        written = 0
+        previous = None
+
+        while True:
+            start = time.monotonic()
+
+            # Data and responses of an earlier run are dropped, also those of a run before this watch
+            if self._ran:
+                self.reset()
+
+            self.run()
+            cycle += 1
+            self.logger.info(f"Watch cycle {cycle}: {self.changes(previous, self.data) if previous is not None else 'initial run'}")
+
+            if self.write_json_file(name, only_changed=True):
+                written += 1
+
+                if inventory_csv:
+                    table = self.build_inventory(json_file=name)
+
+                    if table:
+                        self.write_string_file(inventory_csv, table.get_csv_string(), only_changed=True)
+
+            # reset replaces data. Data of this run stays untouched
+            previous = self.data
+
+            if self._snapshot is not None:
+                self._snapshot = Snapshot(data=self.data)
+
+            if (cycles and cycle >= cycles) or self._interrupted:
+                return written
+
+            delay = interval * (1 + random.uniform(-jitter, jitter)) - (time.monotonic() - start)
+            self.logger.info(f"Next watch cycle in {max(0.0, delay):.0f}s")
+            time.sleep(max(0.0, delay))
+
+    def run_partition(self, task: dict = None) -> dict:
+        """
+        Run partition task dispatched by a coordinator. Used by workers. Responses memoized for earlier partitions are
+        released, every partition reads current data.
+        :param task: processors, site filter and data holding the namespaces of the partition
+        :return: processed data
+        """
+
+        unknown = [processor for processor in task["processors"] if processor not in c.PARTITION_PROCESSORS]
+
+        if unknown:
+            raise ValueError(f"processors {', '.join(unknown)} can not run on workers")
+
+        self.engine.reset()
+
+        return self._process(data=task["data"], processors=task["processors"], site=task["site"])
+
+    def _dispatch(self, processors: list = None, requires: set = None) -> dict:
+        """
+        Run namespace scoped processors on workers.
+        :param processors: processor names
+        :param requires: data keys required by processors
+        :return: merged data of all partitions
+        """
+
+        context = copy.deepcopy({key: self.data[key] for key in list(requires) + c.PARTITION_CONTEXT_KEYS if key in self.data and key != "namespaces"})
+
+        return self._coordinator.run(context=context, namespaces=self.data["namespaces"], processors=processors, site=self.site,
+                                     fallback=lambda task: self._process(data=task["data"], processors=task["processors"], site=task["site"]))
+
+    def _process(self, data: dict = None, processors: list = None, site: str = None) -> dict:
+        """
+        Run independent processors concurrently on workspaces of data.
+        :param data: data holding everything processors require
+        :param processors: processor names
+        :param site: site filter
+        :return: results of all processors merged
+        """
+
+        scheduler = Scheduler(logger=self.logger)
+        result = dict()
+
+        for processor in processors:
+            cls = self._load_processor(processor)
+            scheduler.add(name=processor, prepare=lambda cls=cls: cls.workspace(data),
+                          func=lambda workspace, cls=cls: self._run_processor(cls, workspace=workspace, site=site))
+
+        scheduler.run(complete=lambda name, _data: merge(result, _data))
+
+        return result
+
+    @staticmethod
+    def _requirements(selected: list = None, requires: dict = None) -> set:
+        """
+        Add everything selected names require, directly or indirectly.
+        :param selected: selected names
+        :param requires: name -> names it requires
+        :return: selected names and their requirements
+        """
+
+        resolved = set()
+        stack = list(selected)
+
+        while stack:
+            name = stack.pop()
+
+            if name not in resolved:
+                resolved.add(name)
+                stack.extend(requires.get(name, list()))
+
+        return resolved
+
+    def resolve_processors(self, processors: list = None, skip: list = None, site_processors: list = None, skip_site: list = None) -> tuple[list, list]:
+        """
+        Resolve processors and site object processors to run. Processors providing data required by selected processors are
+        added even if skipped.
+        :param processors: selected processors. None selects c.API_PROCESSORS
+        :param skip: processors left out of selection
+        :param site_processors: selected site object processors. None selects all if site processor itself has been selected
+        :param skip_site: site object processors left out of selection
+        :return: processors and site object processors to run in order of c.API_PROCESSORS and c.SITE_OBJECT_PROCESSORS
+        """
+
+        skip = skip if skip else list()
+        skip_site = skip_site if skip_site else list()
+        unknown = [name for name in (processors if processors else list()) + skip if name not in c.API_PROCESSORS] + \
+                  [name for name in (site_processors if site_processors else list()) + skip_site if name not in c.SITE_OBJECT_PROCESSORS]
+
+        if unknown:
+            raise ValueError(f"unknown processors: {', '.join(unknown)}")
+
+        classes = {name: getattr(load_module(c.PROCESSOR_PACKAGE, name), name.capitalize()) for name in c.API_PROCESSORS}
+        providers = {key: name for name, cls in classes.items() for key in cls.provides}
+        selected = [name for name in (processors if processors else c.API_PROCESSORS) if name not in skip]
+        resolved = self._requirements(selected, {name: [providers[key] for key in cls.requires if key in providers] for name, cls in classes.items()})
+        added = [name for name in c.API_PROCESSORS if name in resolved and name not in selected]
+
+        if site_processors is None:
+            site_processors = c.SITE_OBJECT_PROCESSORS if "site" in selected else list()
+
+        site_selected = [name for name in site_processors if name not in skip_site]
+        site_resolved = self._requirements(site_selected, c.SITE_OBJECT_PROCESSOR_REQUIRES)
+        site_added = [name for name in c.SITE_OBJECT_PROCESSORS if name in site_resolved and name not in site_selected]
+
+        if added or site_added:
+            self.logger.info(f"Running processors {', '.join(added + site_added)} required by selected processors")
+
+        return [name for name in c.API_PROCESSORS if name in resolved], [name for name in c.SITE_OBJECT_PROCESSORS if name in site_resolved]
+
+    def _load_processor(self, name: str = None) -> type:
+        self.logger.info(f"Loading processor <{name}>...")
+        package = load_module(c.PROCESSOR_PACKAGE, name.lower())
+
+        return getattr(package, name.capitalize())
+
+    def _run_processor(self, cls: type = None, workspace: dict = None, site: str = None) -> dict:
+        """
+        Run processor on its workspace.
+        :param cls: processor class
+        :param workspace: working data taken with cls.workspace on the thread merging results
+        :param site: site filter
+        :return: result of processor (see Base.result)
+        """
+
+        # Only the site processor runs site object processors
+        options = {"site_processors": self._site_processors} if cls.__name__.lower() == "site" else dict()
+        keys = set(workspace)
+        cls(session=self.session, api_url=self.api_url, data=workspace, site=site, workers=self.workers, logger=self.logger, engine=self.engine,
+            snapshot=self._snapshot, **options).run()
+        result = cls.result(workspace, keys)
+
+        if self.engine.deadline is not None or self.engine.expired:
+            # Section is complete if processor finished before any request got cancelled
+            result.setdefault(c.SECTIONS_KEY, dict())[cls.__name__.lower()] = not self.engine.expired
+
+        return result
+
+    def close(self):
+        """
+        Stop shared fetch engine, release worker threads and close response cache.
+        :return:
+        """
+        self.engine.close()
+
+        if self._cache:
+            self._cache.close()
+
+        if self._journal:
+            self._journal.close()
@@ -0,0 +1,104 @@
+"""
+authors: cklewar
+"""
+
+import time
+from logging import Logger
+
+import lib.const as c
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker for one api collection in one namespace.
+
+    The breaker opens after threshold consecutive failed requests. While open all requests are rejected. After cooldown
+    seconds one probe request is let through (half open). A successful probe closes the breaker, a failed probe opens it
+    again for another cooldown. A probe ending without verdict (throttled, cancelled, unexpected error) lets the next
+    request probe.
+
+    All methods must be called from the engine event loop.
+
+    Methods
+    -------
+    allow()
+        check if request may be sent
+    success()
+        record request answered by server
+    failure()
+        record request failed with retryable status or connection error
+    release()
+        end probe request without verdict
+    """
+
+    def __init__(self, name: str = None, threshold: int = c.BREAKER_THRESHOLD, cooldown: float = c.BREAKER_COOLDOWN, logger: Logger = None):
+        """
+        :param name: name used in log messages
+        :param threshold: number of consecutive failures opening the breaker
+        :param cooldown: seconds until an open breaker lets a probe request through
+        :param logger: log instance for writing / printing log information
+        """
+
+        self._name = name
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._logger = logger
+        self._state = c.BREAKER_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._opened = 0
+        self._probing = False
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def opened(self):
+        return self._opened
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def allow(self) -> bool:
+        if self._state == c.BREAKER_CLOSED:
+            return True
+
+        if self._state == c.BREAKER_OPEN and time.monotonic() - self._opened_at >= self._cooldown:
+            self._state = c.BREAKER_HALF_OPEN
+            self._probing = False
+
+        if self._state == c.BREAKER_HALF_OPEN and not self._probing:
+            self._probing = True
+            self.logger.info(f"Circuit breaker <{self.name}> half open. Sending probe request")
+            return True
+
+        return False
+
+    def success(self):
+        if self._state != c.BREAKER_CLOSED:
+            self.logger.info(f"Circuit breaker <{self.name}> closed")
+
+        self._state = c.BREAKER_CLOSED
+        self._failures = 0
+        self._probing = False
+
+    def failure(self):
+        self._failures += 1
+
+        if self._state == c.BREAKER_HALF_OPEN or (self._state == c.BREAKER_CLOSED and self._failures >= self._threshold):
+            self._state = c.BREAKER_OPEN
+            self._opened_at = time.monotonic()
+            self._opened += 1
+            self._probing = False
+            self.logger.info(f"Circuit breaker <{self.name}> opened after {self._failures} consecutive failures. Cooling down for {self._cooldown}s")
+
+    def release(self):
+        if self._state == c.BREAKER_HALF_OPEN and self._probing:
+            self._probing = False
+            self.logger.info(f"Circuit breaker <{self.name}> probe request ended without verdict")
@@ -0,0 +1,216 @@
+"""
+authors: cklewar
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from logging import Logger
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+import lib.const as c
+from lib.endpoint import parse
+
+
+def make_response(url: str = None, body: bytes = None, status_code: int = 200, headers: dict = None) -> Response:
+    """
+    Build requests.Response from raw data. Used to serve responses which did not come from the network.
+    :param url: request url
+    :param body: response body
+    :param status_code: http status code
+    :param headers: response headers
+    :return: requests.Response
+    """
+
+    r = Response()
+    r.url = url
+    r.status_code = status_code
+    r.headers = CaseInsensitiveDict(headers if headers else {"Content-Type": "application/json"})
+    r.encoding = "utf-8"
+    r._content = body
+
+    return r
+
+
+class CacheEntry(object):
+    """
+    Cached response body together with its validators.
+    """
+
+    def __init__(self, url: str = None, body: bytes = None, etag: str = None, last_modified: str = None, resource_version: str = None, stored: float = 0, ttl: float = 0,
+                 current: bool = False):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.resource_version = resource_version
+        self.stored = stored
+        self.ttl = ttl
+        # Object still has the resource_version of its latest list item
+        self.current = current
+
+    @property
+    def fresh(self) -> bool:
+        return self.current or time.time() - self.stored < self.ttl
+
+    def validators(self) -> dict:
+        """
+        Conditional request headers for revalidation
+        :return: dict of request headers
+        """
+
+        headers = dict()
+
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        return headers
+
+    def response(self) -> Response:
+        return make_response(url=self.url, body=self.body)
+
+
+class ResponseCache(object):
+    """
+    Persistent response cache keyed by url. Backed by a sqlite database in cache directory.
+
+    Entries store body and validators (ETag, Last-Modified and the object's metadata.resource_version).
+    Entries younger than the TTL of their object kind are served without request, so are entries of objects whose list
+    item still has the cached resource_version. Older entries are revalidated with conditional requests. Total body size is bounded by max_bytes, least recently used entries are evicted first.
+
+    Methods
+    -------
+    lookup(url: str = None, resource_version: str = None)
+        get cache entry for url or None
+    store(url: str = None, r: Response = None)
+        add or replace entry for url from response
+    touch(url: str = None)
+        mark entry as revalidated and recently used
+    stats()
+        hit / revalidation / miss counters
+    close()
+        close database
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = c.CACHE_MAX_BYTES, ttl: float = c.CACHE_TTL_DEFAULT, ttl_by_kind: dict = None, logger: Logger = None):
+        """
+        :param path: cache directory
+        :param max_bytes: maximum total size of cached bodies
+        :param ttl: default time to live in seconds during which entries are served without revalidation
+        :param ttl_by_kind: collection name (e.g. "sites", "http_loadbalancers") -> ttl in seconds
+        :param logger: log instance for writing / printing log information
+        """
+
+        os.makedirs(path, exist_ok=True)
+        self._path = os.path.join(path, c.CACHE_FILE_NAME)
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._ttl_by_kind = dict(c.CACHE_TTL_BY_KIND)
+        self._ttl_by_kind.update(ttl_by_kind if ttl_by_kind else {})
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._counters = {"hit": 0, "revalidated": 0, "miss": 0, "evicted": 0}
+        self._db = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, resource_version TEXT, stored REAL, accessed REAL, size INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def size(self):
+        return self._size
+
+    def ttl(self, url: str = None) -> float:
+        """
+        Time to live for url according to its object kind
+        :param url: request url
+        :return: ttl in seconds
+        """
+
+        _, collection, _ = parse(url)
+
+        return self._ttl_by_kind.get(collection, self._ttl)
+
+    def lookup(self, url: str = None, resource_version: str = None) -> CacheEntry | None:
+        """
+        Get cache entry for url.
+        :param url: request url
+        :param resource_version: resource_version of the object's list item. Entry of the same resource_version is fresh
+        :return: cache entry or None
+        """
+
+        with self._lock:
+            row = self._db.execute("SELECT body, etag, last_modified, resource_version, stored FROM responses WHERE url = ?", (url,)).fetchone()
+
+            if row is None:
+                self._counters["miss"] += 1
+                return None
+
+            self._db.execute("UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url))
+
+        entry = CacheEntry(url, row[0], row[1], row[2], row[3], row[4], self.ttl(url), current=resource_version is not None and row[3] == resource_version)
+
+        with self._lock:
+            self._counters["hit" if entry.fresh else "revalidated"] += 1
+
+        return entry
+
+    def touch(self, url: str = None):
+        with self._lock:
+            now = time.time()
+            self._db.execute("UPDATE responses SET stored = ?, accessed = ? WHERE url = ?", (now, now, url))
+
+    def store(self, url: str = None, r: Response = None):
+        body = r.content
+        resource_version = None
+
+        try:
+            resource_version = json.loads(body).get("metadata", {}).get("resource_version")
+        except (ValueError, AttributeError):
+            pass
+
+        with self._lock:
+            now = time.time()
+            old = self._db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (url, body, r.headers.get("ETag"), r.headers.get("Last-Modified"), resource_version, now, now, len(body)))
+            self._size += len(body) - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self):
+        """
+        Drop least recently used entries until total size is below max_bytes. Caller holds lock.
+        :return:
+        """
+
+        while self._size > self._max_bytes:
+            rows = self._db.execute("SELECT url, size FROM responses ORDER BY accessed LIMIT ?", (c.CACHE_EVICT_BATCH,)).fetchall()
+
+            if not rows:
+                break
+
+            for url, size in rows:
+                if self._size <= self._max_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._size -= size
+                self._counters["evicted"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters, size=self._size)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,247 @@
+"""
+authors: cklewar
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from logging import Logger
+from typing import Iterable
+
+import lib.const as c
+
+
+def percentile(samples: Iterable[float] = None, q: float = 0.95) -> float | None:
+    """
+    Nearest rank percentile of samples
+    :param samples: latency samples
+    :param q: percentile between 0 and 1
+    :return: percentile or None if there are no samples
+    """
+
+    samples = sorted(samples)
+
+    if not samples:
+        return None
+
+    return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+
+
+class PrioritySemaphore(object):
+    """
+    Asyncio semaphore handing free slots to waiters with the lowest priority value first. Waiters of equal priority are
+    served in order of arrival.
+
+    All methods must be called from the engine event loop.
+
+    Methods
+    -------
+    acquire(priority: int = 0)
+        wait for a free slot
+    release()
+        free slot and wake up next waiter
+    slot(priority: int = 0)
+        async context manager holding a slot
+    """
+
+    def __init__(self, value: int = 1):
+        """
+        :param value: number of slots
+        """
+
+        self._value = value
+        self._waiters = list()
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int = 0):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Slot has been handed over just before cancellation. Pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+
+            # Waiters cancelled while waiting leave a done future behind
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self._value += 1
+
+    def slot(self, priority: int = 0) -> "_Slot":
+        return _Slot(self, priority)
+
+
+class _Slot(object):
+    def __init__(self, semaphore: PrioritySemaphore = None, priority: int = 0):
+        self._semaphore = semaphore
+        self._priority = priority
+
+    async def __aenter__(self):
+        await self._semaphore.acquire(self._priority)
+
+    async def __aexit__(self, *args):
+        self._semaphore.release()
+
+
+class AimdWindow(object):
+    """
+    Additive increase / multiplicative decrease concurrency window for one endpoint family.
+
+    The window grows by one after each round of window completed requests as long as the p95 latency of recent
+    requests stays within c.AIMD_LATENCY_TOLERANCE of the best p95 observed so far. It is halved on throttling
+    (429), timeouts, connection errors, server errors or if p95 latency exceeds the best p95 by c.AIMD_LATENCY_SPIKE.
+    At most one decrease per round is applied so a burst of failures of requests sent with the old window does not
+    collapse the window to its minimum.
+
+    All methods must be called from the engine event loop.
+
+    Methods
+    -------
+    acquire()
+        wait until a slot within the window is free
+    release(latency: float | None = 0, congested: bool = False)
+        free slot and feed request outcome into the controller
+    p95()
+        95th percentile of recent request latencies
+    """
+
+    def __init__(self, name: str = None, initial: int = 10, minimum: int = 1, maximum: int = 100, logger: Logger = None):
+        """
+        :param name: endpoint family name
+        :param initial: initial window size
+        :param minimum: lower bound of window
+        :param maximum: upper bound of window
+        :param logger: log instance for writing / printing log information
+        """
+
+        self._name = name
+        self._minimum = max(1, minimum)
+        self._maximum = max(self._minimum, maximum)
+        self._window = float(min(max(initial, self._minimum), self._maximum))
+        self._logger = logger
+        self._in_flight = 0
+        self._completed = 0
+        self._round_end = int(self._window)
+        self._decreased_in_round = False
+        self._best_p95 = None
+        self._latencies = deque(maxlen=c.AIMD_SAMPLE_SIZE)
+        self._history = [(time.time(), int(self._window), "initial")]
+        self._condition = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def window(self):
+        return int(self._window)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def history(self):
+        return self._history
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def p95(self) -> float | None:
+        """
+        95th percentile of recent request latencies
+        :return: latency in seconds or None if no samples collected yet
+        """
+
+        return percentile(self._latencies, 0.95)
+
+    async def acquire(self):
+        """
+        Wait until in flight requests of this family fall below window.
+        :return:
+        """
+
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < int(self._window))
+            self._in_flight += 1
+
+    async def release(self, latency: float | None = 0, congested: bool = False):
+        """
+        Free slot and adjust window.
+        :param latency: request latency in seconds. None frees slot of request not sent without adjusting window
+        :param congested: True if request was throttled, timed out or failed with server error
+        :return:
+        """
+
+        self._in_flight -= 1
+
+        if latency is None:
+            async with self._condition:
+                self._condition.notify_all()
+            return
+
+        self._completed += 1
+
+        if congested:
+            self._decrease("congestion")
+        else:
+            self._latencies.append(latency)
+
+        if self._completed >= self._round_end:
+            self._end_round()
+
+        async with self._condition:
+            self._condition.notify_all()
+
+    def _end_round(self):
+        p95 = self.p95()
+
+        if p95 is not None and not self._decreased_in_round:
+            if self._best_p95 is None or p95 < self._best_p95:
+                self._best_p95 = p95
+
+            if p95 > self._best_p95 * c.AIMD_LATENCY_SPIKE:
+                self._decrease(f"latency spike p95 {p95:.3f}s")
+            elif p95 <= self._best_p95 * (1 + c.AIMD_LATENCY_TOLERANCE):
+                self._set(self._window + 1, f"stable p95 {p95:.3f}s")
+
+        self._decreased_in_round = False
+        self._round_end = self._completed + int(self._window)
+
+    def _decrease(self, reason: str = None):
+        if not self._decreased_in_round:
+            self._decreased_in_round = True
+            self._set(self._window * c.AIMD_DECREASE_FACTOR, reason)
+            # Latencies measured with the larger window are stale now
+            self._best_p95 = None
+            self._latencies.clear()
+
+    def _set(self, window: float = None, reason: str = None):
+        window = min(max(window, self._minimum), self._maximum)
+
+        if int(window) != int(self._window):
+            self._history.append((time.time(), int(window), reason))
+            if self.logger:
+                self.logger.debug(f"concurrency window <{self.name}> {int(self._window)} -> {int(window)}: {reason}")
+
+        self._window = window
@@ -66,6 +66,15 @@ SITE_OBJECT_TYPE_SMS = "sms"
 SITE_OBJECT_TYPE_LEGACY = "legacy"
 SITE_OBJECT_PROCESSORS = ["site_details", "efp", "fpp", "dc_cluster_group", "cloudlink", "node_interfaces", "hw_info",
                           "spokes"]
+# Site object processors working on site details
+SITE_OBJECT_PROCESSOR_REQUIRES = {
+    "efp": ["site_details"],
+    "fpp": ["site_details"],
+    "dc_cluster_group": ["site_details"],
+    "cloudlink": ["site_details"],
+    "node_interfaces": ["site_details"],
+    "spokes": ["site_details"],
+}
 SITE_TYPE_TO_URI_MAP = {
     F5XC_SITE_TYPE_SMS_V1: URI_F5XC_SMS_V1,
     F5XC_SITE_TYPE_SMS_V2: URI_F5XC_SMS_V2,
@@ -81,3 +90,172 @@ HW_INFO_ITEMS_TO_PROCESS = {
     "memory": ["speed", "size_mb"],
     "storage": ["size_gb"]
 }
+
+#
+# Fetch engine
+#
+SESSION_MODE_THREAD = "thread"
+SESSION_MODE_SHARED = "shared"
+SESSION_MODES = [SESSION_MODE_THREAD, SESSION_MODE_SHARED]
+SESSION_POOL_BLOCK = True
+SESSION_PREWARM_TIMEOUT = 30
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 30
+ENDPOINT_FAMILY_SITES = "sites"
+ENDPOINT_FAMILY_LOAD_BALANCERS = "loadbalancers"
+ENDPOINT_FAMILY_ORIGIN_POOLS = "origin_pools"
+ENDPOINT_FAMILY_DEFAULT = "default"
+ENDPOINT_FAMILIES = {
+    ENDPOINT_FAMILY_SITES: ["sites", "securemesh_sites", "securemesh_site_v2s", "aws_vpc_sites", "aws_tgw_sites", "gcp_vpc_sites",
+                            "azure_vnet_sites", "voltstack_sites", "virtual_sites"],
+    ENDPOINT_FAMILY_LOAD_BALANCERS: ["http_loadbalancers", "tcp_loadbalancers", "udp_loadbalancers", "proxys"],
+    ENDPOINT_FAMILY_ORIGIN_POOLS: ["origin_pools"],
+}
+AIMD_SAMPLE_SIZE = 200
+AIMD_LATENCY_TOLERANCE = 0.25
+AIMD_LATENCY_SPIKE = 2.0
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_MAX_WORKERS_FACTOR = 4
+CACHE_FILE_NAME = "responses.sqlite"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_EVICT_BATCH = 64
+# Seconds a cached response is served without revalidation. Sites carry live state and are always revalidated.
+CACHE_TTL_DEFAULT = 300
+CACHE_TTL_BY_KIND = {
+    "namespaces": 3600,
+    "sites": 0,
+    "securemesh_sites": 0,
+    "securemesh_site_v2s": 0,
+    "aws_vpc_sites": 0,
+    "aws_tgw_sites": 0,
+    "gcp_vpc_sites": 0,
+    "azure_vnet_sites": 0,
+    "voltstack_sites": 0,
+}
+# List endpoints asked for full objects in bulk mode. Detail GETs of these collections are served from list response
+BULK_QUERY = "report_fields"
+BULK_COLLECTIONS = ["http_loadbalancers", "tcp_loadbalancers", "udp_loadbalancers", "proxys", "origin_pools", "bgps", "segments", "cloud_connects",
+                    "site_mesh_groups", "virtual_sites"]
+FETCH_MAX_PENDING_FACTOR = 4
+MEMO_MAX_ENTRIES = 4096
+# Object bodies primed from bulk list responses or the snapshot kept until requested. Oldest are released first
+PRIMED_MAX_ENTRIES = 65536
+# (connect, read) timeouts in seconds per endpoint family
+REQUEST_TIMEOUT_DEFAULT = (5.0, 30.0)
+REQUEST_TIMEOUTS = {
+    ENDPOINT_FAMILY_SITES: (5.0, 60.0),
+}
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 0.95
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+TRANSPORT_REQUESTS = "requests"
+TRANSPORT_URLLIB3 = "urllib3"
+TRANSPORT_HTTPX = "httpx"
+TRANSPORT_HTTP2 = "http2"
+TRANSPORTS = [TRANSPORT_REQUESTS, TRANSPORT_URLLIB3, TRANSPORT_HTTPX, TRANSPORT_HTTP2]
+TRANSPORT_NUM_POOLS = 4
+# Connections opened by the HTTP/2 transport. Requests beyond one per connection are multiplexed as streams
+TRANSPORT_HTTP2_CONNECTIONS = 4
+# Object uri built from referring objects of a site. Collection name is the referring object kind plus "s"
+URI_F5XC_OBJECT = "/config/namespaces/{namespace}/{kind}s/{name}"
+# Referring object kinds fetched by processors in site filtered (-s) runs
+REFERRING_KINDS_LOAD_BALANCER = ["http_loadbalancer", "tcp_loadbalancer", "udp_loadbalancer"]
+REFERRING_KINDS_PROXY = ["proxy"]
+REFERRING_KINDS_ORIGIN_POOL = ["origin_pool"]
+REFERRING_KINDS_BGP = ["bgp"]
+# Namespace object keys of site data written to get-sites.json and their referring object kind. Load balancers are stored
+# per type below key "loadbalancer"
+SNAPSHOT_NAMESPACE_KINDS = {"proxys": "proxy", "origin_pools": "origin_pool"}
+# Top level key of get-sites.json holding resource_version per object uri in incremental mode
+SNAPSHOT_VERSIONS_KEY = "versions"
+# Site keys added by processors other than site. Not reused from snapshot for unchanged sites
+SNAPSHOT_REFERENCE_KEYS = ["namespaces", "bgp", "smg", "vsites", "segments", "cloud_connector"]
+# Watch mode. Maximum deviation of interval between runs as ratio and number of changed sites listed per run
+WATCH_JITTER = 0.1
+WATCH_SUMMARY_MAX_ITEMS = 10
+# Journal file written next to the output file unless set explicitly
+JOURNAL_SUFFIX = ".journal"
+# Collections neither recorded nor replayed by the journal. Resumed runs discover namespaces anew
+JOURNAL_SKIP_COLLECTIONS = ["namespaces"]
+# Distributed collection. Namespace scoped processors run by workers on partitions of namespaces. Coordinator runs the
+# others and sends keys in PARTITION_CONTEXT_KEYS along with the data required by namespace scoped processors
+PARTITION_PROCESSORS = ["lb", "proxy", "originpool"]
+PARTITION_TASK = "partitions"
+PARTITION_CONTEXT_KEYS = ["referring", "previous"]
+# Top level keys any processor may add to. Returned with the keys a processor provides
+PROCESSOR_SHARED_KEYS = [SNAPSHOT_VERSIONS_KEY, "referring"]
+PARTITION_COUNT = 8
+PARTITION_TIMEOUT = 600
+PARTITION_CLAIM_WAIT = 10
+PARTITION_POLL_INTERVAL = 0.5
+# Output file of every tenant collected with --tenant
+TENANT_FILE_FORMAT = "{stem}-{tenant}{suffix}"
+# Requests waiting for a free slot are sent in order of priority of their collection. Sites first since they decide which
+# sites exist and which failed, then objects referring to sites, then site sub objects (policies, dc cluster groups...)
+REQUEST_PRIORITY_SITES = 0
+REQUEST_PRIORITY_OBJECTS = 1
+REQUEST_PRIORITY_DEFAULT = 2
+REQUEST_PRIORITIES = {
+    "namespaces": REQUEST_PRIORITY_SITES,
+    "sites": REQUEST_PRIORITY_SITES,
+    "securemesh_sites": REQUEST_PRIORITY_SITES,
+    "securemesh_site_v2s": REQUEST_PRIORITY_SITES,
+    "aws_vpc_sites": REQUEST_PRIORITY_SITES,
+    "aws_tgw_sites": REQUEST_PRIORITY_SITES,
+    "gcp_vpc_sites": REQUEST_PRIORITY_SITES,
+    "azure_vnet_sites": REQUEST_PRIORITY_SITES,
+    "voltstack_sites": REQUEST_PRIORITY_SITES,
+    "virtual_sites": REQUEST_PRIORITY_OBJECTS,
+    "http_loadbalancers": REQUEST_PRIORITY_OBJECTS,
+    "tcp_loadbalancers": REQUEST_PRIORITY_OBJECTS,
+    "udp_loadbalancers": REQUEST_PRIORITY_OBJECTS,
+    "proxys": REQUEST_PRIORITY_OBJECTS,
+    "origin_pools": REQUEST_PRIORITY_OBJECTS,
+}
+# Top level key of get-sites.json telling per processor if its section is complete. Written if a time budget is set or the
+# run has been interrupted
+SECTIONS_KEY = "sections"
+# Run plan. Every run writes the profile of its requests next to its output file. Plans of later runs predict bytes and
+# latency per request from it
+PROFILE_SUFFIX = ".profile"
+# List endpoints read by a plan per processor. Processors listed in PLAN_NAMESPACES list their own namespace only, the
+# others every namespace
+PLAN_LIST_URIS = {
+    "site": [URI_F5XC_SITES],
+    "vs": [URI_F5XC_VIRTUAL_SITES],
+    "lb": [URI_F5XC_LOAD_BALANCER.format(namespace="{namespace}", lb_type=lb_type) for lb_type in F5XC_LOAD_BALANCER_TYPES],
+    "proxy": [URI_F5XC_PROXIES],
+    "originpool": [URI_F5XC_ORIGIN_POOLS],
+    "bgp": [URI_F5XC_BGPS],
+    "smg": [URI_F5XC_SITE_MESH_GROUPS],
+    "cloudconnect": [URI_F5XC_CLOUD_CONNECTS],
+    "segment": [URI_F5XC_SEGMENTS],
+}
+PLAN_NAMESPACES = {
+    "site": F5XC_NAMESPACE_SYSTEM,
+    "vs": F5XC_NAMESPACE_SHARED,
+    "bgp": F5XC_NAMESPACE_SYSTEM,
+    "smg": F5XC_NAMESPACE_SYSTEM,
+    "cloudconnect": F5XC_NAMESPACE_SYSTEM,
+    "segment": F5XC_NAMESPACE_SYSTEM,
+}
+# Processors whose list endpoints are read with report fields by a plan. Their items tell which sites get details and which
+# virtual sites are fetched by site mesh groups
+PLAN_REPORT_FIELDS = ["site", "smg"]
+# Collections of objects fetched by site object processors. Site details are fetched once per site from the collection
+# of its kind. Other objects are referenced by site details and not listed anywhere, their count is taken from the profile
+PLAN_SITE_DETAILS = "site_details"
+PLAN_SITE_OBJECT_COLLECTIONS = {
+    "site_details": ["securemesh_sites", "securemesh_site_v2s", "aws_vpc_sites", "aws_tgw_sites", "gcp_vpc_sites", "azure_vnet_sites", "voltstack_sites"],
+    "efp": ["enhanced_firewall_policys"],
+    "fpp": ["forward_proxy_policys"],
+    "dc_cluster_group": ["dc_cluster_groups"],
+}
+# Bytes and seconds per request assumed for collections neither profiled nor listed by the plan
+PLAN_DEFAULT_BYTES = 4096
+PLAN_DEFAULT_LATENCY = 0.25
@@ -0,0 +1,134 @@
+"""
+authors: cklewar
+"""
+
+from logging import Logger
+
+from requests import Session
+
+import lib.const as c
+from lib.ratelimit import TokenBucket
+from lib.transport import Transport, create
+
+
+class Credential(object):
+    """
+    One API token together with its own rate limiter and connection pool.
+    """
+
+    def __init__(self, name: str = None, transport: Transport = None, bucket: TokenBucket = None):
+        """
+        :param name: name used in log messages. Never the token itself
+        :param transport: transport sending requests authenticated with this token
+        :param bucket: rate limiter of this token
+        """
+
+        self.name = name
+        self.transport = transport
+        self.bucket = bucket
+        self.active = True
+        self.requests = 0
+
+
+class CredentialPool(object):
+    """
+    Spread requests across several API tokens of the same tenant.
+
+    Tokens are used round robin. Tokens throttled with 429 are paused by their own bucket and skipped while paused.
+    Tokens rejected with 401/403 are taken out of rotation unless they are the last active token.
+
+    pick() and disable() must be called from the engine event loop.
+
+    Methods
+    -------
+    pick()
+        next credential to send a request with
+    available(credential: Credential = None)
+        check if another credential than given one can send right away
+    disable(credential: Credential = None)
+        take credential out of rotation
+    close()
+        close connections of all credentials
+    """
+
+    def __init__(self, session: Session = None, tokens: list[str] = None, workers: int = 10, session_mode: str = c.SESSION_MODE_THREAD, transport: str = c.TRANSPORT_REQUESTS,
+                 rate_limit: float = 0, burst: int = None, logger: Logger = None):
+        """
+        :param session: template http session. Authorization header is replaced per token
+        :param tokens: api tokens. None uses the template session as is
+        :param workers: connection pool size per token
+        :param session_mode: session mode of requests transport
+        :param transport: http transport backend
+        :param rate_limit: maximum requests per second per token. 0 disables rate limiting
+        :param burst: maximum number of requests sent back to back per token
+        :param logger: log instance for writing / printing log information
+        """
+
+        self._logger = logger
+        self._credentials = list()
+        self._next = 0
+
+        for idx, token in enumerate(tokens if tokens else [None]):
+            _session = session
+
+            if token:
+                _session = Session()
+                _session.headers.update(session.headers)
+                _session.headers.update({"Authorization": f"APIToken {token}"})
+
+            self._credentials.append(Credential(name=f"token{idx}", transport=create(name=transport, session=_session, workers=workers, session_mode=session_mode),
+                                                bucket=TokenBucket(rate=rate_limit, burst=burst if burst else workers)))
+
+    @property
+    def credentials(self):
+        return self._credentials
+
+    @property
+    def active(self):
+        return [credential for credential in self._credentials if credential.active]
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def pick(self) -> Credential:
+        """
+        Next active credential in round robin order which is not paused. If all are paused the one resuming first.
+        :return: Credential
+        """
+
+        active = self.active
+        candidates = active[self._next % len(active):] + active[:self._next % len(active)]
+        self._next += 1
+
+        for credential in candidates:
+            if credential.bucket.paused() <= 0:
+                return credential
+
+        return min(candidates, key=lambda credential: credential.bucket.paused())
+
+    def available(self, credential: Credential = None) -> bool:
+        return any(other is not credential and other.bucket.paused() <= 0 for other in self.active)
+
+    def disable(self, credential: Credential = None) -> bool:
+        """
+        Take credential out of rotation unless it is the last active one.
+        :param credential: credential rejected by the api
+        :return: True if credential is out of rotation and the request can be retried with another one
+        """
+
+        if not credential.active:
+            # Concurrent request rejected with the same token
+            return True
+
+        if len(self.active) <= 1:
+            return False
+
+        credential.active = False
+        self.logger.info(f"API token <{credential.name}> rejected. Removed from rotation, {len(self.active)} tokens left")
+
+        return True
+
+    def close(self):
+        for credential in self._credentials:
+            credential.transport.close()
@@ -0,0 +1,330 @@
+"""
+authors: cklewar
+"""
+
+import json
+import os
+import socket
+import time
+import uuid
+from logging import Logger
+from typing import Callable
+
+import lib.const as c
+from lib.scheduler import merge
+
+
+class DirectoryQueue(object):
+    """
+    Task queue shared by coordinator and workers through a directory. Workers on other hosts need the directory mounted.
+
+    Tasks and results are json files written to a temporary name and renamed into place, so readers never see partial
+    files. A worker claims a task by renaming it from tasks/ to claimed/. Rename is atomic, only one worker wins.
+    A worker delivers a result by renaming its claimed task out of claimed/ first. Either this rename or the coordinator
+    taking the task back wins. Results of tasks taken back are discarded, tasks being delivered can not be taken back.
+
+    Methods
+    -------
+    put(task_id: str = None, task: dict = None)
+        add task
+    claim()
+        take oldest task or None
+    done(task_id: str = None, result: dict = None)
+        store result of claimed task
+    result(task_id: str = None)
+        pop result of task or None
+    take_back(task_id: str = None)
+        remove task whether claimed or not
+    withdraw(task_id: str = None)
+        remove task not claimed yet
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: queue directory
+        """
+
+        self._path = path
+
+        for name in ["tasks", "claimed", "results"]:
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+
+    def _file(self, folder: str = None, task_id: str = None) -> str:
+        return os.path.join(self._path, folder, f"{task_id}.json")
+
+    def _write(self, folder: str = None, task_id: str = None, data: dict = None):
+        tmp = os.path.join(self._path, folder, f".{task_id}.{uuid.uuid4().hex}")
+
+        with open(tmp, "w") as fp:
+            json.dump(data, fp)
+
+        os.replace(tmp, self._file(folder, task_id))
+
+    @staticmethod
+    def _read(name: str = None) -> dict | None:
+        try:
+            with open(name, "r") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return None
+
+    def put(self, task_id: str = None, task: dict = None):
+        self._write("tasks", task_id, task)
+
+    def claim(self) -> tuple[str, dict] | None:
+        for name in sorted(os.listdir(os.path.join(self._path, "tasks"))):
+            if name.startswith(".") or not name.endswith(".json"):
+                continue
+
+            task_id = name[:-len(".json")]
+
+            try:
+                os.rename(self._file("tasks", task_id), self._file("claimed", task_id))
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+
+            task = self._read(self._file("claimed", task_id))
+
+            if task is not None:
+                return task_id, task
+
+        return None
+
+    def done(self, task_id: str = None, result: dict = None) -> bool:
+        """
+        Store result of claimed task.
+        :param task_id: task id
+        :param result: json serializable result
+        :return: False if task has been taken back
+        """
+
+        delivering = os.path.join(self._path, "results", f".{task_id}.delivering")
+
+        try:
+            # From here on the task belongs to this worker. Fails if coordinator took it back
+            os.rename(self._file("claimed", task_id), delivering)
+        except FileNotFoundError:
+            return False
+
+        self._write("results", task_id, result)
+        os.unlink(delivering)
+
+        return True
+
+    def result(self, task_id: str = None) -> dict | None:
+        result = self._read(self._file("results", task_id))
+
+        if result is not None:
+            os.unlink(self._file("results", task_id))
+
+        return result
+
+    def take_back(self, task_id: str = None) -> bool:
+        """
+        Remove task whether claimed or not.
+        :param task_id: task id
+        :return: False if a worker is delivering or has delivered its result
+        """
+
+        taken = False
+
+        for folder in ["tasks", "claimed"]:
+            try:
+                os.unlink(self._file(folder, task_id))
+                taken = True
+            except FileNotFoundError:
+                pass
+
+        return taken
+
+    def withdraw(self, task_id: str = None) -> bool:
+        """
+        Remove task not claimed by any worker yet.
+        :param task_id: task id
+        :return: True if task has been removed
+        """
+
+        try:
+            os.unlink(self._file("tasks", task_id))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+
+class Coordinator(object):
+    """
+    Spread namespace scoped processors across worker processes.
+
+    Namespaces are split round robin into partitions. Every partition becomes one task holding the processors to run, its
+    namespaces and the data those processors require (sites, virtual sites, failed sites). Sites are not partitioned since
+    objects of any namespace may refer to any site. Workers claim tasks as they become idle, so partitions should outnumber
+    workers. Results are merged in order of completion.
+
+    Partitions not claimed by any worker after claim_wait seconds are withdrawn and run by fallback in the coordinator
+    process one by one, so a run without workers does not wait for the timeout. Partitions without result after timeout
+    seconds or failed on a worker are taken back and run by fallback as well.
+
+    Methods
+    -------
+    run(context: dict = None, namespaces: list = None, processors: list = None, site: str = None, fallback: Callable = None)
+        run processors for all namespaces on workers and return merged data
+    """
+
+    def __init__(self, queue: DirectoryQueue = None, partitions: int = c.PARTITION_COUNT, timeout: float = c.PARTITION_TIMEOUT,
+                 claim_wait: float = c.PARTITION_CLAIM_WAIT, logger: Logger = None):
+        """
+        :param queue: task queue shared with workers
+        :param partitions: maximum number of partitions namespaces are split into
+        :param timeout: seconds to wait for worker results before running remaining partitions locally
+        :param claim_wait: seconds after which partitions no worker claimed are run locally
+        :param logger: log instance for writing / printing log information
+        """
+
+        self._queue = queue
+        self._partitions = partitions
+        self._timeout = timeout
+        self._claim_wait = claim_wait
+        self._logger = logger
+        self._stats = {"remote": 0, "local": 0}
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def run(self, context: dict = None, namespaces: list = None, processors: list = None, site: str = None, fallback: Callable[[dict], dict] = None) -> dict:
+        """
+        Run processors for all namespaces on workers.
+        :param context: data required by processors
+        :param namespaces: namespaces to partition
+        :param processors: names of namespace scoped processors
+        :param site: site filter
+        :param fallback: runs a task in the coordinator process and returns its data
+        :return: merged data of all partitions
+        """
+
+        run_id = uuid.uuid4().hex[:8]
+        count = max(1, min(self._partitions, len(namespaces)))
+        pending = dict()
+        self.logger.info(f"Dispatching {len(namespaces)} namespaces in {count} partitions running {', '.join(processors)}")
+
+        for index in range(count):
+            task_id = f"{run_id}-{index:04d}"
+            pending[task_id] = {"run": run_id, "site": site, "processors": processors, "data": dict(context, namespaces=namespaces[index::count])}
+            self._queue.put(task_id, pending[task_id])
+
+        data = dict()
+        start = time.monotonic()
+        deadline = start + self._timeout
+
+        while pending:
+            for task_id in list(pending):
+                result = self._queue.result(task_id)
+
+                if result is None:
+                    continue
+
+                task = pending.pop(task_id)
+
+                if "error" in result:
+                    self.logger.info(f"Partition {task_id} failed on worker {result.get('worker')} with: {result['error']}. Running locally")
+                    merge(data, fallback(task))
+                    self._stats["local"] += 1
+                else:
+                    self.logger.info(f"Partition {task_id} done by worker {result.get('worker')} in {result.get('elapsed', 0):.1f}s")
+                    merge(data, result["data"])
+                    self._stats["remote"] += 1
+
+            if pending and time.monotonic() - start >= self._claim_wait:
+                # Run one partition nobody claimed, then look for results again
+                for task_id in list(pending):
+                    if self._queue.withdraw(task_id):
+                        self.logger.info(f"Partition {task_id} not claimed after {self._claim_wait}s. Running locally")
+                        merge(data, fallback(pending.pop(task_id)))
+                        self._stats["local"] += 1
+                        break
+
+            if pending and time.monotonic() >= deadline:
+                for task_id in list(pending):
+                    # Results being delivered are picked up by the next poll
+                    if self._queue.take_back(task_id):
+                        self.logger.info(f"Partition {task_id} not done after {self._timeout}s. Running locally")
+                        merge(data, fallback(pending.pop(task_id)))
+                        self._stats["local"] += 1
+
+            if pending:
+                time.sleep(c.PARTITION_POLL_INTERVAL)
+
+        self.logger.info(f"Partitions: {self._stats['remote']} done by workers, {self._stats['local']} done locally")
+
+        return data
+
+
+class Worker(object):
+    """
+    Run tasks claimed from a DirectoryQueue until idle.
+
+    Methods
+    -------
+    serve(idle: float = 0)
+        process tasks
+    """
+
+    def __init__(self, queue: DirectoryQueue = None, process: Callable[[dict], dict] = None, name: str = None, logger: Logger = None):
+        """
+        :param queue: task queue shared with coordinator
+        :param process: runs a task and returns its data e.g. Api.run_partition
+        :param name: worker name reported with results. Defaults to host name and process id
+        :param logger: log instance for writing / printing log information
+        """
+
+        self._queue = queue
+        self._process = process
+        self._name = name if name else f"{socket.gethostname()}-{os.getpid()}"
+        self._logger = logger
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def serve(self, idle: float = 0) -> int:
+        """
+        Claim and process tasks.
+        :param idle: return after idle seconds without task. 0 serves until interrupted
+        :return: number of processed tasks
+        """
+
+        processed = 0
+        last = time.monotonic()
+
+        while not idle or time.monotonic() - last < idle:
+            claimed = self._queue.claim()
+
+            if claimed is None:
+                time.sleep(c.PARTITION_POLL_INTERVAL)
+                continue
+
+            task_id, task = claimed
+            start = time.monotonic()
+            self.logger.info(f"Worker {self._name} processing partition {task_id} with {len(task['data']['namespaces'])} namespaces")
+
+            try:
+                result = {"data": self._process(task)}
+            except Exception as exc:
+                self.logger.info(f"Partition {task_id} failed with: {exc}")
+                result = {"error": str(exc)}
+
+            result.update({"worker": self._name, "elapsed": time.monotonic() - start})
+
+            if not self._queue.done(task_id, result):
+                self.logger.info(f"Partition {task_id} has been taken back by coordinator. Result discarded")
+
+            processed += 1
+            last = time.monotonic()
+
+        return processed
@@ -0,0 +1,58 @@
+"""
+authors: cklewar
+"""
+
+from urllib.parse import urlsplit
+
+import lib.const as c
+
+
+def parse(url: str = None) -> tuple[str | None, str | None, str | None]:
+    """
+    Split F5XC config api url into namespace, collection and object name.
+    E.g. https://tenant/api/config/namespaces/default/http_loadbalancers/lb1 --> ("default", "http_loadbalancers", "lb1")
+    :param url: api url
+    :return: tuple of namespace, collection and object name. Missing parts are None
+    """
+
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+
+    if "namespaces" in parts:
+        idx = parts.index("namespaces")
+        rest = parts[idx + 1:]
+
+        # /web/namespaces or /web/namespaces/<name>
+        if idx == 0 or parts[idx - 1] != "config":
+            return (rest[0] if rest else None), "namespaces", None
+
+        return (rest[0] if len(rest) > 0 else None), (rest[1] if len(rest) > 1 else None), (rest[2] if len(rest) > 2 else None)
+
+    return None, None, None
+
+
+def family(url: str = None) -> str:
+    """
+    Map api url to endpoint family. Endpoint families group collections with similar cost and backend e.g. all site kinds.
+    :param url: api url
+    :return: endpoint family name out of c.ENDPOINT_FAMILIES or c.ENDPOINT_FAMILY_DEFAULT
+    """
+
+    _, collection, _ = parse(url)
+
+    for name, collections in c.ENDPOINT_FAMILIES.items():
+        if collection in collections:
+            return name
+
+    return c.ENDPOINT_FAMILY_DEFAULT
+
+
+def priority(url: str = None) -> int:
+    """
+    Request priority of api url. Lower values are sent first when requests queue for a free slot.
+    :param url: api url
+    :return: priority out of c.REQUEST_PRIORITIES or c.REQUEST_PRIORITY_DEFAULT
+    """
+
+    _, collection, _ = parse(url)
+
+    return c.REQUEST_PRIORITIES.get(collection, c.REQUEST_PRIORITY_DEFAULT)
@@ -0,0 +1,1154 @@
+"""
+authors: cklewar
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from logging import Logger
+from typing import Callable, Iterable, Iterator
+
+from requests import RequestException, Response, Session
+
+import lib.const as c
+from lib.breaker import CircuitBreaker
+from lib.cache import ResponseCache, make_response
+from lib.concurrency import AimdWindow, PrioritySemaphore, percentile
+from lib.endpoint import family, parse, priority
+from lib.credentials import Credential, CredentialPool
+from lib.journal import Journal
+from lib.stream import list_items
+
+
+class RetryLater(Exception):
+    """
+    Raised when a request still fails with a retryable status after all immediate retries.
+    The request is parked in the deferred queue and retried once more at the end of the fetch.
+    """
+
+    def __init__(self, url: str = None, status: int | None = None, delay: float = 0):
+        super().__init__(f"get failed for {url} with {status}, retry deferred")
+        self.url = url
+        self.status = status
+        self.delay = delay
+
+
+class Engine(object):
+    """
+    Shared fetch engine used by Api and all processors.
+
+    The engine owns a single asyncio event loop running in a background thread and one bounded semaphore.
+    Every GET issued by a processor is scheduled as a coroutine on this loop, so all processors share one
+    concurrency budget instead of building and tearing down their own thread pools per phase.
+
+    Requests are sent by a pluggable transport (see lib.transport) whose connection pools are sized to the number of
+    workers. Blocking transports (requests, urllib3) run in executor threads, one thread per request in flight. The
+    requests transport supports "thread" session mode, giving every executor thread its own session, and "shared" session
+    mode using one pooled session for all threads. Non-blocking transports (httpx, http2) run as coroutines on the event
+    loop and need no thread per request.
+
+    Requests are spread round robin across all API tokens. Every token has its own connection pool and token bucket.
+    Requests failing with a status in c.RETRY_STATUS_CODES or with a connection error are retried. Retry-After sent by
+    the server is honoured and pauses the bucket of the throttled token, the retry goes out right away with another
+    token if one is available. Otherwise jittered exponential backoff is used. Tokens rejected with 401/403 are taken
+    out of rotation while other tokens are left. Requests still failing after all retries are deferred to the end of
+    the current fetch and retried once more before being dropped.
+
+    In adaptive mode every endpoint family (see c.ENDPOINT_FAMILIES) gets its own AIMD concurrency window starting at
+    workers and bounded by max_workers. The global semaphore and executor are sized to max_workers.
+
+    Requests are coalesced for the lifetime of the engine. Concurrent requests for the same url share one in flight
+    request and successful responses are served from memory afterwards. Failed requests are not memoized. At most
+    memo_size completed responses are kept, least recently used responses are released first. Responses primed from bulk
+    list responses or the snapshot are kept apart until their url is requested for the first time, so they are not released
+    by memo eviction before they have been used. At most primed_size of them are kept, the oldest are released first and
+    requested again if needed.
+
+    Every request uses the connect and read timeouts of its endpoint family. With hedging enabled a request which did not
+    answer within the p95 latency of its endpoint family gets a duplicate request and the first answer wins. Hedges are
+    capped at hedge ratio of all requests sent.
+
+    Requests of one collection in one namespace share a circuit breaker. After breaker_threshold consecutive failures
+    further requests are skipped until a probe request after breaker_cooldown seconds succeeds. Skipped urls are listed
+    in degraded.
+
+    Requests, bytes and seconds of successful requests are summed up per collection in profile. The profile written by a
+    run lets a plan of the next run predict its bytes and wall time (see lib.planner).
+
+    Requests waiting for a free slot are sent in order of priority of their collection (see c.REQUEST_PRIORITIES).
+
+    With a deadline set, requests in flight are cancelled when it passes and later requests fail right away. Urls not
+    answered because of the deadline are listed in cancelled. expire() does the same right away e.g. on Ctrl-C.
+
+    fetch() keeps at most max_pending requests outstanding and pulls further urls only when results have been consumed,
+    so memory stays flat regardless of the number of urls.
+
+    In bulk mode list requests for collections in c.BULK_COLLECTIONS ask for full objects (c.BULK_QUERY). Every list item
+    carrying a spec is added to the memo under its object url so subsequent per object GETs are served without request.
+    Items without spec are left to the per object GET.
+
+    With a response cache, cached responses within their TTL are served without request. So are cached objects still
+    having the resource_version their item had in the list response they were requested for. Older entries are revalidated
+    with a conditional request and served from cache on 304. Cache I/O runs on a disk thread, never on the event loop.
+
+    With a journal, successful responses are recorded and responses recorded by an interrupted run are served without request.
+    Collections in c.JOURNAL_SKIP_COLLECTIONS are always requested. Recorded responses are read on the disk thread, records
+    are written by the journal writer thread.
+
+    Attributes
+    ----------
+    _session: requests.Session
+        template http session. Provides headers for all requests sent by the transport
+    _credentials: CredentialPool
+        api tokens with their transports and rate limiters
+    _workers: int
+        maximum number of requests in flight
+    _retries: int
+        number of immediate retries per request
+    _windows: dict
+        endpoint family -> AimdWindow. Only used in adaptive mode
+    _cache: ResponseCache
+        persistent response cache or None
+    _listed: dict
+        object url -> resource_version of its list item. Only kept with a response cache
+    _journal: Journal
+        journal of the run or None
+    _budget: threading.Semaphore
+        requests in flight across engines of several tenants or None
+    _memo: OrderedDict
+        url -> task of first request for url in least recently used order. Only accessed from event loop
+    _primed: dict
+        url -> body of primed responses not requested yet. Only accessed from event loop
+    _memo_stats: dict
+        memo hit / miss / primed counters
+    _bulk: bool
+        fetch full objects with list requests
+    _max_pending: int
+        maximum number of requests outstanding per fetch
+    _queue_depth: int
+        number of requests submitted and not completed yet
+    _timeouts: dict
+        endpoint family -> (connect, read) timeout
+    _hedge: float
+        maximum ratio of hedged requests. 0 disables hedging
+    _latencies: dict
+        endpoint family -> recent latencies of successful requests
+    _breakers: dict
+        (collection, namespace) -> CircuitBreaker
+    _degraded: dict
+        namespace -> collection -> skipped urls
+    _dropped: list
+        urls dropped after all retries failed
+    _deadline: float
+        monotonic time requests are cancelled at or None
+    _expired: bool
+        deadline passed or expire() called
+    _cancelled: list
+        urls not answered because of deadline
+    _profile: dict
+        collection -> "list" / "object" -> requests, bytes and seconds of successful requests
+    _logger: logger instance
+
+    Methods
+    -------
+    prewarm(url: str = None, count: int = 0)
+        open count keep-alive connections to url before the first processor runs
+    submit(url: str = None)
+        schedule GET request on the event loop and return future
+    prime(url: str = None, body: bytes = None)
+        serve later requests for url with given body
+    get(url: str = None)
+        run GET request and wait for the result
+    fetch(urls: Iterable[str] = None, expand: Callable = None)
+        schedule GET requests for all urls and yield (url, future) tuples as they complete
+    report()
+        write concurrency window history of all endpoint families, memo and cache statistics to log
+    set_deadline(seconds: float = 0)
+        cancel requests after seconds
+    expire()
+        cancel requests in flight and fail later requests right away
+    reset()
+        forget responses and failures of the previous run, keep connections, windows and breakers
+    close()
+        stop event loop and release worker threads
+    """
+
+    def __init__(self, session: Session = None, workers: int = 10, logger: Logger = None, session_mode: str = c.SESSION_MODE_THREAD, transport: str = c.TRANSPORT_REQUESTS,
+                 tokens: list[str] = None,
+                 rate_limit: float = 0, burst: int = None, retries: int = 3, backoff: float = c.RETRY_BACKOFF_BASE, adaptive: bool = False,
+                 max_workers: int = None, cache: ResponseCache = None, bulk: bool = False, max_pending: int = None, memo_size: int = c.MEMO_MAX_ENTRIES,
+                 primed_size: int = c.PRIMED_MAX_ENTRIES, timeouts: dict = None, hedge: float = 0, breaker_threshold: int = c.BREAKER_THRESHOLD, breaker_cooldown: float = c.BREAKER_COOLDOWN,
+                 journal: Journal = None, budget: threading.Semaphore = None):
+        """
+        Initialize engine and start event loop thread.
+
+        :param session: template http session
+        :param workers: maximum number of requests in flight
+        :param logger: log instance for writing / printing log information
+        :param session_mode: per executor thread sessions ("thread") or one session shared by all threads ("shared")
+        :param transport: http transport backend. One of c.TRANSPORTS
+        :param tokens: api tokens of the tenant to spread requests across. None uses authorization of template session
+        :param rate_limit: maximum requests per second per token. 0 disables rate limiting
+        :param burst: maximum number of requests sent back to back per token. Defaults to number of workers
+        :param retries: number of immediate retries for retryable failures
+        :param backoff: base delay in seconds for exponential backoff
+        :param adaptive: adapt concurrency per endpoint family between 1 and max_workers
+        :param max_workers: upper bound of concurrency in adaptive mode. Defaults to c.AIMD_MAX_WORKERS_FACTOR * workers
+        :param cache: persistent response cache. None disables caching
+        :param bulk: fetch full objects with list requests and serve per object GETs from list response
+        :param max_pending: maximum number of requests outstanding per fetch. Defaults to c.FETCH_MAX_PENDING_FACTOR * max_workers
+        :param memo_size: maximum number of completed responses kept in memo
+        :param primed_size: maximum number of primed object bodies kept until requested
+        :param timeouts: endpoint family -> (connect, read) timeout in seconds. Key c.ENDPOINT_FAMILY_DEFAULT sets default
+        :param hedge: maximum ratio of requests which may be hedged e.g. 0.05. 0 disables hedging
+        :param breaker_threshold: consecutive failures opening circuit breaker of a collection in a namespace. 0 disables breakers
+        :param breaker_cooldown: seconds until an open circuit breaker sends a probe request
+        :param journal: record successful responses and serve responses recorded by an interrupted run. None disables journaling
+        :param budget: concurrency budget shared with engines of other tenants. None limits requests in flight by workers only
+        """
+
+        self._session = session
+        self._workers = workers
+        self._logger = logger
+        self._retries = retries
+        self._backoff = backoff
+        self._dropped = list()
+        self._adaptive = adaptive
+        self._max_workers = (max_workers if max_workers else workers * c.AIMD_MAX_WORKERS_FACTOR) if adaptive else workers
+        self._windows = dict()
+        self._cache = cache
+        self._listed = dict()
+        self._journal = journal
+        self._budget = budget
+        self._memo = OrderedDict()
+        self._memo_size = memo_size
+        self._primed_size = primed_size
+        self._primed = dict()
+        self._memo_stats = {"hit": 0, "miss": 0, "primed": 0}
+        self._bulk = bulk
+        self._max_pending = max_pending if max_pending else self._max_workers * c.FETCH_MAX_PENDING_FACTOR
+        self._queue_depth = 0
+        self._queue_depth_peak = 0
+        self._timeouts = dict(c.REQUEST_TIMEOUTS)
+        self._timeouts.update(timeouts if timeouts else {})
+        self._hedge = hedge
+        self._hedge_stats = {"sent": 0, "hedged": 0, "won": 0}
+        self._latencies = dict()
+        self._breaker_threshold = breaker_threshold
+        self._breaker_cooldown = breaker_cooldown
+        self._breakers = dict()
+        self._degraded = dict()
+        self._deadline = None
+        self._deadline_handle = None
+        self._expired = False
+        self._cancelled = list()
+        self._profile = dict()
+
+        # Hedged requests run next to the request they duplicate and need their own threads and connections
+        threads = self._max_workers + (math.ceil(self._max_workers * hedge) if hedge else 0)
+        self._credentials = CredentialPool(session=session, tokens=tokens, workers=threads, session_mode=session_mode, transport=transport,
+                                           rate_limit=rate_limit, burst=burst if burst else workers, logger=logger)
+        # Blocking transport calls are handed off to this executor. Event loop and semaphore decide what runs when.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="engine")
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        # sqlite access is serialized by the cache anyway. One thread keeps cache and journal reads off the event loop and
+        # transport threads
+        self._disk_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk") if cache or journal else None
+        self._semaphore = PrioritySemaphore(self._max_workers)
+        self._thread = threading.Thread(target=self._run_loop, name="engine-loop", daemon=True)
+        self._thread.start()
+
+    @property
+    def session(self):
+        """
+        Session to be used by the calling thread if transport is requests based else template session.
+        :return: requests.Session
+        """
+
+        return getattr(self.transport, "session", self._session)
+
+    @property
+    def transport(self):
+        return self._credentials.credentials[0].transport
+
+    @property
+    def credentials(self):
+        return self._credentials
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def bucket(self):
+        return self._credentials.credentials[0].bucket
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    @property
+    def windows(self):
+        return self._windows
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def memo_stats(self):
+        return self._memo_stats
+
+    @property
+    def breakers(self):
+        return self._breakers
+
+    @property
+    def degraded(self):
+        return self._degraded
+
+    @property
+    def hedge_stats(self):
+        return self._hedge_stats
+
+    @property
+    def max_pending(self):
+        return self._max_pending
+
+    @property
+    def profile(self):
+        return self._profile
+
+    @property
+    def queue_depth(self):
+        return self._queue_depth
+
+    @property
+    def queue_depth_peak(self):
+        return self._queue_depth_peak
+
+    def _breaker(self, url: str = None) -> CircuitBreaker:
+        """
+        Get circuit breaker of collection and namespace url belongs to. Must be called from event loop.
+        :param url: request url
+        :return: CircuitBreaker
+        """
+
+        namespace, collection, _ = parse(url)
+        key = (collection, namespace)
+
+        if key not in self._breakers:
+            self._breakers[key] = CircuitBreaker(name=f"{namespace}/{collection}", threshold=self._breaker_threshold, cooldown=self._breaker_cooldown,
+                                                 logger=self.logger)
+
+        return self._breakers[key]
+
+    def _skip(self, url: str = None):
+        """
+        Record url skipped because of open circuit breaker in degraded.
+        :param url: request url
+        :return:
+        """
+
+        namespace, collection, _ = parse(url)
+        degraded = self._degraded.setdefault(namespace if namespace else "", dict()).setdefault(collection if collection else "", {"skipped": list()})
+        degraded["skipped"].append(url)
+        degraded["opened"] = self._breakers[(collection, namespace)].opened
+
+    def _window(self, url: str = None) -> AimdWindow:
+        """
+        Get concurrency window of endpoint family url belongs to. Must be called from event loop.
+        :param url: request url
+        :return: AimdWindow
+        """
+
+        name = family(url)
+
+        if name not in self._windows:
+            self._windows[name] = AimdWindow(name=name, initial=self.workers, minimum=1, maximum=self._max_workers, logger=self.logger)
+
+        return self._windows[name]
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _request(self, url: str = None, headers: dict = None, credential: Credential = None) -> Response:
+        """
+        Blocking transport call. Runs in executor thread.
+        :param url: Actual URL to run GET request on
+        :param headers: additional request headers e.g. conditional request validators
+        :param credential: api token to send request with
+        :return: requests.Response
+        """
+
+        timeout = self._timeouts.get(family(url), self._timeouts.get(c.ENDPOINT_FAMILY_DEFAULT, c.REQUEST_TIMEOUT_DEFAULT))
+
+        if self._budget is None:
+            return credential.transport.get(url, headers=headers, timeout=timeout)
+
+        with self._budget:
+            return credential.transport.get(url, headers=headers, timeout=timeout)
+
+    async def _arequest(self, url: str = None, headers: dict = None, credential: Credential = None) -> Response:
+        """
+        Non-blocking transport call. Runs on event loop.
+        :param url: Actual URL to run GET request on
+        :param headers: additional request headers e.g. conditional request validators
+        :param credential: api token to send request with
+        :return: requests.Response
+        """
+
+        timeout = self._timeouts.get(family(url), self._timeouts.get(c.ENDPOINT_FAMILY_DEFAULT, c.REQUEST_TIMEOUT_DEFAULT))
+
+        if self._budget is None:
+            return await credential.transport.aget(url, headers=headers, timeout=timeout)
+
+        # Budget is shared with engines of other tenants running their own event loop. The executor thread keeps waiting for a
+        # slot if the request is cancelled meanwhile (deadline, expire, lost hedge) and the slot is released once it got it
+        acquired = self._loop.run_in_executor(None, self._budget.acquire)
+
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            acquired.add_done_callback(lambda future: self._budget.release() if not future.cancelled() and not future.exception() else None)
+            raise
+
+        try:
+            return await credential.transport.aget(url, headers=headers, timeout=timeout)
+        finally:
+            self._budget.release()
+
+    def _call(self, url: str = None, headers: dict = None, credential: Credential = None) -> asyncio.Future:
+        """
+        Start transport call. Non-blocking transports run as task on event loop, blocking ones in executor.
+        :param url: Actual URL to run GET request on
+        :param headers: additional request headers
+        :param credential: api token to send request with
+        :return: future of requests.Response
+        """
+
+        if credential.transport.asynchronous:
+            return self._loop.create_task(self._arequest(url, headers, credential))
+
+        return self._loop.run_in_executor(None, self._request, url, headers, credential)
+
+    async def _send(self, url: str = None, headers: dict = None, credential: Credential = None) -> Response:
+        """
+        Run transport call. Hedge request if it did not answer within p95 latency of its endpoint family.
+        :param url: Actual URL to run GET request on
+        :param headers: additional request headers
+        :param credential: api token to send request with
+        :return: requests.Response of first request answering
+        """
+
+        name = family(url)
+        latencies = self._latencies.setdefault(name, deque(maxlen=c.AIMD_SAMPLE_SIZE))
+        start = time.monotonic()
+        self._hedge_stats["sent"] += 1
+        credential.requests += 1
+        primary = self._call(url, headers, credential)
+        delay = percentile(latencies, c.HEDGE_PERCENTILE) if self._hedge and len(latencies) >= c.HEDGE_MIN_SAMPLES else None
+
+        if delay is None or self._hedge_stats["hedged"] >= self._hedge * self._hedge_stats["sent"]:
+            r = await primary
+        else:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+
+            if done:
+                r = primary.result()
+            else:
+                self._hedge_stats["hedged"] += 1
+                self.logger.debug(f"hedging request to {url} after {delay:.3f}s")
+                hedge = self._call(url, headers, credential)
+                winner = await self._first(primary, hedge)
+                r = winner.result()
+
+                if winner is hedge:
+                    self._hedge_stats["won"] += 1
+
+        if r.status_code == 200:
+            latencies.append(time.monotonic() - start)
+            self._record(url, r, time.monotonic() - start)
+
+        return r
+
+    def _record(self, url: str = None, r: Response = None, seconds: float = 0):
+        """
+        Add successful request to profile of its collection. Only called from event loop.
+        :param url: request url
+        :param r: response
+        :param seconds: time until response arrived
+        :return:
+        """
+
+        _, collection, name = parse(url)
+        stats = self._profile.setdefault(collection, dict()).setdefault("object" if name else "list", {"requests": 0, "bytes": 0, "seconds": 0.0})
+        stats["requests"] += 1
+        stats["bytes"] += len(r.content)
+        stats["seconds"] += seconds
+
+    @staticmethod
+    async def _first(*futures: asyncio.Future) -> asyncio.Future:
+        """
+        Wait for first of futures to return a response. Exceptions are only raised if all futures failed.
+        :param futures: executor futures
+        :return: first future which completed without exception
+        """
+
+        pending = set(futures)
+        error = None
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        # Non-blocking losers stop right away. Blocking transport calls run on, their outcome is collected to not
+                        # leak exceptions
+                        loser.add_done_callback(lambda f: f.cancelled() or f.exception())
+                        loser.cancel()
+                    return future
+                error = error or future.exception()
+
+        raise error
+
+    def _retry_delay(self, r: Response | None = None, attempt: int = 0) -> float:
+        """
+        Compute delay before next attempt. Retry-After header takes precedence over jittered exponential backoff.
+        :param r: failed response or None if request raised a connection error
+        :param attempt: zero based attempt counter
+        :return: delay in seconds
+        """
+
+        retry_after = r.headers.get("Retry-After") if r is not None else None
+
+        if retry_after:
+            try:
+                return min(float(retry_after), c.RETRY_BACKOFF_MAX)
+            except ValueError:
+                try:
+                    return min(max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()), c.RETRY_BACKOFF_MAX)
+                except (TypeError, ValueError):
+                    pass
+
+        # full jitter
+        return random.uniform(0, min(c.RETRY_BACKOFF_MAX, self._backoff * 2 ** attempt))
+
+    async def _get(self, url: str = None, final: bool = True) -> Response | bool:
+        """
+        Run HTTP GET on a given url bounded by engine semaphore and rate limiter. Retry retryable failures.
+        :param url: Actual URL to run GET request on
+        :param final: if False raise RetryLater after last retry instead of dropping the request
+        :return: requests.Response or False if request failed
+        """
+
+        # Namespaces are discovered anew by every run, resumed runs included
+        journal = self._journal if self._journal and parse(url)[1] not in c.JOURNAL_SKIP_COLLECTIONS else None
+
+        if journal and journal.replayable(url):
+            r = await self._loop.run_in_executor(self._disk_executor, journal.response, url)
+
+            if r is not None:
+                return r
+
+        r = None
+        delay = 0.0
+        entry = await self._loop.run_in_executor(self._disk_executor, self._cache.lookup, url, self._listed.get(url)) if self._cache else None
+
+        if entry and entry.fresh:
+            return entry.response()
+
+        headers = entry.validators() if entry else None
+
+        breaker = self._breaker(url) if self._breaker_threshold else None
+
+        attempt = 0
+
+        while attempt <= self._retries:
+            if breaker and not breaker.allow():
+                if entry:
+                    self.logger.debug(f"circuit breaker <{breaker.name}> open. Serving stale cache entry for {url}")
+                    return entry.response()
+
+                self.logger.debug(f"circuit breaker <{breaker.name}> open. Skipping {url}")
+                self._skip(url)
+                return False
+
+            # Request let through by a half open breaker is its probe
+            probe = breaker is not None and breaker.state == c.BREAKER_HALF_OPEN
+
+            try:
+                credential = self._credentials.pick()
+                wait = credential.bucket.reserve()
+
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                window = self._window(url) if self._adaptive else None
+
+                if window:
+                    await window.acquire()
+
+                start = None
+                r = None
+
+                try:
+                    async with self._semaphore.slot(priority(url)):
+                        # Time queued for a slot is no server latency
+                        start = time.monotonic()
+                        r = await self._send(url, headers, credential)
+                except RequestException as exc:
+                    self.logger.debug(f"get failed for {url} with {exc}")
+                finally:
+                    if window and start is None:
+                        await window.release(latency=None)
+                    elif window:
+                        await window.release(latency=time.monotonic() - start, congested=r is None or r.status_code in c.RETRY_STATUS_CODES)
+
+                if breaker and r is not None and r.status_code not in c.RETRY_STATUS_CODES:
+                    breaker.success()
+                elif breaker and (r is None or r.status_code != 429):
+                    # Throttling is handled by the token bucket and does not indicate a broken backend
+                    breaker.failure()
+            finally:
+                if probe:
+                    # Probe ended without verdict when throttled, cancelled or failed unexpectedly. Next request probes again
+                    breaker.release()
+
+            if r is not None:
+                if 200 == r.status_code:
+                    if self._cache:
+                        await self._loop.run_in_executor(self._disk_executor, self._cache.store, url, r)
+                    if journal:
+                        journal.record(url, r)
+                    return r
+
+                if 304 == r.status_code and entry:
+                    await self._loop.run_in_executor(self._disk_executor, self._cache.touch, url)
+                    return entry.response()
+
+                if (r.status_code == 401 or r.status_code == 403) and self._credentials.disable(credential):
+                    # Retry with another token, does not count as attempt
+                    continue
+
+                if r.status_code not in c.RETRY_STATUS_CODES:
+                    if r.status_code == 401 or r.status_code == 403:
+                        self.logger.info("get failed for {} with authentication error: <{}>".format(url, r.status_code))
+                    self.logger.debug("get failed for {} with {}".format(url, r.status_code))
+                    return False
+
+            delay = self._retry_delay(r, attempt)
+
+            if r is not None and r.status_code == 429:
+                # Throttling applies to all requests sent with this token, not only this one
+                credential.bucket.pause(delay)
+
+                if self._credentials.available(credential):
+                    delay = 0.0
+
+            if attempt < self._retries:
+                self.logger.debug(f"get failed for {url} with {r.status_code if r is not None else 'connection error'}. Retry {attempt + 1}/{self._retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+            attempt += 1
+
+        status = r.status_code if r is not None else None
+
+        if not final:
+            raise RetryLater(url=url, status=status, delay=delay)
+
+        self.logger.info(f"get failed for {url} with {status if status else 'connection error'} after {self._retries} retries. Dropping request")
+        self._dropped.append(url)
+
+        return False
+
+    async def _coalesce(self, url: str = None, final: bool = True) -> Response | bool:
+        """
+        Run GET request once per url. Callers for a url already requested share the result of the first request.
+        :param url: Actual URL to run GET request on
+        :param final: if False raise RetryLater after last retry instead of dropping the request
+        :return: requests.Response or False if request failed
+        """
+
+        task = self._memo.get(url)
+
+        if task is None and url in self._primed:
+            # Primed response leaves its store on first use and is memoized like any other response from now on
+            task = self._loop.create_future()
+            task.set_result(make_response(url=url, body=self._primed.pop(url)))
+            self._memo[url] = task
+            self._evict()
+
+        if self._expired and (task is None or not task.done()):
+            self._cancelled.append(url)
+            return False
+
+        self._queue_depth += 1
+        self._queue_depth_peak = max(self._queue_depth_peak, self._queue_depth)
+
+        try:
+            if task is not None:
+                self._memo_stats["hit"] += 1
+                self._memo.move_to_end(url)
+                return await self._result(url, task)
+
+            self._memo_stats["miss"] += 1
+            task = self._loop.create_task(self._get(self._bulk_url(url), final=final))
+            self._memo[url] = task
+            self._evict()
+            r = False
+
+            try:
+                r = await self._result(url, task)
+            finally:
+                # Only keep successful responses so deferred and later requests for a failed url run again
+                if not r and self._memo.get(url) is task:
+                    del self._memo[url]
+        finally:
+            self._queue_depth -= 1
+
+        # List bodies are decoded once, versions and primed objects share the items with the processors
+        if self._cache and r and parse(url)[2] is None:
+            await self._loop.run_in_executor(self._disk_executor, self._list_versions, url, r)
+
+        if self._bulk and r:
+            self._prime_items(url, r)
+
+        return r
+
+    async def _result(self, url: str = None, task: asyncio.Future = None) -> Response | bool:
+        """
+        Wait for request task shared by all callers of url.
+        :param url: request url
+        :param task: request task
+        :return: requests.Response or False if request failed or has been cancelled by deadline
+        """
+
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Request cancelled by deadline. Caller itself has not been cancelled
+            if not task.cancelled():
+                raise
+
+            self._cancelled.append(url)
+
+            return False
+
+    def _evict(self):
+        """
+        Release least recently used completed responses until memo holds at most memo_size entries.
+        In flight requests are never evicted. Must be called from event loop.
+        :return:
+        """
+
+        excess = len(self._memo) - self._memo_size
+        evict = list()
+
+        for url, task in self._memo.items():
+            if len(evict) >= excess:
+                break
+            if task.done():
+                evict.append(url)
+
+        for url in evict:
+            del self._memo[url]
+
+    def _list_versions(self, url: str = None, r: Response = None):
+        """
+        Remember resource_version of list items, so cached objects still having it are served without request. Runs on
+        cache thread.
+        :param url: list url
+        :param r: list response
+        :return:
+        """
+
+        try:
+            for item in list_items(r):
+                version = item.get("metadata", dict()).get("resource_version") if isinstance(item, dict) else None
+
+                if version is not None and "name" in item:
+                    self._listed[f"{url}/{item['name']}"] = version
+        except ValueError:
+            return
+
+    def _bulk_url(self, url: str = None) -> str:
+        """
+        Add c.BULK_QUERY to list urls of bulk collections in bulk mode.
+        :param url: request url
+        :return: request url to send
+        """
+
+        if self._bulk and "?" not in url:
+            _, collection, name = parse(url)
+
+            if collection in c.BULK_COLLECTIONS and name is None:
+                return f"{url}?{c.BULK_QUERY}"
+
+        return url
+
+    def _prime(self, url: str = None, body: bytes = None):
+        """
+        Keep response body for url until it is requested unless url has been requested or primed already. Must be called
+        from event loop.
+        :param url: object url
+        :param body: response body
+        :return:
+        """
+
+        if url not in self._memo and url not in self._primed:
+            self._primed[url] = body
+            self._memo_stats["primed"] += 1
+
+            # Bodies of objects no processor requests, e.g. of filtered sites, would stay for the whole run otherwise
+            while len(self._primed) > self._primed_size:
+                del self._primed[next(iter(self._primed))]
+
+    def _prime_items(self, url: str = None, r: Response = None):
+        """
+        Add full objects contained in bulk list response to memo under their object url.
+        :param url: list url
+        :param r: list response
+        :return:
+        """
+
+        if url == self._bulk_url(url):
+            return
+
+        try:
+            for item in list_items(r):
+                spec = item.get("spec", item.get("get_spec"))
+
+                if spec is not None and "metadata" in item and "name" in item:
+                    body = {"metadata": item["metadata"], "system_metadata": item.get("system_metadata", {}), "spec": spec}
+                    self._prime(f"{url}/{item['name']}", json.dumps(body).encode("utf-8"))
+        except ValueError:
+            return
+
+    def prewarm(self, url: str = None, count: int = 0) -> int:
+        """
+        Open count keep-alive connections to url per api token. Warm up requests run concurrently on distinct executor threads
+        so every thread (or every pooled connection of the transport) holds an established TLS connection.
+        :param url: url to send warm up request to
+        :param count: number of connections to open. Capped at number of workers
+        :return: number of connections opened
+        """
+
+        count = min(count, self.workers)
+
+        if count <= 0:
+            return 0
+
+        if self.transport.asynchronous:
+            return self._prewarm_async(url, count)
+
+        barrier = threading.Barrier(count)
+
+        def warm() -> bool:
+            try:
+                # Keep all warm up requests in flight at the same time so each one opens its own connection
+                barrier.wait(timeout=c.SESSION_PREWARM_TIMEOUT)
+            except threading.BrokenBarrierError:
+                pass
+            try:
+                for credential in self._credentials.active:
+                    credential.transport.head(url, timeout=c.SESSION_PREWARM_TIMEOUT)
+            except Exception as exc:
+                self.logger.debug(f"prewarm connection to {url} failed with: {exc}")
+                return False
+            return True
+
+        warmed = sum(1 for ok in self._executor.map(lambda _: warm(), range(count)) if ok)
+        self.logger.info(f"Prewarmed {warmed} of {count} connections to {url}")
+
+        return warmed
+
+    def _prewarm_async(self, url: str = None, count: int = 0) -> int:
+        """
+        Open count connections to url per api token with a non-blocking transport. Warm up requests are in flight at the
+        same time, so each one opens its own connection.
+        :param url: url to send warm up request to
+        :param count: number of connections to open
+        :return: number of connections opened
+        """
+
+        async def warm() -> bool:
+            try:
+                for credential in self._credentials.active:
+                    await credential.transport.ahead(url, timeout=c.SESSION_PREWARM_TIMEOUT)
+            except Exception as exc:
+                self.logger.debug(f"prewarm connection to {url} failed with: {exc}")
+                return False
+            return True
+
+        async def warm_all() -> list[bool]:
+            return await asyncio.gather(*[warm() for _ in range(count)])
+
+        warmed = sum(1 for ok in asyncio.run_coroutine_threadsafe(warm_all(), self._loop).result() if ok)
+        self.logger.info(f"Prewarmed {warmed} of {count} connections to {url}")
+
+        return warmed
+
+    def submit(self, url: str = None, final: bool = True) -> concurrent.futures.Future:
+        """
+        Schedule GET request on event loop.
+        :param url: Actual URL to run GET request on
+        :param final: if False future raises RetryLater instead of resolving to False after last retry
+        :return: future resolving to requests.Response or False
+        """
+        return asyncio.run_coroutine_threadsafe(self._coalesce(url, final=final), self._loop)
+
+    def prime(self, url: str = None, body: bytes = None):
+        """
+        Serve requests for url submitted after this call with given body instead of sending them. Ignored if url has been
+        requested already.
+        :param url: object url
+        :param body: response body
+        :return:
+        """
+        self._loop.call_soon_threadsafe(self._prime, url, body)
+
+    def _sleep(self, delay: float = 0):
+        """
+        Sleep delay seconds but not past deadline.
+        :param delay: seconds
+        :return:
+        """
+
+        if self._deadline is not None:
+            delay = min(delay, max(0.0, self._deadline - time.monotonic()))
+
+        time.sleep(delay)
+
+    def get(self, url: str = None) -> Response | bool:
+        """
+        Run HTTP GET on a given url and wait for the result. Retryable failures get one deferred attempt.
+        :param url: Actual URL to run GET request on
+        :return: requests.Response or False
+        """
+
+        try:
+            return self.submit(url, final=False).result()
+        except RetryLater as exc:
+            self._sleep(exc.delay)
+            return self.submit(url).result()
+
+    def fetch(self, urls: Iterable[str] = None, expand: Callable[[str, Response | bool], Iterable[str]] = None) -> Iterator[tuple[str, concurrent.futures.Future]]:
+        """
+        Schedule GET requests for all urls and yield results as they complete.
+        With expand, results of urls are passed to expand instead of being yielded. Urls returned by expand are submitted
+        as soon as the result arrived and their results are yielded, so follow-up requests never wait for the slowest url.
+        expand may return a lazy iterator. Follow-up urls are pulled from it one by one as capacity frees up, so the first
+        object requests are sent while the rest of a large list response is still being decoded.
+        Requests failing after all retries are parked in a deferred queue which is drained once all other requests
+        completed. Their results are yielded last.
+        :param urls: urls to run GET request on
+        :param expand: callable taking url and result returning follow-up urls e.g. object urls of a list response
+        :return: iterator of (url, future) tuples in order of completion
+        """
+
+        deferred = list()
+
+        yield from self._drain(((url, expand) for url in urls), deferred=deferred)
+
+        if deferred and self._expired:
+            self._cancelled.extend(exc.url for exc, _ in deferred)
+        elif deferred:
+            delay = max(exc.delay for exc, _ in deferred)
+            self.logger.info(f"Retry {len(deferred)} deferred requests in {delay:.2f}s...")
+            self._sleep(delay)
+
+            yield from self._drain((exc.url, _expand) for exc, _expand in deferred)
+
+    def _drain(self, source: Iterator[tuple[str, Callable | None]] = None, deferred: list = None) -> Iterator[tuple[str, concurrent.futures.Future]]:
+        """
+        Submit requests from source keeping at most max_pending outstanding, expand results and yield final results as they
+        complete. Follow-up urls returned by expand are submitted before further urls are taken from source.
+        :param source: iterator of (url, expand) tuples
+        :param deferred: list to park RetryLater failures in. None if requests are final
+        :return: iterator of (url, future) tuples in order of completion
+        """
+
+        # (url, iterator) of follow-up urls returned by expand, consumed lazily
+        backlog = deque()
+        pending = dict()
+
+        while True:
+            while len(pending) < self._max_pending:
+                item = self._follow_up(backlog) or next(source, None)
+
+                if item is None:
+                    break
+
+                pending[self.submit(item[0], final=deferred is None)] = item
+
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                url, expand = pending.pop(future)
+
+                if deferred is not None and isinstance(future.exception(), RetryLater):
+                    deferred.append((future.exception(), expand))
+                elif expand:
+                    try:
+                        backlog.append((url, iter(expand(url, future.result()))))
+                    except Exception as exc:
+                        self.logger.info(f"expanding {url} failed with: {exc}")
+                else:
+                    yield url, future
+
+    def _follow_up(self, backlog: deque = None) -> tuple[str, None] | None:
+        """
+        Take next follow-up url from the oldest expand iterator in backlog. Exhausted or failing iterators are dropped.
+        :param backlog: deque of (url, iterator) tuples
+        :return: (url, None) tuple or None if backlog is empty
+        """
+
+        while backlog:
+            url, urls = backlog[0]
+
+            try:
+                _url = next(urls, None)
+            except Exception as exc:
+                self.logger.info(f"expanding {url} failed with: {exc}")
+                _url = None
+
+            if _url is not None:
+                return _url, None
+
+            backlog.popleft()
+
+        return None
+
+    def report(self):
+        """
+        Write concurrency window history of all endpoint families, memo and cache statistics to log.
+        :return:
+        """
+
+        self.logger.info(f"Request memo: {self._memo_stats['hit']} hits, {self._memo_stats['miss']} misses, {self._memo_stats['primed']} primed from list responses")
+        if len(self._credentials.credentials) > 1:
+            self.logger.info(f"Requests per api token: {', '.join(f'{credential.name} {credential.requests}' + ('' if credential.active else ' (disabled)') for credential in self._credentials.credentials)}")
+
+        if self._hedge:
+            self.logger.info(f"Hedged {self._hedge_stats['hedged']} of {self._hedge_stats['sent']} requests, {self._hedge_stats['won']} hedges answered first")
+
+        self.logger.info(f"Request queue: peak depth {self._queue_depth_peak}, max {self._max_pending} pending per fetch")
+
+        if self._cache:
+            stats = self._cache.stats()
+            self.logger.info(f"Response cache: {stats['hit']} hits, {stats['revalidated']} revalidations, {stats['miss']} misses, "
+                             f"{stats['evicted']} evicted, {stats['size'] / 1024 / 1024:.1f} MB")
+
+        for name, window in self._windows.items():
+            history = ", ".join(f"{time.strftime('%H:%M:%S', time.localtime(ts))} {size} ({reason})" for ts, size, reason in window.history)
+            self.logger.info(f"Concurrency window <{name}>: final {window.window} p95 {window.p95() or 0:.3f}s history: {history}")
+
+    @property
+    def deadline(self):
+        return self._deadline
+
+    @property
+    def expired(self):
+        return self._expired
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def _expire(self):
+        """
+        Cancel requests in flight. Must be called from event loop.
+        :return:
+        """
+
+        self._expired = True
+
+        for task in list(self._memo.values()):
+            if not task.done():
+                task.cancel()
+
+    def set_deadline(self, seconds: float = 0):
+        """
+        Cancel requests in flight after seconds and fail later requests right away.
+        :param seconds: time budget
+        :return:
+        """
+
+        async def schedule():
+            self._deadline_handle = self._loop.call_later(seconds, self._expire)
+
+        self._deadline = time.monotonic() + seconds
+        asyncio.run_coroutine_threadsafe(schedule(), self._loop).result()
+
+    def expire(self):
+        """
+        Cancel requests in flight and fail later requests right away. Used on interrupt.
+        :return:
+        """
+
+        self._loop.call_soon_threadsafe(self._expire)
+
+    def reset(self):
+        """
+        Start a new run on the same engine. Memoized responses, dropped and degraded urls of the previous run are released.
+        Connections, rate limiters, concurrency windows, latencies and circuit breakers are kept.
+        :return:
+        """
+
+        async def clear():
+            self._memo.clear()
+            self._primed.clear()
+            self._listed.clear()
+
+            if self._deadline_handle:
+                self._deadline_handle.cancel()
+
+            self._deadline_handle = None
+            self._expired = False
+
+        asyncio.run_coroutine_threadsafe(clear(), self._loop).result()
+        self._dropped = list()
+        self._degraded = dict()
+        self._deadline = None
+        self._cancelled = list()
+        self._profile = dict()
+
+    async def _aclose(self):
+        for credential in self._credentials.credentials:
+            await credential.transport.aclose()
+
+    def close(self):
+        """
+        Stop event loop, release worker threads and close transport connections.
+        :return:
+        """
+
+        if self._loop.is_running():
+            # Clients of non-blocking transports belong to the event loop and are closed on it
+            asyncio.run_coroutine_threadsafe(self._aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+        self._executor.shutdown(wait=False)
+
+        if self._disk_executor:
+            self._disk_executor.shutdown(wait=True)
+
+        self._credentials.close()
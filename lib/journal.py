@@ -0,0 +1,240 @@
+"""
+authors: cklewar
+"""
+
+import json
+import os
+import queue
+import threading
+from logging import Logger
+
+from requests import Response
+
+from lib.cache import make_response
+
+
+class Journal(object):
+    """
+    Append only journal of a run. Lets a run which died before its data reached disk resume where it stopped.
+
+    Every line is a json record. The first record describes the run (api url, namespace, site). Successful responses are
+    recorded as "fetch" records, every finished processor as "processor" record holding its result. Records are written by
+    a background writer thread, so recording never blocks the engine event loop. Records are flushed as they are written,
+    processor records are synced to disk.
+
+    On resume the journal is read back. Processor results are handed to Api which merges them into data instead of running
+    the processor again. Responses of fetch records are served for their url instead of sending a request. Bodies stay on
+    disk and are read on demand. File I/O never runs under the lock guarding the index of recorded responses, so a sync of
+    the writer does not hold up lookups. A journal of another run is discarded, a record cut off by a crash ends the journal.
+
+    Methods
+    -------
+    replayable(url: str = None)
+        True if a response has been recorded for url
+    response(url: str = None)
+        response recorded for url or None
+    record(url: str = None, r: Response = None)
+        append successful response for url
+    milestone(name: str = None, data: dict = None)
+        append result of finished processor
+    clear()
+        drop all records. Called when data of the run has been written
+    close()
+        close journal file
+    """
+
+    def __init__(self, path: str = None, run: dict = None, resume: bool = False, logger: Logger = None):
+        """
+        :param path: journal file
+        :param run: identifies run e.g. api url, namespace and site. Journal of a different run is not resumed
+        :param resume: resume from existing journal
+        :param logger: log instance for writing / printing log information
+        """
+
+        self._path = path
+        self._run = run if run else dict()
+        self._logger = logger
+        # Guards offsets, recorded urls and stats. Never held during file I/O
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._offsets = dict()
+        self._processors = dict()
+        self._stats = {"replayed": 0, "recorded": 0}
+        self._fd = None
+        self._reader = None
+        # Urls recorded by this run. Their offset is known once the writer appended them
+        self._recorded = set()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write, name="journal", daemon=True)
+
+        if resume and os.path.exists(path):
+            self._load()
+
+        if self._offsets or self._processors:
+            self._fd = open(path, "ab")
+            self.logger.info(f"Resuming from journal {path}: {len(self._offsets)} responses, {len(self._processors)} finished processors")
+        else:
+            self._start()
+
+        self._reader = open(path, "rb")
+        self._writer.start()
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def processors(self):
+        return self._processors
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def _start(self):
+        """
+        Start empty journal holding the run record only.
+        :return:
+        """
+
+        self._fd = open(self._path, "wb")
+        self._append(self._encode({"type": "run", "run": self._run}), sync=True)
+
+    def _load(self):
+        """
+        Index fetch records by url and read processor records. File is truncated after the last complete record.
+        :return:
+        """
+
+        offset = 0
+        offsets = dict()
+        processors = dict()
+
+        with open(self._path, "rb") as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+
+                if not line.endswith(b"\n"):
+                    break
+
+                if offset == 0 and (record.get("type") != "run" or record.get("run") != self._run):
+                    self.logger.info(f"Journal {self._path} belongs to another run. Starting over")
+                    return
+
+                if record.get("type") == "fetch":
+                    offsets[record["url"]] = offset
+                elif record.get("type") == "processor":
+                    processors[record["name"]] = record["data"]
+
+                offset += len(line)
+
+        if offset == 0:
+            return
+
+        os.truncate(self._path, offset)
+        self._offsets = offsets
+        self._processors = processors
+
+    @staticmethod
+    def _encode(record: dict = None) -> bytes:
+        return json.dumps(record).encode("utf-8") + b"\n"
+
+    def _append(self, line: bytes = None, sync: bool = False) -> int:
+        """
+        Append record. Caller is the writer thread or the only user of the journal.
+        :param line: encoded record
+        :param sync: sync journal to disk
+        :return: offset of record
+        """
+
+        offset = self._fd.tell()
+        self._fd.write(line)
+        self._fd.flush()
+
+        if sync:
+            os.fsync(self._fd.fileno())
+
+        return offset
+
+    def _write(self):
+        """
+        Append queued records until close() queues None. Runs on writer thread.
+        :return:
+        """
+
+        while True:
+            item = self._queue.get()
+
+            try:
+                if item is None:
+                    return
+
+                line, url, sync = item
+
+                if url is not None:
+                    line = self._encode({"type": "fetch", "url": url, "body": line.decode("utf-8")})
+
+                # Writer thread is the only one appending, file I/O runs without lock
+                offset = self._append(line, sync=sync)
+
+                if url is not None:
+                    with self._lock:
+                        self._offsets[url] = offset
+            finally:
+                self._queue.task_done()
+
+    def replayable(self, url: str = None) -> bool:
+        with self._lock:
+            return url in self._offsets
+
+    def response(self, url: str = None) -> Response | None:
+        with self._lock:
+            offset = self._offsets.get(url)
+
+        if offset is None:
+            return None
+
+        with self._read_lock:
+            self._reader.seek(offset)
+            record = json.loads(self._reader.readline())
+
+        with self._lock:
+            self._stats["replayed"] += 1
+
+        return make_response(url=url, body=record["body"].encode("utf-8"))
+
+    def record(self, url: str = None, r: Response = None):
+        with self._lock:
+            if url in self._offsets or url in self._recorded:
+                return
+
+            self._recorded.add(url)
+            self._stats["recorded"] += 1
+
+        self._queue.put((r.content, url, False))
+
+    def milestone(self, name: str = None, data: dict = None):
+        # Processor result is merged into data of the run afterwards and may change. Record is encoded right away
+        self._queue.put((self._encode({"type": "processor", "name": name, "data": data}), None, True))
+        self._processors[name] = data
+
+    def clear(self):
+        self._queue.join()
+
+        with self._lock:
+            self._recorded = set()
+            self._offsets = dict()
+            self._processors = dict()
+
+        # Writer is idle after join
+        self._fd.close()
+        self._start()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._fd.close()
+        self._reader.close()
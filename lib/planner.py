@@ -0,0 +1,306 @@
+"""
+authors: cklewar
+"""
+
+from logging import Logger
+
+from prettytable import PrettyTable, TableStyle
+
+import lib.const as c
+from lib.endpoint import parse
+from lib.engine import Engine
+from lib.stream import iter_items
+
+
+class Planner(object):
+    """
+    Predict requests, bytes and wall time of a run without running it.
+
+    Only list requests are sent: the list endpoints of every selected processor (see c.PLAN_LIST_URIS) in every namespace
+    they are scoped to. Detail GETs are counted from list items the way processors issue them: one per listed object, none
+    for collections served from list responses in bulk mode. Lists of processors in c.PLAN_REPORT_FIELDS are read with
+    report fields to count the requests depending on object content:
+        - every listed site gets its site object. Sites with a kind and site state ONLINE get the object of their kind with
+          site_details selected. Legacy sites are judged by site state since their deployment status is not listed
+        - every site mesh group gets the virtual site it refers to, unless the virtual site processor fetches it anyway
+    Hardware info is read from the site object. Objects referenced by site details (c.PLAN_SITE_OBJECT_COLLECTIONS) are not
+    listed anywhere, their number is taken from the profile of the last run.
+
+    Bytes and seconds per request come from the profile of the last run (see Engine.profile). Collections not in the
+    profile use the latency of the list requests sent by the plan or c.PLAN_DEFAULT_BYTES / c.PLAN_DEFAULT_LATENCY.
+
+    Processors run in phases given by their requires. Within a processor requests are sent stage by stage (lists, objects,
+    objects referenced by them). A stage takes its requests times latency spread over workers or its requests at the rate
+    limit, whichever is longer. A phase takes as long as its slowest processor or all its requests spread over workers.
+
+    Methods
+    -------
+    run()
+        send list requests and predict requests, bytes and seconds per processor
+    table()
+        plan as table
+    """
+
+    def __init__(self, engine: Engine = None, api_url: str = None, namespaces: list = None, processors: dict = None, site_processors: list = None,
+                 bulk: bool = False, profile: dict = None, workers: int = 10, rate: float = 0, logger: Logger = None):
+        """
+        :param engine: fetch engine sending list requests
+        :param api_url: F5XC API URL
+        :param namespaces: namespaces of the run
+        :param processors: processor name -> class of processors to run
+        :param site_processors: site object processors to run
+        :param bulk: predict run fetching full objects with list requests
+        :param profile: profile of the last run. None predicts bytes and latency from list requests and defaults
+        :param workers: number of requests in flight
+        :param rate: requests per second across all api tokens. 0 is unlimited
+        :param logger: log instance for writing / printing log information
+        """
+
+        self._engine = engine
+        self._api_url = api_url
+        self._namespaces = namespaces
+        self._processors = processors
+        self._site_processors = site_processors if site_processors else list()
+        self._bulk = bulk
+        self._profile = profile if profile else dict()
+        self._workers = max(1, workers)
+        self._rate = rate
+        self._logger = logger
+        self._plan = dict()
+        # processor name -> items of its lists
+        self._items = dict()
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def plan(self):
+        return self._plan
+
+    def _list_urls(self, name: str = None) -> list[str]:
+        namespaces = [c.PLAN_NAMESPACES[name]] if name in c.PLAN_NAMESPACES else self._namespaces
+
+        query = f"?{c.BULK_QUERY}" if name in c.PLAN_REPORT_FIELDS else ""
+
+        return [self._api_url + uri.format(namespace=namespace) + query for namespace in namespaces for uri in c.PLAN_LIST_URIS[name]]
+
+    @staticmethod
+    def _average(profile: dict = None, collections: list = None, scope: str = None) -> tuple[float, float] | None:
+        """
+        Bytes and seconds per request to collections recorded in profile.
+        :param profile: collection -> scope -> requests, bytes and seconds
+        :param collections: collection names
+        :param scope: "list" or "object"
+        :return: bytes and seconds per request or None if collections have not been requested
+        """
+
+        stats = [profile[collection][scope] for collection in collections if scope in profile.get(collection, dict())]
+        requests = sum(stat["requests"] for stat in stats)
+
+        if not requests:
+            return None
+
+        return sum(stat["bytes"] for stat in stats) / requests, sum(stat["seconds"] for stat in stats) / requests
+
+    def _cost(self, collections: list = None, scope: str = None) -> tuple[float, float]:
+        """
+        Expected bytes and seconds per request to collections.
+        :param collections: collection names
+        :param scope: "list" or "object"
+        :return: bytes and seconds per request
+        """
+
+        last = self._average(self._profile, collections, scope)
+
+        if last:
+            return last
+
+        # Object requests take about as long as list requests of their collection sent by the plan. Their size is unknown
+        listed = self._average(self._engine.profile, collections, "list")
+
+        return listed[0] if listed and scope == "list" else c.PLAN_DEFAULT_BYTES, listed[1] if listed else c.PLAN_DEFAULT_LATENCY
+
+    def _profiled(self, collections: list = None) -> int:
+        return sum(self._profile.get(collection, dict()).get("object", dict()).get("requests", 0) for collection in collections)
+
+    @staticmethod
+    def _detailed(item: dict = None) -> bool:
+        """
+        Site gets the object of its kind. Sites listed without report fields are counted.
+        :param item: site list item
+        :return: True if site has a kind and is online
+        """
+
+        if "system_metadata" not in item:
+            return True
+
+        owner_view = item["system_metadata"].get("owner_view")
+
+        return bool(owner_view and owner_view.get("kind")) and item.get("get_spec", dict()).get("site_state") == "ONLINE"
+
+    def _virtual_sites(self) -> int:
+        """
+        Virtual sites requested by the site mesh group processor. Smg fetches the first virtual site of every site mesh group.
+        Virtual sites fetched by the virtual site processor as well are sent once.
+        :return: number of virtual site requests
+        """
+
+        referenced = {smg["get_spec"]["virtual_site"][0]["name"] for smg in self._items.get("smg", list()) if smg.get("get_spec", dict()).get("virtual_site")}
+
+        return len(referenced - {item["name"] for item in self._items.get("vs", list())})
+
+    def _stages(self, name: str = None, listed: dict = None) -> list[list[tuple[list, str, int]]]:
+        """
+        Requests of processor in the order they are sent. Requests of one stage are sent concurrently.
+        :param name: processor name
+        :param listed: collection -> number of list requests and number of listed objects
+        :return: stages of (collections, scope, number of requests)
+        """
+
+        stages = [[([collection], "list", lists) for collection, (lists, _) in listed.items()]]
+
+        if name != "site":
+            stages.append([([collection], "object", 0 if self._bulk and collection in c.BULK_COLLECTIONS else items) for collection, (_, items) in listed.items()])
+
+            if name == "smg":
+                stages.append([(["virtual_sites"], "object", self._virtual_sites())])
+
+            return stages
+
+        stages.append([(["sites"], "object", sum(items for _, items in listed.values()))])
+        detailed = sum(1 for item in self._items.get(name, list()) if self._detailed(item))
+
+        for processor in self._site_processors:
+            if processor in c.PLAN_SITE_OBJECT_COLLECTIONS:
+                collections = c.PLAN_SITE_OBJECT_COLLECTIONS[processor]
+                stages.append([(collections, "object", detailed if processor == c.PLAN_SITE_DETAILS else self._profiled(collections))])
+
+        return stages
+
+    def _duration(self, requests: int = 0, work: float = 0) -> float:
+        """
+        Seconds to send requests taking work seconds in total at configured workers and rate limit.
+        :param requests: number of requests
+        :param work: sum of seconds of all requests
+        :return: seconds
+        """
+
+        return max(work / self._workers, requests / self._rate if self._rate else 0)
+
+    def _phases(self) -> dict:
+        """
+        Phase of every processor. Processors without requirements run in phase 0, others one phase after their latest requirement.
+        :return: processor name -> phase
+        """
+
+        providers = {key: name for name, cls in self._processors.items() for key in cls.provides}
+        phases = dict()
+
+        def phase(name: str = None) -> int:
+            if name not in phases:
+                phases[name] = max([phase(providers[key]) + 1 for key in self._processors[name].requires if key in providers], default=0)
+
+            return phases[name]
+
+        for processor in self._processors:
+            phase(processor)
+
+        return phases
+
+    def run(self) -> dict:
+        """
+        Send list requests and predict requests, bytes and seconds per processor and wall time of the run.
+        :return: plan
+        """
+
+        urls = {name: self._list_urls(name) for name in self._processors}
+        names = {url: name for name, _urls in urls.items() for url in _urls}
+        items = dict()
+        self._items = {name: list() for name in self._processors}
+
+        self.logger.info(f"Plan: reading {sum(len(_urls) for _urls in urls.values())} lists of {len(self._namespaces)} namespaces")
+
+        for url, future in self._engine.fetch([url for _urls in urls.values() for url in _urls]):
+            r = future.result()
+            objects = list(iter_items(r)) if r else list()
+            items[url] = len(objects)
+            self._items[names[url]].extend(objects)
+
+            if not r:
+                self.logger.info(f"Plan: reading {url} failed. Objects of this list are not counted")
+
+        if not self._profile:
+            self.logger.info("Plan: no profile of a previous run. Objects referenced by site details are not counted, "
+                             "bytes and latency of object requests are guessed")
+
+        phases = self._phases()
+        processors = dict()
+        work = dict()
+
+        for name in self._processors:
+            listed = dict()
+
+            for url in urls[name]:
+                lists, count = listed.get(parse(url)[1], (0, 0))
+                listed[parse(url)[1]] = (lists + 1, count + items[url])
+
+            entry = {"phase": phases[name], "lists": len(urls[name]), "listed": sum(count for _, count in listed.values()), "requests": 0, "bytes": 0, "seconds": 0.0}
+
+            for stage in self._stages(name, listed):
+                requests = 0
+                seconds = 0.0
+
+                for collections, scope, count in stage:
+                    size, latency = self._cost(collections, scope)
+                    requests += count
+                    seconds += count * latency
+                    entry["bytes"] += int(count * size)
+
+                    if scope == "object":
+                        entry["requests"] += count
+
+                entry["seconds"] += self._duration(requests, seconds)
+                totals = work.setdefault(phases[name], [0, 0.0])
+                totals[0] += requests
+                totals[1] += seconds
+
+            processors[name] = entry
+
+        # Processors of a phase share workers and rate limit
+        wall_time = sum(max(max(entry["seconds"] for entry in processors.values() if entry["phase"] == phase), self._duration(*work[phase])) for phase in work)
+        self._plan = {
+            "processors": processors,
+            "total": {key: sum(entry[key] for entry in processors.values()) for key in ["lists", "listed", "requests", "bytes"]},
+            "wall_time": wall_time,
+            "workers": self._workers,
+            "rate": self._rate,
+            "bulk": self._bulk,
+        }
+
+        total = self._plan["total"]
+        self.logger.info(f"Plan: {total['lists']} list requests, {total['requests']} detail requests, {total['bytes'] / 1024 / 1024:.1f} MB, "
+                         f"about {wall_time:.0f}s with {self._workers} workers{f' at {self._rate:g} requests/s' if self._rate else ''}")
+
+        return self._plan
+
+    def table(self) -> PrettyTable:
+        """
+        Plan as table with one row per processor and totals.
+        :return: table
+        """
+
+        table = PrettyTable()
+        table.set_style(TableStyle.SINGLE_BORDER)
+        table.field_names = ["Processor", "Phase", "Lists", "Listed", "Requests", "MB", "Seconds"]
+        table.title = "Plan"
+        table.padding_width = 1
+
+        for name, entry in self._plan["processors"].items():
+            table.add_row([name, entry["phase"], entry["lists"], entry["listed"], entry["requests"], f"{entry['bytes'] / 1024 / 1024:.2f}", f"{entry['seconds']:.1f}"])
+
+        total = self._plan["total"]
+        table.add_divider()
+        table.add_row(["total", "", total["lists"], total["listed"], total["requests"], f"{total['bytes'] / 1024 / 1024:.2f}", f"{self._plan['wall_time']:.1f}"])
+
+        return table
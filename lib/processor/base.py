@@ -1,20 +1,35 @@
-import concurrent.futures
+import copy
+import json
 from abc import abstractmethod
+from itertools import chain
 from logging import Logger
-from typing import Any
+from typing import Any, Iterator
 
 from requests import Response, Session
 
 import lib.const as c
+from lib.engine import Engine
+from lib.snapshot import Snapshot
+from lib.stream import iter_items
 
 
 class Base(object):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    # Data the processor reads and produces. Used by Api.run to schedule processors with satisfied requirements concurrently
+    requires = list()
+    provides = list()
+    # Processor requests only objects related to the site given with -s instead of listing whole collections
+    site_filter = False
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None):
         self._session = session
+        self._engine = engine
+        self._snapshot = snapshot
         self.api_url = api_url
         self._site = site
         self._urls = list()
         self._data = data
+        self._live_sites = None
         self._workers = workers
         self._logger = logger
         self.must_break = False
@@ -35,6 +50,14 @@ class Base(object):
     def session(self):
         return self._session
 
+    @property
+    def engine(self):
+        return self._engine
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
     @property
     def workers(self):
         return self._workers
@@ -49,6 +72,64 @@ class Base(object):
     def __repr__(self):
         return f"class: {self.__class__.__name__}, api_url: {self.api_url}, site: {self._site}, workers: {self.workers}"
 
+    @classmethod
+    def workspace(cls, data: dict = None) -> dict:
+        """
+        Data a processor run works on. Dicts processors add their results to (site types, sites, site namespaces) are
+        copied, everything below is shared with data and only read. Values of keys the processor provides are copied in full.
+        Must be taken on the thread merging results into data.
+        :param data: data of the run
+        :return: working data
+        """
+
+        def copy_entry(entry: dict = None) -> dict:
+            entry = {key: copy.deepcopy(value) if key in cls.provides else value for key, value in entry.items()}
+
+            if isinstance(entry.get("namespaces"), dict):
+                entry["namespaces"] = {namespace: copy_entry(objects) for namespace, objects in entry["namespaces"].items()}
+
+            return entry
+
+        workspace = {key: copy.deepcopy(value) if key in cls.provides else value for key, value in data.items() if key != c.SNAPSHOT_VERSIONS_KEY}
+
+        for site_type in c.F5XC_SITE_TYPES:
+            if site_type in data and site_type not in cls.provides:
+                workspace[site_type] = {name: copy_entry(entry) for name, entry in data[site_type].items()}
+
+        if "referring" in data:
+            workspace["referring"] = {site_type: dict(referring) for site_type, referring in data["referring"].items()}
+
+        return workspace
+
+    @classmethod
+    def result(cls, workspace: dict = None, keys: set = None) -> dict:
+        """
+        Everything a processor run produced: keys it provides at top level, per site and per site namespace, top level keys
+        added by the run and c.PROCESSOR_SHARED_KEYS.
+        :param workspace: working data after processor run
+        :param keys: top level keys of workspace before processor run
+        :return: data to merge into data of the run
+        """
+
+        def pick(entry: dict = None) -> dict:
+            picked = {key: value for key, value in entry.items() if key in cls.provides}
+            namespaces = {namespace: pick(objects) for namespace, objects in entry.get("namespaces", dict()).items()}
+            namespaces = {namespace: objects for namespace, objects in namespaces.items() if objects}
+
+            if namespaces:
+                picked["namespaces"] = namespaces
+
+            return picked
+
+        result = {key: value for key, value in workspace.items() if key in cls.provides or key in c.PROCESSOR_SHARED_KEYS or key not in keys}
+
+        for site_type in c.F5XC_SITE_TYPES:
+            if site_type in workspace and site_type not in result:
+                entries = {name: pick(entry) for name, entry in workspace[site_type].items()}
+                result[site_type] = {name: entry for name, entry in entries.items() if entry}
+
+        return result
+
     def get_site_nic_mode(self, site: str = None) -> str | None:
         """
         Check if interface mode key exists in given data. Return site interface mode which is Single NIC or Dual NIC.
@@ -84,13 +165,7 @@ class Base(object):
         :param url: Actual URL to run GET request on
         :return: requests.Response
         """
-        r = self.session.get(url)
-
-        if 200 != r.status_code:
-            self.logger.debug("get failed for {} with {}".format(url, r.status_code))
-            return False
-
-        return r if r else False
+        return self.engine.get(url)
 
     def build_url(self, uri: str = None) -> str:
         """
@@ -100,29 +175,154 @@ class Base(object):
         """
         return "{}{}".format(self.api_url, uri)
 
+    def stream(self, name: str = None, urls: dict[str, Any] | list[str] = None) -> Iterator[dict]:
+        """
+        Get urls and yield results as they arrive. Responses are released once the consumer moved on to the next result.
+        :param name: name used in log messages
+        :param urls: dict of url -> object name or list of list urls
+        :return: iterator of {"object": name, "data": object} for dict urls or {url: items} for list urls
+        """
+
+        self.logger.info(f"Prepare {name} query...")
+
+        for url, future in self.engine.fetch(urls):
+            self.logger.info(f"process {name} get item: {url} ...")
+            try:
+                data = future.result()
+            except Exception as exc:
+                self.logger.info('%s: %r generated an exception: %s' % (f"process {name}", url, exc))
+            else:
+                self.logger.info(f"process {name} got item: {url} ...")
+                if data:
+                    if isinstance(urls, dict):
+                        yield {"object": urls[url], "data": data.json()}
+                    elif isinstance(urls, list):
+                        items = list(iter_items(data))
+                        if items:
+                            yield {url: items}
+
     def execute(self, name: str = None, urls: dict[str, Any] | list[str] = None) -> list | None:
-        resp = list()
+        return list(self.stream(name=name, urls=urls))
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+    def fetch_items(self, name: str = None, urls: list[str] = None, kinds: list[str] = None) -> Iterator[tuple[str, Any]]:
+        """
+        Get list urls and all objects contained in list responses. Object requests of a list are submitted as soon as
+        its list response arrives. Yields object url and future as objects arrive.
+        Site filtered runs skip the lists and fetch only objects of given kinds referring to the site if these are known.
+        Otherwise objects which referred to the site in the previous snapshot are fetched first. The lists are still read
+        afterwards to catch new references, objects fetched already are not requested again.
+        In incremental runs list items still having the resource_version of the previous run are served from the snapshot
+        or skipped if they did not refer to any site. Versions of all listed objects are recorded for the next run.
+        :param name: name used in log messages
+        :param urls: list urls
+        :param kinds: referring object kinds of listed objects
+        :return: iterator of (object url, future) tuples
+        """
+
+        referring = self.referring_urls(kinds=kinds) if kinds else None
+
+        if referring is not None:
             self.logger.info(f"Prepare {name} query...")
+            return self.engine.fetch(referring)
+
+        previous = self.referring_urls(kinds=kinds, source="previous") if kinds else None
+        fetched = set(previous) if previous else set()
+
+        def expand(url: str = None, result: Response | bool = None) -> Iterator[str]:
+            self.logger.info(f"process {name} got list: {url} ...")
+
+            for item in iter_items(result):
+                _url = "{}/{}".format(url, item['name'])
+
+                if _url in fetched or (self.snapshot is not None and self.unchanged(_url, item)):
+                    continue
+
+                yield _url
+
+        self.logger.info(f"Prepare {name} query...")
+
+        if previous:
+            return chain(self.engine.fetch(previous), self.engine.fetch(urls, expand=expand))
+
+        return self.engine.fetch(urls, expand=expand)
+
+    def unchanged(self, url: str = None, item: dict = None) -> bool:
+        """
+        Record resource_version of list item. Check if object did not change since the previous run. Unchanged objects which
+        referred to a site are served from the snapshot. Unchanged objects which did not are skipped unless the sites being up
+        changed since the previous run, these may refer to a site which failed or did not exist before.
+        :param url: object url
+        :param item: list item
+        :return: True if object does not have to be processed
+        """
+
+        uri = url[len(self.api_url):]
+        version = item.get("metadata", dict()).get("resource_version")
+
+        if version is None:
+            return False
+
+        self.data.setdefault(c.SNAPSHOT_VERSIONS_KEY, dict())[uri] = version
+
+        if not self.snapshot.unchanged(uri, version):
+            return False
+
+        stored = self.snapshot.get(uri)
+
+        if stored is None:
+            if self._live_sites is None:
+                self._live_sites = self.snapshot.live_sites(self.data)
+
+            if not self.snapshot.sites_unchanged(self._live_sites):
+                return False
+
+            self.snapshot.count("skipped")
+            return True
+
+        self.snapshot.count("reused")
+        self.engine.prime(url, json.dumps(stored).encode("utf-8"))
+
+        return False
+
+    def store_referring(self, site_type: str = None, name: str = None, data: dict = None):
+        """
+        Remember objects referring to the site given with -s. Only stored if the api returned referring objects.
+        :param site_type: one of c.F5XC_SITE_TYPES
+        :param name: site or virtual site name
+        :param data: object returned by the api
+        :return:
+        """
+
+        if self.site and "referring_objects" in data:
+            self.data.setdefault("referring", dict()).setdefault(site_type, dict())[name] = data["referring_objects"]
+
+    def referring_urls(self, kinds: list[str] = None, source: str = "referring") -> list[str] | None:
+        """
+        Object urls of given kinds referring to the site given with -s or to the virtual site of the same name.
+        Site filtered runs fetch these objects directly instead of listing the collection in every namespace.
+        :param kinds: referring object kinds e.g. "origin_pool"
+        :param source: "referring" for referring objects returned by the api or "previous" for objects taken from previous snapshot
+        :return: list of object urls. None if not filtered by site or referring objects are unknown
+        """
+
+        if not self.site:
+            return None
+
+        urls = list()
+
+        for site_type in c.F5XC_SITE_TYPES:
+            if self.site in self.data[site_type]:
+                refs = self.data.get(source, dict()).get(site_type, dict()).get(self.site)
+
+                if refs is None:
+                    self.logger.info(f"{self} {source} objects of {site_type} <{self.site}> unknown")
+                    return None
+
+                urls.extend(self.build_url(c.URI_F5XC_OBJECT.format(namespace=ref["namespace"], kind=ref["kind"], name=ref["name"])) for ref in refs if ref["kind"] in kinds)
+
+        self.logger.info(f"{self} fetching {len(urls)} {source} objects of <{self.site}>")
 
-            future_to_ds = {executor.submit(self.get, url=url): url for url in urls}
-            for future in concurrent.futures.as_completed(future_to_ds):
-                _data = future_to_ds[future]
-                self.logger.info(f"process {name} get item: {future_to_ds[future]} ...")
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    self.logger.info('%s: %r generated an exception: %s' % (f"process {name}", _data, exc))
-                else:
-                    self.logger.info(f"process {name} got item: {future_to_ds[future]} ...")
-                    if data:
-                        if isinstance(urls, dict):
-                            resp.append({"object": urls[future_to_ds[future]], "data": data.json()})
-                        elif isinstance(urls, list):
-                            resp.append({future_to_ds[future]: data.json()["items"]}) if data and data.json()["items"] else None
-
-            return resp
+        return urls
 
     @abstractmethod
     def run(self) -> dict:
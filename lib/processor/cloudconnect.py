@@ -1,14 +1,20 @@
-import json
 from logging import Logger
 
 from requests import Session
 
 import lib.const as c
+from lib.engine import Engine
 from lib.processor.base import Base
+from lib.snapshot import Snapshot
+from lib.stream import debug_body, iter_items
 
 
 class Cloudconnect(Base):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    requires = ["site", "failed"]
+    provides = ["cloud_connector"]
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None):
         """
         A class for processing site related cloudconnect data.
         :param session: current http session
@@ -17,8 +23,10 @@ class Cloudconnect(Base):
         :param site: user injected site name to filter for
         :param workers: amount of concurrent threads
         :param logger: log instance for writing / printing log information
+        :param engine: shared fetch engine used to run requests
+        :param snapshot: data of previous run in incremental mode
         """
-        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger)
+        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger, engine=engine, snapshot=snapshot)
 
     def run(self) -> dict | None:
         """
@@ -27,6 +35,10 @@ class Cloudconnect(Base):
         :return: structure with cloud connectors information being added
         """
 
+        if self.site and self.site not in self.data["site"]:
+            # Site filtered run for unknown or failed site
+            return self.data
+
         def process():
             try:
                 cloud_connector_name = cloud_connector["data"]["metadata"]["name"]
@@ -51,11 +63,10 @@ class Cloudconnect(Base):
         _ccs = self.get(self.build_url(c.URI_F5XC_CLOUD_CONNECTS).format(namespace=c.F5XC_NAMESPACE_SYSTEM))
 
         if _ccs:
-            self.logger.debug(json.dumps(_ccs.json(), indent=2))
-            ccs = [cc for cc in _ccs.json()['items']]
+            debug_body(self.logger, _ccs)
             urls = dict()
 
-            for cc in ccs:
+            for cc in iter_items(_ccs):
                 urls[self.build_url(c.URI_F5XC_CLOUD_CONNECT.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=cc['name']))] = cc['name']
 
             cloud_connectors = self.execute(name="cloud connector details", urls=urls)
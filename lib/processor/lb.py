@@ -1,11 +1,12 @@
-import concurrent.futures
 import json
 from logging import Logger
 
 from requests import Session
 
 import lib.const as c
+from lib.engine import Engine
 from lib.processor.base import Base
+from lib.snapshot import Snapshot
 
 QUERY_STRING_LB_HTTP = "/http_loadbalancers/"
 QUERY_STRING_LB_TCP = "/tcp_loadbalancers/"
@@ -13,7 +14,12 @@ QUERY_STRING_LB_UDP = "/udp_loadbalancers/"
 
 
 class Lb(Base):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    requires = ["namespaces", "site", "virtual_site", "failed"]
+    provides = ["loadbalancer"]
+    site_filter = True
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None):
         """
         A class for processing site related load balancer data.
         :param session: current http session
@@ -22,8 +28,10 @@ class Lb(Base):
         :param site: user injected site name to filter for
         :param workers: amount of concurrent threads
         :param logger: log instance for writing / printing log information
+        :param engine: shared fetch engine used to run requests
+        :param snapshot: data of previous run in incremental mode
         """
-        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger)
+        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger, engine=engine, snapshot=snapshot)
 
         for namespace in self.data["namespaces"]:
             for lb_type in c.F5XC_LOAD_BALANCER_TYPES:
@@ -37,22 +45,6 @@ class Lb(Base):
         :return: structure with load balancer information being added
         """
 
-        lbs = list()
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            self.logger.info("Prepare load balancer query...")
-            future_to_ds = {executor.submit(self.get, url=url): url for url in self.urls}
-
-            for future in concurrent.futures.as_completed(future_to_ds):
-                _data = future_to_ds[future]
-
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    self.logger.info('%r generated an exception: %s' % (_data, exc))
-                else:
-                    lbs.append({future_to_ds[future]: data.json()["items"]}) if data and data.json()["items"] else None
-
         def process():
             try:
                 lb_name = r["metadata"]["name"]
@@ -66,7 +58,7 @@ class Lb(Base):
                     self.data[site_type][site_name]['namespaces'][namespace] = dict()
                 if "loadbalancer" not in self.data[site_type][site_name]['namespaces'][namespace].keys():
                     self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"] = dict()
-                if QUERY_STRING_LB_TCP in future_to_ds[future]:
+                if QUERY_STRING_LB_TCP in url:
                     if "tcp" not in self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"].keys():
                         self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"]["tcp"] = dict()
                     self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"]["tcp"][lb_name] = dict()
@@ -76,7 +68,7 @@ class Lb(Base):
                     self.data[site_type][site_name]['namespaces'][namespace]['loadbalancer']["tcp"][lb_name]['spec'] = r['spec']
                     self.data[site_type][site_name]['namespaces'][namespace]['loadbalancer']["tcp"][lb_name]['metadata'] = r['metadata']
                     self.data[site_type][site_name]['namespaces'][namespace]['loadbalancer']["tcp"][lb_name]['system_metadata'] = r['system_metadata']
-                if QUERY_STRING_LB_UDP in future_to_ds[future]:
+                if QUERY_STRING_LB_UDP in url:
                     if "udp" not in self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"].keys():
                         self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"]["udp"] = dict()
                     self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"]["udp"][lb_name] = dict()
@@ -86,7 +78,7 @@ class Lb(Base):
                     self.data[site_type][site_name]['namespaces'][namespace]['loadbalancer']["udp"][lb_name]['spec'] = r['spec']
                     self.data[site_type][site_name]['namespaces'][namespace]['loadbalancer']["udp"][lb_name]['metadata'] = r['metadata']
                     self.data[site_type][site_name]['namespaces'][namespace]['loadbalancer']["udp"][lb_name]['system_metadata'] = r['system_metadata']
-                if QUERY_STRING_LB_HTTP in future_to_ds[future]:
+                if QUERY_STRING_LB_HTTP in url:
                     if "http" not in self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"].keys():
                         self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"]["http"] = dict()
                     self.data[site_type][site_name]['namespaces'][namespace]["loadbalancer"]["http"][lb_name] = dict()
@@ -103,52 +95,38 @@ class Lb(Base):
                 self.logger.info("system_metadata:", r['system_metadata'])
                 self.logger.info("Exception:", e)
 
-        urls = list()
-
-        for item in lbs:
-            for url, lbs in item.items():
-                for lb in lbs:
-                    _url = "{}/{}".format(url, lb['name'])
-                    urls.append(_url)
+        for url, future in self.fetch_items(name="loadbalancer", urls=self.urls, kinds=c.REFERRING_KINDS_LOAD_BALANCER):
+            self.must_break = False
 
-        self.logger.debug(f"process loadbalancer url: {urls}")
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            future_to_ds = {executor.submit(self.get, url=url): url for url in urls}
-
-            for future in concurrent.futures.as_completed(future_to_ds):
-                _data = future_to_ds[future]
-                self.must_break = False
-
-                try:
-                    self.logger.info(f"process loadbalancer get item: {future_to_ds[future]} ...")
-                    result = future.result()
-                except Exception as exc:
-                    self.logger.info('%s: %r generated an exception: %s' % ("process loadbalancer", _data, exc))
-                else:
-                    self.logger.info(f"process loadbalancer got item: {future_to_ds[future]} ...")
-
-                    if result:
-                        r = result.json()
-                        self.logger.debug(json.dumps(r, indent=2))
-
-                        if 'advertise_custom' in r['spec'] and 'advertise_where' in r['spec']['advertise_custom']:
-                            for site_info in r['spec']['advertise_custom']['advertise_where']:
-                                if self.must_break:
-                                    break
-                                else:
-                                    for site_type in site_info.keys():
-                                        if site_type in c.F5XC_SITE_TYPES:
-                                            # Referenced site must exist
-                                            if site_info[site_type][site_type]['name'] in self.data[site_type]:
-                                                # Only processing sites which are not in failed state
-                                                if site_info[site_type][site_type]['name'] not in self.data["failed"]:
-                                                    if self.site:
-                                                        if self.site == site_info[site_type][site_type]['name']:
-                                                            self.must_break = True
-                                                            process()
-                                                            break
-                                                    else:
+            try:
+                self.logger.info(f"process loadbalancer get item: {url} ...")
+                result = future.result()
+            except Exception as exc:
+                self.logger.info('%s: %r generated an exception: %s' % ("process loadbalancer", url, exc))
+            else:
+                self.logger.info(f"process loadbalancer got item: {url} ...")
+
+                if result:
+                    r = result.json()
+                    self.logger.debug(json.dumps(r, indent=2))
+
+                    if 'advertise_custom' in r['spec'] and 'advertise_where' in r['spec']['advertise_custom']:
+                        for site_info in r['spec']['advertise_custom']['advertise_where']:
+                            if self.must_break:
+                                break
+                            else:
+                                for site_type in site_info.keys():
+                                    if site_type in c.F5XC_SITE_TYPES:
+                                        # Referenced site must exist
+                                        if site_info[site_type][site_type]['name'] in self.data[site_type]:
+                                            # Only processing sites which are not in failed state
+                                            if site_info[site_type][site_type]['name'] not in self.data["failed"]:
+                                                if self.site:
+                                                    if self.site == site_info[site_type][site_type]['name']:
+                                                        self.must_break = True
                                                         process()
+                                                        break
+                                                else:
+                                                    process()
 
         return self.data
@@ -1,15 +1,21 @@
-import concurrent.futures
 import json
 from logging import Logger
 
 from requests import Session
 
 import lib.const as c
+from lib.engine import Engine
 from lib.processor.base import Base
+from lib.snapshot import Snapshot
 
 
 class Originpool(Base):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    requires = ["namespaces", "site", "virtual_site", "failed"]
+    provides = ["origin_pools"]
+    site_filter = True
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None):
         """
         A class for processing site related origin pool data.
         :param session: current http session
@@ -18,8 +24,10 @@ class Originpool(Base):
         :param site: user injected site name to filter for
         :param workers: amount of concurrent threads
         :param logger: log instance for writing / printing log information
+        :param engine: shared fetch engine used to run requests
+        :param snapshot: data of previous run in incremental mode
         """
-        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger)
+        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger, engine=engine, snapshot=snapshot)
 
         for namespace in self.data["namespaces"]:
             self.urls.append(self.build_url(c.URI_F5XC_ORIGIN_POOLS.format(namespace=namespace)))
@@ -32,8 +40,6 @@ class Originpool(Base):
         :return: structure with origin pool information being added
         """
 
-        _origin_pools = self.execute(name="origin pools", urls=self.urls)
-
         def process():
             try:
                 origin_pool_name = r["metadata"]["name"]
@@ -64,61 +70,47 @@ class Originpool(Base):
                 self.logger.info("system_metadata:", r['system_metadata'])
                 self.logger.info("Exception:", e)
 
-        urls = list()
-
-        for item in _origin_pools:
-            for url, origin_pools in item.items():
-                for origin_pool in origin_pools:
-                    _url = "{}/{}".format(url, origin_pool['name'])
-                    urls.append(_url)
-
-        self.logger.debug(f"process origin pools url: {urls}")
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            future_to_ds = {executor.submit(self.get, url=url): url for url in urls}
-            self.must_break = False
-
-            for future in concurrent.futures.as_completed(future_to_ds):
-                _data = future_to_ds[future]
-
-                try:
-                    self.logger.info(f"process origin pools get item: {future_to_ds[future]} ...")
-                    result = future.result()
-                except Exception as exc:
-                    self.logger.info('%s: %r generated an exception: %s' % ("process origin pools", _data, exc))
-                else:
-                    self.logger.info(f"process origin pools got item: {future_to_ds[future]} ...")
-
-                    if result:
-                        r = result.json()
-                        self.logger.debug(json.dumps(r, indent=2))
-                        origin_servers = r['spec'].get('origin_servers', [])
-
-                        for origin_server in origin_servers:
-                            if self.must_break:
-                                break
-                            else:
-                                for key in c.F5XC_ORIGIN_SERVER_TYPES:
-                                    if self.must_break:
-                                        break
-                                    else:
-                                        site_locator = origin_server.get(key, {}).get('site_locator', {})
-
-                                        for site_type, site_data in site_locator.items():
-                                            site_name = site_data.get('name')
-
-                                            if site_name:
-                                                # Referenced site must exist
-                                                if site_name in self.data[site_type]:
-                                                    # Only processing sites which are not in failed state
-                                                    if site_name not in self.data["failed"]:
-                                                        if self.site:
-
-                                                            if self.site == site_name:
-                                                                self.must_break = True
-                                                                process()
-                                                                break
-                                                        else:
+        self.must_break = False
+
+        for url, future in self.fetch_items(name="origin pools", urls=self.urls, kinds=c.REFERRING_KINDS_ORIGIN_POOL):
+            try:
+                self.logger.info(f"process origin pools get item: {url} ...")
+                result = future.result()
+            except Exception as exc:
+                self.logger.info('%s: %r generated an exception: %s' % ("process origin pools", url, exc))
+            else:
+                self.logger.info(f"process origin pools got item: {url} ...")
+
+                if result:
+                    r = result.json()
+                    self.logger.debug(json.dumps(r, indent=2))
+                    origin_servers = r['spec'].get('origin_servers', [])
+
+                    for origin_server in origin_servers:
+                        if self.must_break:
+                            break
+                        else:
+                            for key in c.F5XC_ORIGIN_SERVER_TYPES:
+                                if self.must_break:
+                                    break
+                                else:
+                                    site_locator = origin_server.get(key, {}).get('site_locator', {})
+
+                                    for site_type, site_data in site_locator.items():
+                                        site_name = site_data.get('name')
+
+                                        if site_name:
+                                            # Referenced site must exist
+                                            if site_name in self.data[site_type]:
+                                                # Only processing sites which are not in failed state
+                                                if site_name not in self.data["failed"]:
+                                                    if self.site:
+
+                                                        if self.site == site_name:
+                                                            self.must_break = True
                                                             process()
+                                                            break
+                                                    else:
+                                                        process()
 
         return self.data
@@ -1,15 +1,21 @@
-import concurrent.futures
 import json
 from logging import Logger
 
 from requests import Session
 
 import lib.const as c
+from lib.engine import Engine
 from lib.processor.base import Base
+from lib.snapshot import Snapshot
 
 
 class Proxy(Base):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    requires = ["namespaces", "site", "virtual_site", "failed"]
+    provides = ["proxys"]
+    site_filter = True
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None):
         """
         A class for processing site related proxy data.
         :param session: current http session
@@ -18,8 +24,10 @@ class Proxy(Base):
         :param site: user injected site name to filter for
         :param workers: amount of concurrent threads
         :param logger: log instance for writing / printing log information
+        :param engine: shared fetch engine used to run requests
+        :param snapshot: data of previous run in incremental mode
         """
-        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger)
+        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger, engine=engine, snapshot=snapshot)
 
         for namespace in self.data["namespaces"]:
             self.urls.append(self.build_url(c.URI_F5XC_PROXIES.format(namespace=namespace)))
@@ -32,8 +40,6 @@ class Proxy(Base):
         :return: structure with proxies information being added
         """
 
-        proxies = self.execute(name="proxies query", urls=self.urls)
-
         def process():
             try:
                 proxy_name = r["metadata"]["name"]
@@ -61,47 +67,33 @@ class Proxy(Base):
                 self.logger.info("system_metadata:", r['system_metadata'])
                 self.logger.info("Exception:", e)
 
-        urls = list()
-
-        for item in proxies:
-            for url, proxies in item.items():
-                for proxy in proxies:
-                    _url = "{}/{}".format(url, proxy['name'])
-                    urls.append(_url)
-
-        self.logger.debug(f"process proxies url: {urls}")
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            future_to_ds = {executor.submit(self.get, url=url): url for url in urls}
-            self.must_break = False
+        self.must_break = False
 
-            for future in concurrent.futures.as_completed(future_to_ds):
-                _data = future_to_ds[future]
-
-                try:
-                    self.logger.info(f"process proxies get item: {future_to_ds[future]} ...")
-                    result = future.result()
-                except Exception as exc:
-                    self.logger.info('%s: %r generated an exception: %s' % ("process proxies", _data, exc))
-                else:
-                    self.logger.info(f"process proxies got item: {future_to_ds[future]} ...")
-
-                    if result:
-                        r = result.json()
-                        self.logger.debug(json.dumps(r, indent=2))
-
-                        site_virtual_sites = r['spec'].get('site_virtual_sites', {})
-                        advertise_where = site_virtual_sites.get('advertise_where', [])
-
-                        for site_info in advertise_where:
-                            for site_type in site_info.keys():
-                                if site_type in c.F5XC_SITE_TYPES:
-                                    # Referenced site must exist
-                                    if site_info[site_type][site_type]['name'] in self.data[site_type]:
-                                        # Only processing sites which are not in failed state
-                                        if site_info[site_type][site_type]['name'] not in self.data["failed"]:
-                                            if self.site:
-                                                if self.site == site_info[site_type][site_type]['name']:
-                                                    process()
+        for url, future in self.fetch_items(name="proxies", urls=self.urls, kinds=c.REFERRING_KINDS_PROXY):
+            try:
+                self.logger.info(f"process proxies get item: {url} ...")
+                result = future.result()
+            except Exception as exc:
+                self.logger.info('%s: %r generated an exception: %s' % ("process proxies", url, exc))
+            else:
+                self.logger.info(f"process proxies got item: {url} ...")
+
+                if result:
+                    r = result.json()
+                    self.logger.debug(json.dumps(r, indent=2))
+
+                    site_virtual_sites = r['spec'].get('site_virtual_sites', {})
+                    advertise_where = site_virtual_sites.get('advertise_where', [])
+
+                    for site_info in advertise_where:
+                        for site_type in site_info.keys():
+                            if site_type in c.F5XC_SITE_TYPES:
+                                # Referenced site must exist
+                                if site_info[site_type][site_type]['name'] in self.data[site_type]:
+                                    # Only processing sites which are not in failed state
+                                    if site_info[site_type][site_type]['name'] not in self.data["failed"]:
+                                        if self.site:
+                                            if self.site == site_info[site_type][site_type]['name']:
+                                                process()
 
         return self.data
@@ -4,11 +4,18 @@ from logging import Logger
 from requests import Session
 
 import lib.const as c
+from lib.engine import Engine
 from lib.processor.base import Base
+from lib.snapshot import Snapshot
+from lib.stream import debug_body, iter_items
 
 
 class Segment(Base):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    requires = ["site", "failed"]
+    provides = ["segments"]
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None):
         """
         A class for processing site related segment data.
         :param session: current http session
@@ -17,8 +24,10 @@ class Segment(Base):
         :param site: user injected site name to filter for
         :param workers: amount of concurrent threads
         :param logger: log instance for writing / printing log information
+        :param engine: shared fetch engine used to run requests
+        :param snapshot: data of previous run in incremental mode
         """
-        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger)
+        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger, engine=engine, snapshot=snapshot)
 
     def run(self) -> dict | None:
         """
@@ -27,6 +36,10 @@ class Segment(Base):
         :return: structure with segments information being added
         """
 
+        if self.site and self.site not in self.data["site"]:
+            # Site filtered run for unknown or failed site
+            return self.data
+
         def process():
             try:
                 for site in self.data["site"]:
@@ -53,11 +66,10 @@ class Segment(Base):
         _segments = self.get(self.build_url(c.URI_F5XC_SEGMENTS).format(namespace=c.F5XC_NAMESPACE_SYSTEM))
 
         if _segments:
-            self.logger.debug(json.dumps(_segments.json(), indent=2))
-            tmp_segments = [segment for segment in _segments.json()['items']]
+            debug_body(self.logger, _segments)
             urls = dict()
 
-            for segment in tmp_segments:
+            for segment in iter_items(_segments):
                 urls[self.build_url(c.URI_F5XC_SEGMENT.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=segment['name']))] = segment['name']
 
             segments = self.execute(name="segment details", urls=urls)
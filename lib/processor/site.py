@@ -1,4 +1,3 @@
-import concurrent.futures
 import json
 import pprint
 from logging import Logger
@@ -6,11 +5,19 @@ from logging import Logger
 from requests import Session
 
 import lib.const as c
+from lib.engine import Engine
 from lib.processor.base import Base
+from lib.snapshot import Snapshot
+from lib.stream import debug_body, iter_items
 
 
 class Site(Base):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    requires = ["namespaces"]
+    provides = ["site", "failed"]
+    site_filter = True
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None, site_processors: list = None):
         """
         :param session: current http session
         :param api_url: api url to connect to
@@ -18,6 +25,9 @@ class Site(Base):
         :param site: user injected site name to filter for
         :param workers: amount of concurrent threads
         :param logger: log instance for writing / printing log information
+        :param engine: shared fetch engine used to run requests
+        :param snapshot: data of previous run in incremental mode
+        :param site_processors: site object processors to run. Defaults to c.SITE_OBJECT_PROCESSORS
 
         A class for processing site related data. A site object directly references certain objects like:
         - efp
@@ -33,6 +43,8 @@ class Site(Base):
             start modules to start build site inventory information
         process_site()
             process general site data. Filter sites in available attributes and their status
+        reuse_sites()
+            take sites unchanged since previous run out of site object processing in incremental mode
         process_site_details()
             add site detail information to site inventory. Site details are 'metadata', 'spec', 'main_node_counter', 'worker_node_counter'
         process_efp()
@@ -50,7 +62,8 @@ class Site(Base):
         process_hw_info()
             add site hardware information to site inventory
         """
-        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger)
+        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger, engine=engine, snapshot=snapshot)
+        self._site_processors = c.SITE_OBJECT_PROCESSORS if site_processors is None else site_processors
 
     def run(self) -> dict | None:
         """
@@ -66,22 +79,54 @@ class Site(Base):
         :return: structure with label information being added
         """
 
-        self.logger.info(f"process sites get all sites from {self.build_url(c.URI_F5XC_SITES)}")
-        _sites = self.get(self.build_url(c.URI_F5XC_SITES))
+        if self.site:
+            # Site filter pushed down. Named site is fetched directly instead of listing all sites, failed holds the named site only
+            self.logger.info(f"process sites get site {self.site}")
+            sites = [{"name": self.site}]
+        else:
+            self.logger.info(f"process sites get all sites from {self.build_url(c.URI_F5XC_SITES)}")
+            _sites = self.get(self.build_url(c.URI_F5XC_SITES))
+
+            if not _sites:
+                return None
+
+            debug_body(self.logger, _sites)
+            sites = list(iter_items(_sites))
+
+        if sites:
+            self.process_site(sites=sites)
+            # Sites unchanged since previous run are left out of site object processing
+            reused = self.reuse_sites() if self.snapshot is not None else dict()
+
+            for processor in self._site_processors:
+                getattr(self, f"process_{processor}")()
+
+            self.data['site'].update(reused)
+
+        return self.data
+
+    def reuse_sites(self) -> dict:
+        """
+        Take sites with the resource_version they had in the previous run out of site data. Details, nodes, interfaces etc.
+        of these sites are taken from the snapshot instead of being queried again. Site state has been checked already.
+        :return: site name -> site data of unchanged sites
+        """
 
-        if _sites:
-            self.logger.debug(json.dumps(_sites.json(), indent=2))
-            sites = [site for site in _sites.json()['items'] if self.site == site['name']] if self.site else _sites.json()['items']
+        reused = dict()
 
-            if sites:
-                self.process_site(sites=sites)
+        for name, values in list(self.data['site'].items()):
+            previous = self.snapshot.site(name)
+            version = values['metadata'].get('resource_version')
 
-                for processor in c.SITE_OBJECT_PROCESSORS:
-                    getattr(self, f"process_{processor}")()
+            if previous and version is not None and previous.get('metadata', dict()).get('resource_version') == version:
+                reused[name] = dict(values, **{key: value for key, value in previous.items() if key not in values and key not in c.SNAPSHOT_REFERENCE_KEYS})
+                del self.data['site'][name]
+                self.snapshot.count("sites")
 
-            return self.data
+        if reused:
+            self.logger.info(f"process sites reusing {len(reused)} unchanged sites from snapshot")
 
-        return None
+        return reused
 
     def process_site(self, sites: list = None) -> dict | None:
         """
@@ -98,7 +143,7 @@ class Site(Base):
         for site in sites:
             urls[self.build_url(c.URI_F5XC_SITE.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=site['name']))] = site['name']
 
-        _sites = self.execute(name="general site details", urls=urls)
+        _sites = self.stream(name="general site details", urls=urls)
         for site in _sites:
             # Only process sites with a "kind" key set. Sites without "kind" key are malformed
             if site['data']['system_metadata']["owner_view"]:
@@ -153,6 +198,7 @@ class Site(Base):
                     state, msg = get_site_status(site_kind=site['data']['system_metadata']['owner_view']["kind"])
 
                     if state:
+                        self.store_referring(site_type="site", name=site["object"], data=site['data'])
                         self.data['site'][site["object"]] = dict()
                         self.data['site'][site["object"]]['kind'] = site['data']['system_metadata']['owner_view']["kind"]
                         self.data['site'][site["object"]]['main_node_count'] = len(site['data']['spec']['main_nodes'])
@@ -185,46 +231,42 @@ class Site(Base):
             if 'kind' in values.keys():
                 urls[self.build_url(c.SITE_TYPE_TO_URI_MAP[values['kind']].format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=site))] = site
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            self.logger.info(f"Prepare site details query...")
-            future_to_ds = {executor.submit(self.get, url=url): url for url in urls.keys()}
+        self.logger.info(f"Prepare site details query...")
 
-            for future in concurrent.futures.as_completed(future_to_ds):
-                _data = future_to_ds[future]
+        for url, future in self.engine.fetch(urls.keys()):
+            try:
+                self.logger.info(f"process site details get item: {url} ...")
+                result = future.result()
+            except Exception as exc:
+                self.logger.info('%s: %r generated an exception: %s' % ("process site details", url, exc))
+            else:
+                self.logger.info(f"process site details got item: {url} ...")
 
-                try:
-                    self.logger.info(f"process site details get item: {future_to_ds[future]} ...")
-                    result = future.result()
-                except Exception as exc:
-                    self.logger.info('%s: %r generated an exception: %s' % ("process site details", _data, exc))
-                else:
-                    self.logger.info(f"process site details got item: {future_to_ds[future]} ...")
+                if result:
+                    r = result.json()
+                    self.logger.debug(json.dumps(r, indent=2))
 
-                    if result:
-                        r = result.json()
-                        self.logger.debug(json.dumps(r, indent=2))
+                    if urls[url] in self.data['site']:
+                        if self.get_key_from_site_kind(urls[url]) not in self.data['site'][urls[url]].keys():
+                            self.data['site'][urls[url]][self.get_key_from_site_kind(urls[url])] = dict()
 
-                        if urls[future_to_ds[future]] in self.data['site']:
-                            if self.get_key_from_site_kind(urls[future_to_ds[future]]) not in self.data['site'][urls[future_to_ds[future]]].keys():
-                                self.data['site'][urls[future_to_ds[future]]][self.get_key_from_site_kind(urls[future_to_ds[future]])] = dict()
+                        # Check if site is voltstack enabled
+                        self.data['site'][urls[url]]['sub_kind'] = c.F5XC_SITE_VOLT_STACK if "voltstack_cluster" in r["spec"] else None
+                        self.data['site'][urls[url]][self.get_key_from_site_kind(urls[url])]['metadata'] = r['metadata']
+                        self.data['site'][urls[url]][self.get_key_from_site_kind(urls[url])]['spec'] = r['spec']
 
-                            # Check if site is voltstack enabled
-                            self.data['site'][urls[future_to_ds[future]]]['sub_kind'] = c.F5XC_SITE_VOLT_STACK if "voltstack_cluster" in r["spec"] else None
-                            self.data['site'][urls[future_to_ds[future]]][self.get_key_from_site_kind(urls[future_to_ds[future]])]['metadata'] = r['metadata']
-                            self.data['site'][urls[future_to_ds[future]]][self.get_key_from_site_kind(urls[future_to_ds[future]])]['spec'] = r['spec']
+                        if "worker_nodes" in r['spec'].keys():
+                            self.data['site'][urls[url]]['worker_node_count'] = len(r['spec']['worker_nodes'])
 
-                            if "worker_nodes" in r['spec'].keys():
-                                self.data['site'][urls[future_to_ds[future]]]['worker_node_count'] = len(r['spec']['worker_nodes'])
-
-                            # check if sms or legacy object type
-                            if self.get_key_from_site_kind(urls[future_to_ds[future]]) == c.SITE_OBJECT_TYPE_LEGACY:
-                                # Evaluate if site object interface configration is ingress or ingress_egress and set dict key accordingly
-                                nic_setup = self.get_site_nic_mode(site=urls[future_to_ds[future]])
+                        # check if sms or legacy object type
+                        if self.get_key_from_site_kind(urls[url]) == c.SITE_OBJECT_TYPE_LEGACY:
+                            # Evaluate if site object interface configration is ingress or ingress_egress and set dict key accordingly
+                            nic_setup = self.get_site_nic_mode(site=urls[url])
 
-                                if nic_setup:
-                                    # Set main node counter
-                                    if "az_nodes" in self.data['site'][urls[future_to_ds[future]]][self.get_key_from_site_kind(urls[future_to_ds[future]])]["spec"][nic_setup]:
-                                        self.data['site'][urls[future_to_ds[future]]]['main_node_count'] = len(self.data['site'][urls[future_to_ds[future]]][self.get_key_from_site_kind(urls[future_to_ds[future]])]["spec"][nic_setup]['az_nodes'])
+                            if nic_setup:
+                                # Set main node counter
+                                if "az_nodes" in self.data['site'][urls[url]][self.get_key_from_site_kind(urls[url])]["spec"][nic_setup]:
+                                    self.data['site'][urls[url]]['main_node_count'] = len(self.data['site'][urls[url]][self.get_key_from_site_kind(urls[url])]["spec"][nic_setup]['az_nodes'])
 
         return self.data
 
@@ -273,7 +315,7 @@ class Site(Base):
                                         urls[self.build_url(c.URI_F5XC_ENHANCED_FW_POLICY.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=efp['name']))] = self.data['site'][site][self.get_key_from_site_kind(site)]['metadata']['name']
 
         if urls:
-            efps = self.execute(name="enhanced firewall policy details", urls=urls)
+            efps = self.stream(name="enhanced firewall policy details", urls=urls)
 
             for efp in efps:
                 if efp["object"] in self.data['site']:
@@ -331,7 +373,7 @@ class Site(Base):
                                         urls[self.build_url(c.URI_F5XC_FORWARD_PROXY_POLICY.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=fpp['name']))] = self.data['site'][site][self.get_key_from_site_kind(site)]['metadata']['name']
 
         if urls:
-            fpps = self.execute(name="forward proxy policy details query", urls=urls)
+            fpps = self.stream(name="forward proxy policy details query", urls=urls)
 
             for fpp in fpps:
                 if fpp["object"] in self.data['site']:
@@ -403,61 +445,53 @@ class Site(Base):
                                     urls_sli[self.build_url(c.URI_F5XC_DC_CLUSTER_GROUP.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=name))] = self.data['site'][site][self.get_key_from_site_kind(site)]['metadata']['name']
 
         if urls_slo:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-                self.logger.info("Prepare dc cluster group slo details query...")
-                future_to_ds = {executor.submit(self.get, url=url): url for url in urls_slo.keys()}
-
-                for future in concurrent.futures.as_completed(future_to_ds):
-                    _data = future_to_ds[future]
-
-                    try:
-                        self.logger.info(f"process dc cluster group slo details get item: {future_to_ds[future]} ...")
-                        result = future.result()
-                    except Exception as exc:
-                        self.logger.info('%s: %r generated an exception: %s' % ("process dc cluster group details", _data, exc))
-                    else:
-                        self.logger.info(f"process dc cluster group slo details got item: {future_to_ds[future]} ...")
+            self.logger.info("Prepare dc cluster group slo details query...")
 
-                        if result:
-                            dc_cg = result.json()
-                            self.logger.debug(json.dumps(dc_cg, indent=2))
+            for url, future in self.engine.fetch(urls_slo.keys()):
+                try:
+                    self.logger.info(f"process dc cluster group slo details get item: {url} ...")
+                    result = future.result()
+                except Exception as exc:
+                    self.logger.info('%s: %r generated an exception: %s' % ("process dc cluster group details", url, exc))
+                else:
+                    self.logger.info(f"process dc cluster group slo details got item: {url} ...")
 
-                            if urls_slo[future_to_ds[future]] in self.data['site']:
-                                if "dc_cluster_group" not in self.data['site'][urls_slo[future_to_ds[future]]]:
-                                    self.data['site'][urls_slo[future_to_ds[future]]]['dc_cluster_group'] = dict()
+                    if result:
+                        dc_cg = result.json()
+                        self.logger.debug(json.dumps(dc_cg, indent=2))
+
+                        if urls_slo[url] in self.data['site']:
+                            if "dc_cluster_group" not in self.data['site'][urls_slo[url]]:
+                                self.data['site'][urls_slo[url]]['dc_cluster_group'] = dict()
 
-                                self.data['site'][urls_slo[future_to_ds[future]]]['dc_cluster_group'][dc_cg['metadata']['name']] = dict()
-                                self.data['site'][urls_slo[future_to_ds[future]]]['dc_cluster_group'][dc_cg['metadata']['name']]['slo'] = dict()
-                                self.data['site'][urls_slo[future_to_ds[future]]]['dc_cluster_group'][dc_cg['metadata']['name']]['slo']['metadata'] = dc_cg['metadata']
-                                self.data['site'][urls_slo[future_to_ds[future]]]['dc_cluster_group'][dc_cg['metadata']['name']]['slo']['spec'] = dc_cg['spec']
+                            self.data['site'][urls_slo[url]]['dc_cluster_group'][dc_cg['metadata']['name']] = dict()
+                            self.data['site'][urls_slo[url]]['dc_cluster_group'][dc_cg['metadata']['name']]['slo'] = dict()
+                            self.data['site'][urls_slo[url]]['dc_cluster_group'][dc_cg['metadata']['name']]['slo']['metadata'] = dc_cg['metadata']
+                            self.data['site'][urls_slo[url]]['dc_cluster_group'][dc_cg['metadata']['name']]['slo']['spec'] = dc_cg['spec']
         if urls_sli:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-                self.logger.info("Prepare dc cluster group sli details query...")
-                future_to_ds = {executor.submit(self.get, url=url): url for url in urls_sli.keys()}
-
-                for future in concurrent.futures.as_completed(future_to_ds):
-                    _data = future_to_ds[future]
-
-                    try:
-                        self.logger.info(f"process dc cluster group sli details get item: {future_to_ds[future]} ...")
-                        result = future.result()
-                    except Exception as exc:
-                        self.logger.info('%s: %r generated an exception: %s' % ("process dc cluster group details", _data, exc))
-                    else:
-                        self.logger.info(f"process dc cluster group sli details got item: {future_to_ds[future]} ...")
+            self.logger.info("Prepare dc cluster group sli details query...")
 
-                        if result:
-                            dc_cg = result.json()
-                            self.logger.debug(json.dumps(dc_cg, indent=2))
+            for url, future in self.engine.fetch(urls_sli.keys()):
+                try:
+                    self.logger.info(f"process dc cluster group sli details get item: {url} ...")
+                    result = future.result()
+                except Exception as exc:
+                    self.logger.info('%s: %r generated an exception: %s' % ("process dc cluster group details", url, exc))
+                else:
+                    self.logger.info(f"process dc cluster group sli details got item: {url} ...")
 
-                            if urls_sli[future_to_ds[future]] in self.data['site']:
-                                if "dc_cluster_group" not in self.data['site'][urls_sli[future_to_ds[future]]]:
-                                    self.data['site'][urls_sli[future_to_ds[future]]]['dc_cluster_group'] = dict()
+                    if result:
+                        dc_cg = result.json()
+                        self.logger.debug(json.dumps(dc_cg, indent=2))
 
-                                self.data['site'][urls_sli[future_to_ds[future]]]['dc_cluster_group'][dc_cg['metadata']['name']] = dict()
-                                self.data['site'][urls_sli[future_to_ds[future]]]['dc_cluster_group'][dc_cg['metadata']['name']]['sli'] = dict()
-                                self.data['site'][urls_sli[future_to_ds[future]]]['dc_cluster_group'][dc_cg['metadata']['name']]['sli']['metadata'] = dc_cg['metadata']
-                                self.data['site'][urls_sli[future_to_ds[future]]]['dc_cluster_group'][dc_cg['metadata']['name']]['sli']['spec'] = dc_cg['spec']
+                        if urls_sli[url] in self.data['site']:
+                            if "dc_cluster_group" not in self.data['site'][urls_sli[url]]:
+                                self.data['site'][urls_sli[url]]['dc_cluster_group'] = dict()
+
+                            self.data['site'][urls_sli[url]]['dc_cluster_group'][dc_cg['metadata']['name']] = dict()
+                            self.data['site'][urls_sli[url]]['dc_cluster_group'][dc_cg['metadata']['name']]['sli'] = dict()
+                            self.data['site'][urls_sli[url]]['dc_cluster_group'][dc_cg['metadata']['name']]['sli']['metadata'] = dc_cg['metadata']
+                            self.data['site'][urls_sli[url]]['dc_cluster_group'][dc_cg['metadata']['name']]['sli']['spec'] = dc_cg['spec']
 
         return self.data
 
@@ -611,47 +645,43 @@ class Site(Base):
         for site in self.data['site'].keys():
             urls[self.build_url(c.URI_F5XC_SITE.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=site))] = site
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            self.logger.info("Prepare site hardware info query...")
-            future_to_ds = {executor.submit(self.get, url=url): url for url in urls.keys()}
-
-            for future in concurrent.futures.as_completed(future_to_ds):
-                _data = future_to_ds[future]
-
-                try:
-                    self.logger.info(f"process site hardware info get item: {future_to_ds[future]} ...")
-                    result = future.result()
-                except Exception as exc:
-                    self.logger.info('%s: %r generated an exception: %s' % ("process site hardware info", _data, exc))
-                else:
-                    self.logger.info(f"process site hardware info got item: {future_to_ds[future]} ...")
+        self.logger.info("Prepare site hardware info query...")
 
-                    if result:
-                        r = result.json()
-                        self.logger.debug(json.dumps(r, indent=2))
-                        if urls[future_to_ds[future]] in self.data['site']:
-                            # Build nodes structure first if not already created. Since nodes available below ['status'] key not idempotent nodes are taken from ['spec'] which is. :(
-                            # Build static mapping between node key and hostname e.g. node0 --> ip-192-168-0-88
-                            node_key_to_hostname_map = dict()
-                            if "nodes" not in self.data['site'][urls[future_to_ds[future]]].keys():
-                                self.data['site'][urls[future_to_ds[future]]]['nodes'] = dict()
-
-                            for idx, node in enumerate(r['spec']['main_nodes']):
-                                if f"node{idx}" not in self.data['site'][urls[future_to_ds[future]]]['nodes']:
-                                    self.data['site'][urls[future_to_ds[future]]]['nodes'][f"node{idx}"] = dict()
-
-                                # explicitly set hostname since used as filter when adding hw info
-                                self.data['site'][urls[future_to_ds[future]]]['nodes'][f"node{idx}"]['hostname'] = node['name']
-                                # add node name to hostname mapping
-                                node_key_to_hostname_map[node['name']] = f"node{idx}"
-
-                            for node in r['status']:
-                                if node['node_info']:
-                                    if node['metadata']['creator_class'] == c.F5XC_CREATOR_CLASS_MAURICE and c.F5XC_NODE_PRIMARY in node['node_info']['role']:
-                                        # Filter on hostname set in previous step :(.
-                                        if node['node_info']['hostname'] in node_key_to_hostname_map:
-                                            self.data['site'][urls[future_to_ds[future]]]['nodes'][node_key_to_hostname_map[node['node_info']['hostname']]]['hw_info'] = node['hw_info']
-                                        else:
-                                            self.logger.info(f"Site {urls[future_to_ds[future]]} node {node['node_info']['hostname']} does not have hardware info available. No node name to hostname mapping found.")
+        for url, future in self.engine.fetch(urls.keys()):
+            try:
+                self.logger.info(f"process site hardware info get item: {url} ...")
+                result = future.result()
+            except Exception as exc:
+                self.logger.info('%s: %r generated an exception: %s' % ("process site hardware info", url, exc))
+            else:
+                self.logger.info(f"process site hardware info got item: {url} ...")
+
+                if result:
+                    r = result.json()
+                    self.logger.debug(json.dumps(r, indent=2))
+                    if urls[url] in self.data['site']:
+                        # Build nodes structure first if not already created. Since nodes available below ['status'] key not idempotent nodes are taken from ['spec'] which is. :(
+                        # Build static mapping between node key and hostname e.g. node0 --> ip-192-168-0-88
+                        node_key_to_hostname_map = dict()
+                        if "nodes" not in self.data['site'][urls[url]].keys():
+                            self.data['site'][urls[url]]['nodes'] = dict()
+
+                        for idx, node in enumerate(r['spec']['main_nodes']):
+                            if f"node{idx}" not in self.data['site'][urls[url]]['nodes']:
+                                self.data['site'][urls[url]]['nodes'][f"node{idx}"] = dict()
+
+                            # explicitly set hostname since used as filter when adding hw info
+                            self.data['site'][urls[url]]['nodes'][f"node{idx}"]['hostname'] = node['name']
+                            # add node name to hostname mapping
+                            node_key_to_hostname_map[node['name']] = f"node{idx}"
+
+                        for node in r['status']:
+                            if node['node_info']:
+                                if node['metadata']['creator_class'] == c.F5XC_CREATOR_CLASS_MAURICE and c.F5XC_NODE_PRIMARY in node['node_info']['role']:
+                                    # Filter on hostname set in previous step :(.
+                                    if node['node_info']['hostname'] in node_key_to_hostname_map:
+                                        self.data['site'][urls[url]]['nodes'][node_key_to_hostname_map[node['node_info']['hostname']]]['hw_info'] = node['hw_info']
+                                    else:
+                                        self.logger.info(f"Site {urls[url]} node {node['node_info']['hostname']} does not have hardware info available. No node name to hostname mapping found.")
 
         return self.data
@@ -1,14 +1,20 @@
-import json
 from logging import Logger
 
 from requests import Session
 
 import lib.const as c
+from lib.engine import Engine
 from lib.processor.base import Base
+from lib.snapshot import Snapshot
+from lib.stream import debug_body, iter_items
 
 
 class Smg(Base):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    requires = ["site"]
+    provides = ["smg", "vsites"]
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None):
         """
         A class for processing site related site mesh group data.
         :param session: current http session
@@ -17,8 +23,10 @@ class Smg(Base):
         :param site: user injected site name to filter for
         :param workers: amount of concurrent threads
         :param logger: log instance for writing / printing log information
+        :param engine: shared fetch engine used to run requests
+        :param snapshot: data of previous run in incremental mode
         """
-        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger)
+        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger, engine=engine, snapshot=snapshot)
 
     def run(self) -> dict | None:
         """
@@ -26,15 +34,19 @@ class Smg(Base):
         :return: structure with site mesh group information being added
         """
 
+        if self.site and self.site not in self.data["site"]:
+            # Site filtered run for unknown or failed site
+            return self.data
+
         urls_smg = dict()
         urls_vs = dict()
 
         _smgs = self.get(self.build_url(c.URI_F5XC_SITE_MESH_GROUPS.format(namespace=c.F5XC_NAMESPACE_SYSTEM)))
 
         if _smgs:
-            self.logger.debug(json.dumps(_smgs.json(), indent=2))
+            debug_body(self.logger, _smgs)
 
-            for smg in _smgs.json()['items']:
+            for smg in iter_items(_smgs):
                 urls_smg[self.build_url(c.URI_F5XC_SITE_MESH_GROUP.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=smg['name']))] = smg['name']
 
             site_mesh_groups = self.execute(name="site mesh group", urls=urls_smg)
@@ -1,14 +1,21 @@
-import json
 from logging import Logger
 
 from requests import Session
 
 import lib.const as c
+from lib.engine import Engine
 from lib.processor.base import Base
+from lib.snapshot import Snapshot
+from lib.stream import debug_body, iter_items
 
 
 class Vs(Base):
-    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None):
+    requires = []
+    provides = ["virtual_site"]
+    site_filter = True
+
+    def __init__(self, session: Session = None, api_url: str = None, data: dict = None, site: str = None, workers: int = 10, logger: Logger = None, engine: Engine = None,
+                 snapshot: Snapshot = None):
         """
         A class for processing site related virtual site data.
         :param session: current http session
@@ -17,8 +24,10 @@ class Vs(Base):
         :param site: user injected site name to filter for
         :param workers: amount of concurrent threads
         :param logger: log instance for writing / printing log information
+        :param engine: shared fetch engine used to run requests
+        :param snapshot: data of previous run in incremental mode
         """
-        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger)
+        super().__init__(session=session, api_url=api_url, data=data, site=site, workers=workers, logger=logger, engine=engine, snapshot=snapshot)
 
     def run(self) -> dict | None:
         """
@@ -27,24 +36,32 @@ class Vs(Base):
         :return: structure with virtual sites information being added
         """
 
-        self.logger.info(f"process virtual sites get all virtual sites from {self.build_url(c.URI_F5XC_VIRTUAL_SITES.format(namespace=c.F5XC_NAMESPACE_SHARED))}")
-        _virtual_sites = self.get(self.build_url(c.URI_F5XC_VIRTUAL_SITES.format(namespace=c.F5XC_NAMESPACE_SHARED)))
+        if self.site:
+            # Site filter pushed down. Virtual site of the same name is fetched directly instead of listing all virtual sites
+            self.logger.info(f"process virtual sites get virtual site {self.site}")
+            virtual_sites = [{"name": self.site}]
+        else:
+            self.logger.info(f"process virtual sites get all virtual sites from {self.build_url(c.URI_F5XC_VIRTUAL_SITES.format(namespace=c.F5XC_NAMESPACE_SHARED))}")
+            _virtual_sites = self.get(self.build_url(c.URI_F5XC_VIRTUAL_SITES.format(namespace=c.F5XC_NAMESPACE_SHARED)))
+
+            if not _virtual_sites:
+                return None
 
-        if _virtual_sites:
-            self.logger.debug(json.dumps(_virtual_sites.json(), indent=2))
-            virtual_sites = [vs for vs in _virtual_sites.json()['items'] if self.site == vs['name']] if self.site else _virtual_sites.json()['items']
+            debug_body(self.logger, _virtual_sites)
+            virtual_sites = list(iter_items(_virtual_sites))
 
-            if virtual_sites:
-                # Stores virtual_site urls build from URI_F5XC_VIRTUAL_SITE
-                urls = dict()
-                # Build urls for site
-                for vs in virtual_sites:
-                    urls[self.build_url(c.URI_F5XC_VIRTUAL_SITE.format(namespace=c.F5XC_NAMESPACE_SHARED, name=vs['name']))] = vs['name']
+        if virtual_sites:
+            # Stores virtual_site urls build from URI_F5XC_VIRTUAL_SITE
+            urls = dict()
+            # Build urls for site
+            for vs in virtual_sites:
+                urls[self.build_url(c.URI_F5XC_VIRTUAL_SITE.format(namespace=c.F5XC_NAMESPACE_SHARED, name=vs['name']))] = vs['name']
 
-                _virtual_sites = self.execute(name="virtual site details", urls=urls)
-                for vs in _virtual_sites:
-                    self.data['virtual_site'][vs["object"]] = dict()
-                    self.data['virtual_site'][vs["object"]]['metadata'] = vs['data']['metadata']
-                    self.data['virtual_site'][vs["object"]]['spec'] = vs['data']['spec']
+            _virtual_sites = self.stream(name="virtual site details", urls=urls)
+            for vs in _virtual_sites:
+                self.store_referring(site_type="virtual_site", name=vs["object"], data=vs['data'])
+                self.data['virtual_site'][vs["object"]] = dict()
+                self.data['virtual_site'][vs["object"]]['metadata'] = vs['data']['metadata']
+                self.data['virtual_site'][vs["object"]]['spec'] = vs['data']['spec']
 
-            return self.data
+        return self.data
@@ -0,0 +1,98 @@
+"""
+authors: cklewar
+"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket shared by all requests going to a tenant.
+
+    Tokens are refilled at rate tokens per second up to burst tokens. Callers reserve a token and get back the time
+    they have to wait before they are allowed to send. Reservations may drive the bucket negative which queues callers
+    in order of arrival. A bucket with rate <= 0 does not limit requests but still honours pause().
+
+    Methods
+    -------
+    reserve()
+        take one token and return the number of seconds to wait before sending
+    acquire()
+        take one token and block until sending is allowed
+    pause(seconds: float = 0)
+        stop handing out tokens for given number of seconds e.g. after server sent Retry-After
+    paused()
+        remaining pause in seconds
+    """
+
+    def __init__(self, rate: float = 0, burst: int = 1):
+        """
+        :param rate: requests per second. 0 disables rate limiting
+        :param burst: maximum number of requests sent back to back
+        """
+
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    def reserve(self) -> float:
+        """
+        Take one token.
+        :return: seconds to wait before request can be sent
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            paused = max(0.0, self._paused_until - now)
+
+            if self._rate <= 0:
+                return paused
+
+            self._tokens = min(float(self._burst), self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+            return max(wait, paused)
+
+    def acquire(self):
+        """
+        Take one token and block until request can be sent.
+        :return:
+        """
+
+        wait = self.reserve()
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float = 0):
+        """
+        Stop handing out tokens for given number of seconds.
+        :param seconds: pause duration
+        :return:
+        """
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def paused(self) -> float:
+        """
+        Remaining pause.
+        :return: seconds until bucket hands out tokens again
+        """
+
+        with self._lock:
+            return max(0.0, self._paused_until - time.monotonic())
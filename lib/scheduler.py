@@ -0,0 +1,152 @@
+"""
+authors: cklewar
+"""
+
+import concurrent.futures
+from logging import Logger
+from typing import Any, Callable, Iterable
+
+
+def merge(dst: dict = None, src: dict = None) -> dict:
+    """
+    Deep merge src into dst. Nested dicts are merged key by key, lists are extended by items missing in dst,
+    any other value in src replaces the value in dst.
+    :param dst: data to merge into
+    :param src: data to merge
+    :return: dst
+    """
+
+    for key, value in src.items():
+        if isinstance(value, dict) and isinstance(dst.get(key), dict):
+            merge(dst[key], value)
+        elif isinstance(value, list) and isinstance(dst.get(key), list):
+            dst[key].extend(missing(dst[key], value))
+        else:
+            dst[key] = value
+
+    return dst
+
+
+def missing(dst: list = None, src: list = None) -> list:
+    """
+    Items of src not in dst, each once. Hashable items are looked up in a set, others are compared one by one.
+    :param dst: list to extend
+    :param src: list to take items from
+    :return: missing items in order of src
+    """
+
+    try:
+        seen = set(dst)
+        return [item for item in src if item not in seen and not seen.add(item)]
+    except TypeError:
+        items = list()
+
+        for item in src:
+            if item not in dst and item not in items:
+                items.append(item)
+
+        return items
+
+
+class Task(object):
+    """
+    Unit of work run by Scheduler.
+    """
+
+    def __init__(self, name: str = None, requires: Iterable[str] = None, provides: Iterable[str] = None, func: Callable[..., Any] = None,
+                 prepare: Callable[[], Any] = None):
+        self.name = name
+        self.requires = set(requires if requires else [])
+        self.provides = set(provides if provides else [])
+        self.func = func
+        self.prepare = prepare
+
+
+class Scheduler(object):
+    """
+    Run tasks as soon as everything they require has been provided. Independent tasks run concurrently.
+
+    Results are handed to the complete callback on the calling thread one at a time in order of completion.
+    A task's provides are marked available only after its complete callback returned, so dependent tasks always
+    see merged results of their requirements. A task's prepare callback runs on the calling thread right before the task
+    is started, its result is passed to func. Input taken from data merged by the complete callback must be taken there.
+
+    The first Ctrl-C calls the interrupt callback and keeps collecting results, so tasks can wrap up with what they have.
+    A second Ctrl-C returns right away without waiting for running tasks.
+
+    Methods
+    -------
+    add(name: str = None, requires: Iterable[str] = None, provides: Iterable[str] = None, func: Callable = None, prepare: Callable = None)
+        add task
+    run(available: Iterable[str] = None, complete: Callable = None, interrupt: Callable = None)
+        run all tasks
+    """
+
+    def __init__(self, logger: Logger = None):
+        """
+        :param logger: log instance for writing / printing log information
+        """
+
+        self._logger = logger
+        self._tasks = dict()
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def tasks(self):
+        return self._tasks
+
+    def add(self, name: str = None, requires: Iterable[str] = None, provides: Iterable[str] = None, func: Callable[..., Any] = None,
+            prepare: Callable[[], Any] = None):
+        self._tasks[name] = Task(name=name, requires=requires, provides=provides, func=func, prepare=prepare)
+
+    def run(self, available: Iterable[str] = None, complete: Callable[[str, Any], None] = None, interrupt: Callable[[], None] = None):
+        """
+        Run all tasks.
+        :param available: names already provided before the first task runs
+        :param complete: callback invoked with task name and task result
+        :param interrupt: callback invoked on first Ctrl-C. None returns on first Ctrl-C
+        :return:
+        """
+
+        available = set(available if available else [])
+        pending = dict(self._tasks)
+        running = dict()
+        interrupted = False
+        aborted = False
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(pending)), thread_name_prefix="scheduler")
+
+        try:
+            while pending or running:
+                for name in [name for name, task in pending.items() if task.requires <= available]:
+                    task = pending.pop(name)
+                    self.logger.info(f"Starting <{name}>...")
+                    future = executor.submit(task.func, task.prepare()) if task.prepare else executor.submit(task.func)
+                    running[future] = task
+
+                if not running:
+                    raise ValueError(f"unsatisfiable requirements: {({name: sorted(task.requires - available) for name, task in pending.items()})}")
+
+                try:
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    if interrupt is None or interrupted:
+                        raise
+
+                    interrupted = True
+                    self.logger.info("Interrupted. Waiting for running tasks to wrap up, press Ctrl-C again to abort...")
+                    interrupt()
+                    continue
+
+                for future in done:
+                    task = running.pop(future)
+                    complete(task.name, future.result())
+                    available.update(task.provides)
+                    self.logger.info(f"Finished <{task.name}>")
+        except KeyboardInterrupt:
+            aborted = True
+            raise
+        finally:
+            executor.shutdown(wait=not aborted, cancel_futures=aborted)
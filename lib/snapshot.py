@@ -0,0 +1,111 @@
+"""
+authors: cklewar
+"""
+
+import threading
+
+import lib.const as c
+
+
+class Snapshot(object):
+    """
+    Data of a previous run used by incremental runs.
+
+    Indexes every object stored below sites and virtual sites of a previous get-sites.json by object uri together with
+    the resource_version of all objects listed in the previous run (top level key c.SNAPSHOT_VERSIONS_KEY). Objects whose
+    resource_version did not change are served from the snapshot or skipped if they did not refer to any site. Objects
+    not stored below any site may have referred to a site which failed or did not exist in the previous run. These are
+    only skipped as long as the sites which are up did not change (see live_sites).
+
+    Methods
+    -------
+    unchanged(uri: str = None, version: str = None)
+        check if object still has the resource_version it had in the previous run
+    get(uri: str = None)
+        stored object of previous run or None
+    site(name: str = None)
+        site data of previous run or None
+    live_sites(data: dict = None)
+        sites and virtual sites not in failed state
+    sites_unchanged(live: set = None)
+        check if the same sites are up as in the previous run
+    count(name: str = None)
+        increment statistics counter
+    """
+
+    def __init__(self, data: dict = None):
+        """
+        :param data: data of previous run. None for the first incremental run
+        """
+
+        data = data if data else dict()
+        self._versions = data.get(c.SNAPSHOT_VERSIONS_KEY, dict())
+        self._sites = data.get("site", dict())
+        self._live = self.live_sites(data)
+        self._objects = dict()
+        self._stats = {"reused": 0, "skipped": 0, "sites": 0}
+        self._lock = threading.Lock()
+
+        for site_type in c.F5XC_SITE_TYPES:
+            for site in data.get(site_type, dict()).values():
+                self._index(site)
+
+    @property
+    def versions(self):
+        return self._versions
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def _add(self, uri: str = None, obj: dict = None):
+        if "metadata" in obj and "spec" in obj:
+            self._objects[uri] = {"metadata": obj["metadata"], "system_metadata": obj.get("system_metadata", dict()), "spec": obj["spec"]}
+
+    def _index(self, site: dict = None):
+        """
+        Add objects referring to site to object index.
+        :param site: site or virtual site data of previous run
+        :return:
+        """
+
+        for namespace, objects in site.get("namespaces", dict()).items():
+            for lb_type, lbs in objects.get("loadbalancer", dict()).items():
+                for name, obj in lbs.items():
+                    self._add(c.URI_F5XC_OBJECT.format(namespace=namespace, kind=f"{lb_type}_loadbalancer", name=name), obj)
+
+            for key, kind in c.SNAPSHOT_NAMESPACE_KINDS.items():
+                for name, obj in objects.get(key, dict()).items():
+                    self._add(c.URI_F5XC_OBJECT.format(namespace=namespace, kind=kind, name=name), obj)
+
+        for name, obj in site.get("bgp", dict()).items():
+            self._add(c.URI_F5XC_BGP.format(namespace=c.F5XC_NAMESPACE_SYSTEM, name=name), obj)
+
+    def unchanged(self, uri: str = None, version: str = None) -> bool:
+        return version is not None and self._versions.get(uri) == version
+
+    def get(self, uri: str = None) -> dict | None:
+        return self._objects.get(uri)
+
+    def site(self, name: str = None) -> dict | None:
+        return self._sites.get(name)
+
+    @staticmethod
+    def live_sites(data: dict = None) -> set[tuple[str, str]]:
+        """
+        Sites and virtual sites objects are stored below. Processors store an object below a site only if the site exists
+        and is not in failed state.
+        :param data: data holding sites, virtual sites and failed sites
+        :return: set of (site type, name)
+        """
+
+        failed = data.get("failed", dict())
+
+        return {(site_type, name) for site_type in c.F5XC_SITE_TYPES for name in data.get(site_type, dict()) if name not in failed}
+
+    def sites_unchanged(self, live: set = None) -> bool:
+        return live == self._live
+
+    def count(self, name: str = None):
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,124 @@
+"""
+authors: cklewar
+"""
+
+import json
+import logging
+import re
+from logging import Logger
+from typing import Any, Iterator
+
+from requests import Response
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Response attribute holding list items decoded by list_items
+_ITEMS = "_decoded_items"
+
+
+def _skip(text: str = None, idx: int = 0) -> int:
+    return _WHITESPACE.match(text, idx).end()
+
+
+def _expect(text: str = None, idx: int = 0, chars: str = None) -> str:
+    """
+    Get character at idx and make sure it is one of chars.
+    :param text: json document
+    :param idx: position in document
+    :param chars: allowed characters
+    :return: character at idx
+    """
+
+    if idx >= len(text) or text[idx] not in chars:
+        raise json.JSONDecodeError(f"Expecting one of '{chars}'", text, idx)
+
+    return text[idx]
+
+
+def iter_items(response: Response | bool = None, key: str = "items") -> Iterator[Any]:
+    """
+    Decode list response incrementally and yield elements of its top level key array one by one.
+    Only one element is decoded at a time. The full document is never materialized as dict and consumers can act on the
+    first element before the remaining body has been decoded. Other top level keys are decoded and discarded. Items decoded
+    by list_items already are not decoded again.
+    :param response: list response or False if request failed
+    :param key: top level key holding the array
+    :return: iterator of array elements
+    """
+
+    if not response:
+        return
+
+    if key == "items" and getattr(response, _ITEMS, None) is not None:
+        yield from getattr(response, _ITEMS)
+        return
+
+    text = response.content.decode(response.encoding or "utf-8")
+    idx = _skip(text, 0)
+    _expect(text, idx, "{")
+    idx = _skip(text, idx + 1)
+
+    if text.startswith("}", idx):
+        return
+
+    while True:
+        _expect(text, idx, '"')
+        name, idx = _DECODER.raw_decode(text, idx)
+        idx = _skip(text, idx)
+        _expect(text, idx, ":")
+        idx = _skip(text, idx + 1)
+
+        if name == key and text.startswith("[", idx):
+            idx = _skip(text, idx + 1)
+
+            if text.startswith("]", idx):
+                idx += 1
+            else:
+                while True:
+                    item, idx = _DECODER.raw_decode(text, idx)
+                    yield item
+                    idx = _skip(text, idx)
+
+                    if _expect(text, idx, ",]") == "]":
+                        idx += 1
+                        break
+
+                    idx = _skip(text, idx + 1)
+        else:
+            _, idx = _DECODER.raw_decode(text, idx)
+
+        idx = _skip(text, idx)
+
+        if _expect(text, idx, ",}") == "}":
+            return
+
+        idx = _skip(text, idx + 1)
+
+
+def list_items(response: Response | bool = None) -> list:
+    """
+    Decode list response once and keep its items with the response. Later iter_items calls on the same response share
+    them instead of decoding the body again. Items must not be modified.
+    :param response: list response or False if request failed
+    :return: list items
+    """
+
+    if not response:
+        return list()
+
+    if getattr(response, _ITEMS, None) is None:
+        setattr(response, _ITEMS, list(iter_items(response)))
+
+    return getattr(response, _ITEMS)
+
+
+def debug_body(logger: Logger = None, response: Response = None):
+    """
+    Write pretty printed response body to log. Body is only decoded if debug logging is enabled.
+    :param logger: log instance
+    :param response: response to log
+    :return:
+    """
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(response.json(), indent=2))
@@ -0,0 +1,170 @@
+"""
+authors: cklewar
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+from logging import Logger
+from urllib.parse import urlsplit
+
+import lib.const as c
+from lib.api import Api, NamespaceError
+
+
+class TenantLogger(logging.LoggerAdapter):
+    """
+    Prefix log messages with tenant name.
+    """
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['tenant']}] {msg}", kwargs
+
+
+def tenant_name(api_url: str = None) -> str:
+    """
+    Tenant name taken from first label of api url host e.g. "acme" for https://acme.console.ves.volterra.io/api
+    :param api_url: F5XC API URL
+    :return: tenant name
+    """
+
+    return urlsplit(api_url).hostname.split(".")[0]
+
+
+def tenant_file(name: str = None, tenant: str = None) -> str:
+    """
+    Output file of tenant derived from output file name e.g. get-sites-acme.json for get-sites.json
+    :param name: output file
+    :param tenant: tenant name
+    :return: output file of tenant
+    """
+
+    stem, suffix = os.path.splitext(name)
+
+    return c.TENANT_FILE_FORMAT.format(stem=stem, tenant=tenant, suffix=suffix)
+
+
+class Tenants(object):
+    """
+    Collect several tenants concurrently in one process.
+
+    Every tenant gets its own Api with its own session, connection pools and rate limiters (rate_limit applies per api token
+    of each tenant). All tenant engines share one concurrency budget of workers requests in flight, so a tenant can use the
+    whole budget once the others are done. Total run time is close to the slowest tenant.
+
+    Every tenant writes its own output file and request profile. A failed tenant does not stop the others.
+
+    In plan mode tenants are not collected. Every tenant gets a plan predicting its run from its list requests and the
+    profile of its last run. Plans are added to the index.
+
+    Methods
+    -------
+    run()
+        collect all tenants and write their output files
+    write_index(name: str = None)
+        write index of all tenants and their output files
+    """
+
+    def __init__(self, logger: Logger = None, tenants: list[dict] = None, workers: int = 10, options: dict = None, journal: bool = False,
+                 resume: bool = False, incremental: bool = False, plan: bool = False):
+        """
+        :param logger: log instance for writing / printing log information
+        :param tenants: tenants to collect. Dicts with keys name, api_url, api_token and file
+        :param workers: maximum number of requests in flight across all tenants
+        :param options: further Api parameters used for every tenant e.g. namespace, site, rate_limit
+        :param journal: record progress of every tenant in journal next to its output file
+        :param resume: resume tenants from their journal
+        :param incremental: refresh data of previous run read from output file of every tenant
+        :param plan: plan tenants instead of collecting them
+        """
+
+        self._logger = logger
+        self._tenants = tenants
+        self._workers = workers
+        self._options = options if options else dict()
+        self._journal = journal
+        self._resume = resume
+        self._incremental = incremental
+        self._plan = plan
+        self._budget = threading.BoundedSemaphore(workers)
+        self._index = dict()
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def index(self):
+        return self._index
+
+    def _collect(self, tenant: dict = None) -> dict:
+        """
+        Collect tenant and write its output file or plan tenant.
+        :param tenant: tenant to collect
+        :return: index entry of tenant
+        """
+
+        start = time.perf_counter()
+        name = tenant["file"]
+        entry = {"api_url": tenant["api_url"], "file": name}
+
+        # Plans read lists without full objects
+        options = dict(self._options, bulk=False) if self._plan else self._options
+
+        try:
+            api = Api(logger=TenantLogger(self.logger, {"tenant": tenant["name"]}), api_url=tenant["api_url"], api_token=tenant["api_token"], workers=self._workers,
+                      budget=self._budget, journal=name + c.JOURNAL_SUFFIX if self._journal and not self._plan else None, resume=self._resume,
+                      incremental=name if self._incremental and not self._plan else None, **options)
+        except (NamespaceError, ValueError) as exc:
+            entry["error"] = str(exc)
+            return entry
+
+        try:
+            if self._plan:
+                entry["plan"] = api.plan(bulk=self._options.get("bulk", False) or self._incremental, profile=name + c.PROFILE_SUFFIX)
+            else:
+                data = api.run()
+                api.write_json_file(name)
+                api.write_profile(name + c.PROFILE_SUFFIX)
+                entry.update({key: sorted(data.get(key, dict())) for key in c.F5XC_SITE_TYPES + ["failed"]})
+        except Exception as exc:
+            self.logger.info(f"Collecting tenant <{tenant['name']}> failed with: {exc}")
+            entry["error"] = str(exc)
+        finally:
+            api.close()
+
+        entry["elapsed"] = round(time.perf_counter() - start, 1)
+
+        return entry
+
+    def run(self) -> dict:
+        """
+        Collect all tenants concurrently.
+        :return: tenant name -> index entry
+        """
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self._tenants)), thread_name_prefix="tenant") as executor:
+            futures = {executor.submit(self._collect, tenant): tenant["name"] for tenant in self._tenants}
+
+            for future in concurrent.futures.as_completed(futures):
+                self._index[futures[future]] = future.result()
+                self.logger.info(f"Tenant <{futures[future]}> {'failed' if 'error' in self._index[futures[future]] else 'done'}")
+
+        return self._index
+
+    def write_index(self, name: str = None):
+        """
+        Write index of all tenants with their output file, sites, virtual sites and failed sites.
+        :param name: index file
+        :return:
+        """
+
+        try:
+            with open(name, "w") as fd:
+                json.dump({"tenants": {tenant: self._index[tenant] for tenant in sorted(self._index)}}, fd, indent=2)
+                self.logger.info(f"Index of {len(self._index)} tenants written to {name}")
+        except OSError as e:
+            self.logger.info(f"Writing file {name} failed with error: {e}")
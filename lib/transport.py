@@ -0,0 +1,292 @@
+"""
+authors: cklewar
+"""
+
+import threading
+
+import requests
+import urllib3
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+
+import lib.const as c
+from lib.cache import make_response
+
+
+class Transport(object):
+    """
+    Http transport used by the fetch engine. Implementations return requests.Response objects. Transport errors are raised
+    as requests exceptions so retry handling does not depend on the backend.
+
+    Blocking transports implement get / head and must be safe to call from many executor threads. Every request in flight
+    holds an executor thread. Non-blocking transports set asynchronous and implement aget / ahead / aclose instead. They
+    run as coroutines on the engine event loop and do not hold a thread per request.
+
+    Methods
+    -------
+    get(url: str = None, headers: dict = None, timeout: tuple = None)
+        run GET request
+    head(url: str = None, timeout: float = None)
+        run HEAD request e.g. to open a connection
+    close()
+        close all connections
+    aget(url: str = None, headers: dict = None, timeout: tuple = None)
+        run GET request on event loop
+    ahead(url: str = None, timeout: float = None)
+        run HEAD request on event loop
+    aclose()
+        close all connections on event loop
+    """
+
+    asynchronous = False
+
+    def __init__(self, session: Session = None, workers: int = 10):
+        """
+        :param session: template http session. Provides headers sent with every request
+        :param workers: maximum number of requests in flight
+        """
+
+        self._template = session
+        self._workers = workers
+
+    @property
+    def headers(self):
+        return dict(self._template.headers)
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def get(self, url: str = None, headers: dict = None, timeout: tuple[float, float] = None) -> Response:
+        raise NotImplementedError(f"{self.__class__.__name__} is non-blocking")
+
+    def head(self, url: str = None, timeout: float = None) -> Response:
+        raise NotImplementedError(f"{self.__class__.__name__} is non-blocking")
+
+    def close(self):
+        pass
+
+    async def aget(self, url: str = None, headers: dict = None, timeout: tuple[float, float] = None) -> Response:
+        raise NotImplementedError(f"{self.__class__.__name__} is blocking")
+
+    async def ahead(self, url: str = None, timeout: float = None) -> Response:
+        raise NotImplementedError(f"{self.__class__.__name__} is blocking")
+
+    async def aclose(self):
+        pass
+
+
+class RequestsTransport(Transport):
+    """
+    requests based transport. In "thread" session mode every executor thread gets its own session cloned from the template
+    session. In "shared" session mode all threads use the template session whose adapter keeps one pooled connection per
+    worker and blocks instead of discarding connections when the pool is exhausted. Sessions and adapters created by the
+    transport are closed with it.
+    """
+
+    def __init__(self, session: Session = None, workers: int = 10, session_mode: str = c.SESSION_MODE_THREAD):
+        """
+        :param session: template http session
+        :param workers: maximum number of requests in flight
+        :param session_mode: per executor thread sessions ("thread") or one session shared by all threads ("shared")
+        """
+
+        super().__init__(session=session, workers=workers)
+        self._session_mode = session_mode
+        self._local = threading.local()
+        # Per thread sessions created so far. Closed by close() along with the adapter mounted on the template session
+        self._sessions = list()
+        self._lock = threading.Lock()
+        self._adapter = self._mount(self._template, pool_maxsize=workers) if self._session_mode == c.SESSION_MODE_SHARED else None
+
+    @property
+    def session(self):
+        """
+        Session to be used by the calling thread.
+        :return: requests.Session
+        """
+
+        if self._session_mode == c.SESSION_MODE_SHARED:
+            return self._template
+
+        if not hasattr(self._local, "session"):
+            session = Session()
+            session.headers.update(self._template.headers)
+            self._mount(session, pool_maxsize=1)
+            self._local.session = session
+
+            with self._lock:
+                self._sessions.append(session)
+
+        return self._local.session
+
+    @property
+    def session_mode(self):
+        return self._session_mode
+
+    @staticmethod
+    def _mount(session: Session = None, pool_maxsize: int = 10) -> HTTPAdapter:
+        """
+        Replace default adapters of session with adapters sized to pool_maxsize.
+        :param session: session to mount adapters on
+        :param pool_maxsize: number of connections kept per host
+        :return: mounted adapter
+        """
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=c.SESSION_POOL_BLOCK)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        return adapter
+
+    def get(self, url: str = None, headers: dict = None, timeout: tuple[float, float] = None) -> Response:
+        return self.session.get(url, headers=headers, timeout=timeout)
+
+    def head(self, url: str = None, timeout: float = None) -> Response:
+        return self.session.head(url, timeout=timeout)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, list()
+
+        for session in sessions:
+            session.close()
+
+        if self._adapter:
+            self._adapter.close()
+
+
+class Urllib3Transport(Transport):
+    """
+    urllib3 based transport. One thread safe pool manager keeping one connection per worker and host.
+    Skips the per request overhead of requests (hooks, cookie handling, adapter lookup).
+    """
+
+    def __init__(self, session: Session = None, workers: int = 10):
+        super().__init__(session=session, workers=workers)
+        self._pool = urllib3.PoolManager(num_pools=c.TRANSPORT_NUM_POOLS, maxsize=workers, block=c.SESSION_POOL_BLOCK, headers=self.headers,
+                                         retries=False)
+
+    def _request(self, method: str = None, url: str = None, headers: dict = None, timeout: urllib3.Timeout = None) -> Response:
+        try:
+            r = self._pool.request(method, url, headers=dict(self.headers, **headers) if headers else None, timeout=timeout, redirect=False)
+        except urllib3.exceptions.TimeoutError as exc:
+            raise requests.Timeout(exc)
+        except urllib3.exceptions.HTTPError as exc:
+            raise requests.ConnectionError(exc)
+
+        return make_response(url=url, body=r.data, status_code=r.status, headers=dict(r.headers))
+
+    def get(self, url: str = None, headers: dict = None, timeout: tuple[float, float] = None) -> Response:
+        return self._request("GET", url, headers=headers, timeout=urllib3.Timeout(connect=timeout[0], read=timeout[1]) if timeout else None)
+
+    def head(self, url: str = None, timeout: float = None) -> Response:
+        return self._request("HEAD", url, timeout=urllib3.Timeout(total=timeout) if timeout else None)
+
+    def close(self):
+        self._pool.clear()
+
+
+class HttpxTransport(Transport):
+    """
+    Non-blocking transport based on httpx.AsyncClient. Requests run as coroutines on the engine event loop, so requests in
+    flight are bounded by the engine semaphore only and do not hold a thread each. The client is bound to the event loop
+    it is first used on. Requires the optional httpx dependency.
+    """
+
+    asynchronous = True
+    http2 = False
+
+    def __init__(self, session: Session = None, workers: int = 10):
+        super().__init__(session=session, workers=workers)
+
+        try:
+            import httpx
+        except ImportError as exc:
+            raise ImportError(f"transport <{self.name}> needs httpx: pip install '{self.requirement}'") from exc
+
+        self._httpx = httpx
+        self._client = httpx.AsyncClient(http2=self.http2, headers=self.headers, follow_redirects=False, limits=self._limits())
+
+    @property
+    def name(self) -> str:
+        return c.TRANSPORT_HTTPX
+
+    @property
+    def requirement(self) -> str:
+        return "httpx"
+
+    def _limits(self):
+        return self._httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers)
+
+    async def _request(self, method: str = None, url: str = None, headers: dict = None, timeout=None) -> Response:
+        try:
+            r = await self._client.request(method, url, headers=headers, timeout=timeout)
+        except self._httpx.TimeoutException as exc:
+            raise requests.Timeout(exc)
+        except self._httpx.TransportError as exc:
+            raise requests.ConnectionError(exc)
+
+        return make_response(url=url, body=r.content, status_code=r.status_code, headers=dict(r.headers))
+
+    async def aget(self, url: str = None, headers: dict = None, timeout: tuple[float, float] = None) -> Response:
+        return await self._request("GET", url, headers=headers, timeout=self._httpx.Timeout(timeout[1], connect=timeout[0]) if timeout else None)
+
+    async def ahead(self, url: str = None, timeout: float = None) -> Response:
+        return await self._request("HEAD", url, timeout=timeout)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class Http2Transport(HttpxTransport):
+    """
+    Non-blocking HTTP/2 transport based on httpx.AsyncClient. Concurrent requests are multiplexed as streams over few
+    connections instead of opening one TLS connection per worker. Falls back to HTTP/1.1 if the server does not negotiate
+    h2. Requires the optional httpx[http2] dependency.
+    """
+
+    http2 = True
+
+    def __init__(self, session: Session = None, workers: int = 10):
+        super().__init__(session=session, workers=workers)
+
+        try:
+            import h2  # noqa: F401
+        except ImportError as exc:
+            raise ImportError(f"transport <{self.name}> needs httpx with http2 support: pip install '{self.requirement}'") from exc
+
+    @property
+    def name(self) -> str:
+        return c.TRANSPORT_HTTP2
+
+    @property
+    def requirement(self) -> str:
+        return "httpx[http2]"
+
+    def _limits(self):
+        return self._httpx.Limits(max_connections=c.TRANSPORT_HTTP2_CONNECTIONS, max_keepalive_connections=c.TRANSPORT_HTTP2_CONNECTIONS)
+
+
+TRANSPORTS = {
+    c.TRANSPORT_REQUESTS: RequestsTransport,
+    c.TRANSPORT_URLLIB3: Urllib3Transport,
+    c.TRANSPORT_HTTPX: HttpxTransport,
+    c.TRANSPORT_HTTP2: Http2Transport,
+}
+
+
+def create(name: str = c.TRANSPORT_REQUESTS, session: Session = None, workers: int = 10, session_mode: str = c.SESSION_MODE_THREAD) -> Transport:
+    """
+    Create transport by name.
+    :param name: one of c.TRANSPORTS
+    :param session: template http session
+    :param workers: maximum number of requests in flight
+    :param session_mode: session mode of requests transport
+    :return: Transport
+    """
+
+    if name == c.TRANSPORT_REQUESTS:
+        return RequestsTransport(session=session, workers=workers, session_mode=session_mode)
+
+    return TRANSPORTS[name](session=session, workers=workers)
@@ -0,0 +1,32 @@
+import shutil
+import subprocess
+
+import pytest
+
+from tests.stub import StubApi
+
+
+@pytest.fixture
+def stub():
+    with StubApi() as stub:
+        yield stub
+
+
+@pytest.fixture
+def h2stub(tmp_path, monkeypatch):
+    """
+    Stand-in API speaking HTTP/2 over TLS with a self-signed certificate trusted through SSL_CERT_FILE.
+    """
+
+    pytest.importorskip("h2")
+
+    if not shutil.which("openssl"):
+        pytest.skip("openssl is needed to create a test certificate")
+
+    cert, key = str(tmp_path / "cert.pem"), str(tmp_path / "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost", "-keyout", key, "-out", cert,
+                    "-addext", "subjectAltName=IP:127.0.0.1"], check=True, capture_output=True)
+    monkeypatch.setenv("SSL_CERT_FILE", cert)
+
+    with StubApi(tls=(cert, key)) as stub:
+        yield stub
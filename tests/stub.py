@@ -0,0 +1,244 @@
+import hashlib
+import json
+import queue
+import socketserver
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:
+    h2 = None
+
+# Minimal tenant served by the stand-in API. One online secure mesh v2 site referenced by a load balancer, an origin pool,
+# a bgp object and a site mesh group. A second site is in failed state.
+TENANT = {
+    "/web/namespaces": {"items": [{"name": "default"}, {"name": "ns1"}]},
+    "/web/namespaces/default": {"name": "default"},
+    "/config/namespaces/system/sites": {"items": [{"name": "site-a"}, {"name": "site-b"}]},
+    "/config/namespaces/system/sites/site-a": {
+        "metadata": {"name": "site-a", "labels": {"env": "prod"}, "resource_version": "1"},
+        "system_metadata": {"owner_view": {"kind": "securemesh_site_v2"}},
+        "spec": {"site_state": "ONLINE", "main_nodes": [{"name": "node-a0"}]},
+        "status": [{"node_info": {"hostname": "node-a0", "role": ["k8s-master-primary"]}, "metadata": {"creator_class": "maurice"}, "hw_info": {"cpu": {"model": "x86"}}}],
+        "referring_objects": [{"kind": "http_loadbalancer", "namespace": "default", "name": "lb1"}, {"kind": "origin_pool", "namespace": "ns1", "name": "pool1"}, {"kind": "bgp", "namespace": "system", "name": "bgp-a"}],
+    },
+    "/config/namespaces/system/sites/site-b": {
+        "metadata": {"name": "site-b", "labels": {}},
+        "system_metadata": {"owner_view": {"kind": "securemesh_site_v2"}},
+        "spec": {"site_state": "PROVISIONING", "main_nodes": []},
+        "status": [],
+    },
+    "/config/namespaces/system/securemesh_site_v2s/site-a": {"metadata": {"name": "site-a"}, "spec": {"site_state": "ONLINE"}},
+    "/config/namespaces/shared/virtual_sites": {"items": [{"name": "vs-prod"}]},
+    "/config/namespaces/shared/virtual_sites/vs-prod": {"metadata": {"name": "vs-prod"}, "spec": {"site_selector": {"expressions": ["env in (prod)"]}}},
+    "/config/namespaces/default/http_loadbalancers": {"items": [{"name": "lb1"}]},
+    "/config/namespaces/default/http_loadbalancers/lb1": {
+        "metadata": {"name": "lb1", "namespace": "default", "resource_version": "1"},
+        "system_metadata": {"uid": "lb1-uid"},
+        "spec": {"advertise_custom": {"advertise_where": [{"site": {"site": {"name": "site-a"}}}]}},
+    },
+    "/config/namespaces/default/tcp_loadbalancers": {"items": []},
+    "/config/namespaces/default/udp_loadbalancers": {"items": []},
+    "/config/namespaces/ns1/http_loadbalancers": {"items": []},
+    "/config/namespaces/ns1/tcp_loadbalancers": {"items": []},
+    "/config/namespaces/ns1/udp_loadbalancers": {"items": []},
+    "/config/namespaces/default/proxys": {"items": []},
+    "/config/namespaces/ns1/proxys": {"items": []},
+    "/config/namespaces/default/origin_pools": {"items": []},
+    "/config/namespaces/ns1/origin_pools": {"items": [{"name": "pool1"}]},
+    "/config/namespaces/ns1/origin_pools/pool1": {
+        "metadata": {"name": "pool1", "namespace": "ns1", "resource_version": "1"},
+        "system_metadata": {"uid": "pool1-uid"},
+        "spec": {"origin_servers": [{"private_ip": {"site_locator": {"site": {"name": "site-a"}}}}]},
+    },
+    "/config/namespaces/system/bgps": {"items": [{"name": "bgp-a"}]},
+    "/config/namespaces/system/bgps/bgp-a": {
+        "metadata": {"name": "bgp-a", "namespace": "system"},
+        "system_metadata": {"uid": "bgp-a-uid"},
+        "spec": {"where": {"site": {"ref": [{"name": "site-a"}]}}},
+    },
+    "/config/namespaces/system/site_mesh_groups": {"items": [{"name": "smg1"}]},
+    "/config/namespaces/system/site_mesh_groups/smg1": {"metadata": {"name": "smg1"}, "spec": {"virtual_site": [{"name": "vs-prod"}]}},
+    "/config/namespaces/system/segments": {"items": []},
+    "/config/namespaces/system/cloud_connects": {"items": []},
+}
+
+
+class StubApi(object):
+    """
+    Stand-in F5XC API serving TENANT from a local http server. Records every request path. Given a certificate and key the
+    server speaks HTTP/2 over TLS only (ALPN h2) and counts connections.
+    """
+
+    def __init__(self, tenant: dict = None, tls: tuple[str, str] = None):
+        self.tenant = json.loads(json.dumps(tenant if tenant else TENANT))
+        self.requests = list()
+        # path -> list of status codes returned before the real body is served
+        self.faults = dict()
+        # path -> list of seconds to wait before answering
+        self.delays = dict()
+        # object names returned without spec in report_fields list responses
+        self.specless = set()
+        # api tokens answered with 401 and the token sent with every GET request
+        self.rejected = set()
+        self.tokens = list()
+        # connections accepted by the HTTP/2 server
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._tls = tls
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.reply(*stub.respond("GET", self.path, {key.lower(): value for key, value in self.headers.items()}))
+
+            def do_HEAD(self):
+                self.reply(*stub.respond("HEAD", self.path, dict()))
+
+            def reply(self, status: int = None, headers: dict = None, payload: bytes = None):
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class H2Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                with stub._lock:
+                    stub.connections += 1
+
+                context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+                context.load_cert_chain(*stub._tls)
+                context.set_alpn_protocols(["h2"])
+                sock = context.wrap_socket(self.request, server_side=True)
+                sock.settimeout(0.01)
+                conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+                conn.initiate_connection()
+                sock.sendall(conn.data_to_send())
+                # streams are answered by one thread each, this thread owns the connection and sends their replies
+                replies = queue.Queue()
+
+                def answer(stream_id: int = None, headers: dict = None):
+                    replies.put((stream_id, *stub.respond(headers[":method"], headers[":path"], headers)))
+
+                while True:
+                    try:
+                        data = sock.recv(65535)
+                        if not data:
+                            return
+                        for event in conn.receive_data(data):
+                            if isinstance(event, h2.events.RequestReceived):
+                                threading.Thread(target=answer, args=(event.stream_id, dict(event.headers)), daemon=True).start()
+                            elif isinstance(event, h2.events.ConnectionTerminated):
+                                return
+                    except TimeoutError:
+                        pass
+                    except (OSError, h2.exceptions.ProtocolError):
+                        return
+
+                    while not replies.empty():
+                        stream_id, status, headers, payload = replies.get()
+                        try:
+                            conn.send_headers(stream_id, [(":status", str(status)), ("content-length", str(len(payload)))] + [(key.lower(), value) for key, value in headers.items()],
+                                              end_stream=not payload)
+                            if payload:
+                                conn.send_data(stream_id, payload, end_stream=True)
+                        except h2.exceptions.StreamClosedError:
+                            # stream was reset by the client, e.g. after a timeout
+                            pass
+
+                    sock.sendall(conn.data_to_send())
+
+        if tls:
+            self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), H2Handler)
+            self._server.daemon_threads = True
+        else:
+            self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"{'https' if self._tls else 'http'}://127.0.0.1:{self._server.server_address[1]}"
+
+    def respond(self, method: str = None, path: str = None, headers: dict = None) -> tuple[int, dict, bytes]:
+        """
+        Record request and build its reply.
+        :param method: GET or HEAD
+        :param path: request path with query
+        :param headers: request headers with lower case names
+        :return: status, reply headers and payload
+        """
+
+        parts = urlsplit(path)
+
+        if method == "HEAD":
+            with self._lock:
+                self.requests.append(path)
+            return 200, dict(), b""
+
+        token = headers.get("authorization", "").removeprefix("APIToken ")
+        with self._lock:
+            self.requests.append(path)
+            self.tokens.append(token)
+            fault = self.faults[parts.path].pop(0) if self.faults.get(parts.path) else None
+            delay = self.delays[parts.path].pop(0) if self.delays.get(parts.path) else 0
+
+        time.sleep(delay)
+
+        if token in self.rejected:
+            return self.reply(401, {"code": 401})
+        elif fault:
+            return self.reply(fault, {"code": fault}, {"Retry-After": "0"} if fault == 429 else None)
+        elif parts.path in self.tenant and parts.query == "report_fields":
+            return self.reply(200, {"items": [self.report_item(parts.path, item) for item in self.tenant[parts.path]["items"]]})
+        elif parts.path in self.tenant:
+            etag = '"{}"'.format(hashlib.sha1(json.dumps(self.tenant[parts.path], sort_keys=True).encode("utf-8")).hexdigest())
+            if headers.get("if-none-match") == etag:
+                return 304, {"ETag": etag}, b""
+            return self.reply(200, self.tenant[parts.path], {"ETag": etag})
+
+        return self.reply(404, {"code": 404})
+
+    @staticmethod
+    def reply(status: int = None, body: dict = None, headers: dict = None) -> tuple[int, dict, bytes]:
+        return status, dict(headers or {}, **{"Content-Type": "application/json"}), json.dumps(body).encode("utf-8")
+
+    def report_item(self, path: str = None, item: dict = None) -> dict:
+        """
+        List item as returned with report_fields: name plus metadata, system_metadata and get_spec of the object.
+        """
+
+        obj = self.tenant.get(f"{path}/{item['name']}")
+
+        if obj is None:
+            return item
+
+        if item["name"] in self.specless:
+            return dict(item, metadata=obj["metadata"], system_metadata=obj.get("system_metadata", {}))
+
+        return dict(item, metadata=obj["metadata"], system_metadata=obj.get("system_metadata", {}), get_spec=obj["spec"])
+
+    def count(self, path: str = None) -> int:
+        return len([p for p in self.requests if urlsplit(p).path == path])
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,6 +1,8 @@
+import copy
 import json
 import logging
 import os
+import time
 from unittest.mock import patch
 
 import jsondiff.symbols
@@ -18,6 +20,11 @@ TEST_DATA_SITE_OLD_NAME = "f5xc-aws-ce-test-60"
 TEST_DATA_SITE_NEW_NAME = "f5xc-aws-ce-test-61"
 TEST_DATA_SITE_OLD_FILE_NAME = "tests/data/site_old.json"
 TEST_DATA_SITE_NEW_FILE_NAME = "tests/data/site_new.json"
+# Workers of Api instances querying the stand-in API (see tests/stub.py)
+STUB_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
 
 
 @pytest.fixture
@@ -121,3 +128,247 @@ def test_get_by_path(api, dict_keys, expected, old_site, data_old):
         response = list()
         result = api._get_by_path(data_old['site'][old_site], k.split("/"), response)
         assert result == expected[idx]
+
+
+def test_api_run(stub):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS)
+    data = api.run()
+    api.close()
+    assert data["namespaces"] == ["default", "ns1"]
+    assert data["failed"] == {"site-b": "PROVISIONING"}
+    site = data["site"]["site-a"]
+    assert "lb1" in site["namespaces"]["default"]["loadbalancer"]["http"]
+    assert "pool1" in site["namespaces"]["ns1"]["origin_pools"]
+    assert "bgp-a" in site["bgp"]
+    assert site["vsites"] == ["vs-prod"]
+    assert "vs-prod" in site["smg"]
+    assert site["nodes"]["node0"]["hw_info"] == {"cpu": {"model": "x86"}}
+    assert "vs-prod" in data["virtual_site"]
+
+
+def test_api_run_bulk(stub):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS, bulk=True)
+    data = api.run()
+    api.close()
+    site = data["site"]["site-a"]
+    assert "lb1" in site["namespaces"]["default"]["loadbalancer"]["http"]
+    assert "pool1" in site["namespaces"]["ns1"]["origin_pools"]
+    assert "bgp-a" in site["bgp"]
+    assert "vs-prod" in site["smg"]
+    assert stub.count("/config/namespaces/default/http_loadbalancers/lb1") == 0
+
+
+def test_api_run_tokens(stub):
+    api = Api(logger=logger, api_url=stub.url, api_token="t0,t1", namespace=None, site=None, workers=STUB_WORKERS)
+    stub.rejected.add("t1")
+    data = api.run()
+    api.close()
+    assert data["failed"] == {"site-b": "PROVISIONING"}
+    assert "lb1" in data["site"]["site-a"]["namespaces"]["default"]["loadbalancer"]["http"]
+    assert set(stub.tokens) == {"t0", "t1"}
+
+
+@pytest.mark.parametrize("api_token", [None, "", " , "])
+def test_api_token_missing(stub, api_token):
+    with pytest.raises(ValueError, match="api_token"):
+        Api(logger=logger, api_url=stub.url, api_token=api_token, namespace=None, site=None, workers=STUB_WORKERS)
+
+
+def test_api_run_site(stub):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site="site-a", workers=STUB_WORKERS)
+    data = api.run()
+    api.close()
+    site = data["site"]["site-a"]
+    assert list(data["site"].keys()) == ["site-a"]
+    assert "lb1" in site["namespaces"]["default"]["loadbalancer"]["http"]
+    assert "pool1" in site["namespaces"]["ns1"]["origin_pools"]
+    assert "bgp-a" in site["bgp"]
+    assert "referring" not in data
+    # objects referring to the site are fetched directly instead of listing collections
+    for path in ["/config/namespaces/system/sites", "/config/namespaces/default/http_loadbalancers", "/config/namespaces/ns1/origin_pools", "/config/namespaces/system/bgps", "/config/namespaces/shared/virtual_sites"]:
+        assert stub.count(path) == 0
+    assert stub.count("/config/namespaces/system/sites/site-b") == 0
+    # failed sites are known for the named site only
+    assert data["failed"] == {}
+
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site="site-b", workers=STUB_WORKERS)
+    data = api.run()
+    api.close()
+    assert data["failed"] == {"site-b": "PROVISIONING"} and data["site"] == {}
+
+
+def test_api_run_previous(stub, tmp_path):
+    snapshot = str(tmp_path / "get-sites.json")
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS)
+    api.run()
+    api.write_json_file(snapshot)
+    api.close()
+    # api does not return referring objects. New load balancer referring to site added after snapshot
+    del stub.tenant["/config/namespaces/system/sites/site-a"]["referring_objects"]
+    stub.tenant["/config/namespaces/ns1/http_loadbalancers"] = {"items": [{"name": "lb2"}]}
+    stub.tenant["/config/namespaces/ns1/http_loadbalancers/lb2"] = dict(stub.tenant["/config/namespaces/default/http_loadbalancers/lb1"], metadata={"name": "lb2", "namespace": "ns1"})
+    stub.requests.clear()
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site="site-a", workers=STUB_WORKERS, previous=snapshot)
+    data = api.run()
+    api.close()
+    site = data["site"]["site-a"]
+    assert "lb1" in site["namespaces"]["default"]["loadbalancer"]["http"]
+    assert "lb2" in site["namespaces"]["ns1"]["loadbalancer"]["http"]
+    assert "pool1" in site["namespaces"]["ns1"]["origin_pools"]
+    assert "bgp-a" in site["bgp"]
+    assert "previous" not in data
+    # objects known from snapshot are fetched before the lists and only once
+    paths = [path.split("?")[0] for path in stub.requests]
+    assert paths.index("/config/namespaces/default/http_loadbalancers/lb1") < paths.index("/config/namespaces/default/http_loadbalancers")
+    assert stub.count("/config/namespaces/default/http_loadbalancers/lb1") == 1
+
+
+def test_api_run_incremental(stub, tmp_path):
+    snapshot = str(tmp_path / "get-sites.json")
+    lb = "/config/namespaces/default/http_loadbalancers/lb1"
+    # list items without spec are not primed by bulk mode. pool2 does not refer to an existing site
+    stub.specless.update({"lb1", "pool1", "pool2"})
+    stub.tenant["/config/namespaces/default/origin_pools"] = {"items": [{"name": "pool2"}]}
+    stub.tenant["/config/namespaces/default/origin_pools/pool2"] = {
+        "metadata": {"name": "pool2", "namespace": "default", "resource_version": "1"},
+        "system_metadata": {"uid": "pool2-uid"},
+        "spec": {"origin_servers": [{"private_ip": {"site_locator": {"site": {"name": "site-x"}}}}]},
+    }
+
+    def run():
+        stub.requests.clear()
+        api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS, incremental=snapshot)
+        data = api.run()
+        api.write_json_file(snapshot)
+        api.close()
+        return data
+
+    run()
+    data = run()
+    site = data["site"]["site-a"]
+    assert "lb1" in site["namespaces"]["default"]["loadbalancer"]["http"]
+    assert "pool1" in site["namespaces"]["ns1"]["origin_pools"]
+    assert site["nodes"]["node0"]["hw_info"] == {"cpu": {"model": "x86"}}
+    assert data["failed"] == {"site-b": "PROVISIONING"}
+    assert data["versions"][lb] == "1"
+    # unchanged objects and site details are not queried again, site state is
+    for path in [lb, "/config/namespaces/ns1/origin_pools/pool1", "/config/namespaces/default/origin_pools/pool2", "/config/namespaces/system/securemesh_site_v2s/site-a"]:
+        assert stub.count(path) == 0
+    assert stub.count("/config/namespaces/system/sites/site-a") == 1
+    # changed object is fetched again
+    stub.tenant[lb]["metadata"]["resource_version"] = "2"
+    data = run()
+    assert stub.count(lb) == 1
+    assert data["versions"][lb] == "2"
+    assert "lb1" in data["site"]["site-a"]["namespaces"]["default"]["loadbalancer"]["http"]
+
+
+def test_api_run_incremental_site_recovered(stub, tmp_path):
+    snapshot = str(tmp_path / "get-sites.json")
+    pool = "/config/namespaces/default/origin_pools/pool2"
+    # pool2 refers to failed site-b and is not stored below any site
+    stub.specless.add("pool2")
+    stub.tenant["/config/namespaces/default/origin_pools"] = {"items": [{"name": "pool2"}]}
+    stub.tenant[pool] = {
+        "metadata": {"name": "pool2", "namespace": "default", "resource_version": "1"},
+        "system_metadata": {"uid": "pool2-uid"},
+        "spec": {"origin_servers": [{"private_ip": {"site_locator": {"site": {"name": "site-b"}}}}]},
+    }
+
+    def run():
+        stub.requests.clear()
+        api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS, incremental=snapshot)
+        data = api.run()
+        api.write_json_file(snapshot)
+        api.close()
+        return data
+
+    run()
+    run()
+    assert stub.count(pool) == 0
+    # unchanged pool2 is fetched again once site-b is up
+    stub.tenant["/config/namespaces/system/sites/site-b"]["spec"]["site_state"] = "ONLINE"
+    stub.tenant["/config/namespaces/system/securemesh_site_v2s/site-b"] = {"metadata": {"name": "site-b"}, "spec": {"site_state": "ONLINE"}}
+    data = run()
+    assert stub.count(pool) == 1
+    assert "pool2" in data["site"]["site-b"]["namespaces"]["default"]["origin_pools"]
+
+
+def test_api_watch(stub, tmp_path):
+    output = str(tmp_path / "get-sites.json")
+    lb = "/config/namespaces/default/http_loadbalancers/lb1"
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS)
+    # unchanged tenant rewrites output once but is queried every cycle
+    assert api.watch(output, interval=0, cycles=2) == 1
+    assert stub.count(lb) == 2
+    assert "site-a" in json.load(open(output))["site"]
+    old = copy.deepcopy(api.data)
+    stub.tenant[lb]["spec"]["changed"] = True
+    assert api.watch(output, interval=0, cycles=1) == 1
+    assert api.changes(old, api.data) == "site: ~site-a"
+    assert api.changes(api.data, api.data) == "no changes"
+    api.close()
+
+
+def test_api_resume(stub, tmp_path):
+    journal = str(tmp_path / "get-sites.json.journal")
+    output = str(tmp_path / "get-sites.json")
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS, journal=journal)
+    data = copy.deepcopy(api.run())
+    # run dies before data is written
+    api.close()
+
+    # keep responses and the first processor only, last record is cut off
+    with open(journal) as fd:
+        records = [json.loads(line) for line in fd]
+    processors = [record["name"] for record in records if record["type"] == "processor"]
+    with open(journal, "w") as fd:
+        for record in records:
+            if record["type"] != "processor" or record["name"] == processors[0]:
+                fd.write(json.dumps(record) + "\n")
+        fd.write('{"type": "fetch", "url": "/con')
+
+    stub.requests.clear()
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS, journal=journal, resume=True)
+    assert api.run() == data
+    # namespaces are discovered anew, everything else is served from journal
+    assert stub.requests == ["/web/namespaces"]
+    api.write_json_file(output)
+    api.close()
+
+    # journal is cleared once data has been written
+    with open(journal) as fd:
+        assert [json.loads(line)["type"] for line in fd] == ["run"]
+
+
+def test_api_run_time_budget(stub):
+    lb = "/config/namespaces/default/http_loadbalancers/lb1"
+    stub.delays[lb] = [3]
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS, time_budget=0.5)
+    start = time.monotonic()
+    data = api.run()
+    assert time.monotonic() - start < 2
+    assert f"{stub.url}{lb}" in api.engine.cancelled
+    assert data["sections"]["lb"] is False
+    assert data["sections"]["site"] is True
+    assert "site-a" in data["site"]
+    api.close()
+
+
+def test_api_run_processors(stub):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS, processors=["lb"])
+    data = api.run()
+    api.close()
+    site = data["site"]["site-a"]
+    assert "lb1" in site["namespaces"]["default"]["loadbalancer"]["http"]
+    assert "nodes" not in site and "bgp" not in site and "smg" not in site
+    # lb requires site and vs only. Site runs without site object processors
+    for path in ["/config/namespaces/system/bgps", "/config/namespaces/system/site_mesh_groups", "/config/namespaces/system/segments",
+                 "/config/namespaces/system/cloud_connects", "/config/namespaces/system/securemesh_site_v2s/site-a", "/config/namespaces/default/origin_pools"]:
+        assert stub.count(path) == 0
+
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=STUB_WORKERS, skip_processors=["site"], site_processors=["efp"])
+    assert api.resolve_processors(processors=["bgp"], site_processors=["efp"]) == (["site", "vs", "bgp"], ["site_details", "efp"])
+    with pytest.raises(ValueError):
+        api.resolve_processors(processors=["unknown"])
+    api.close()
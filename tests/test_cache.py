@@ -0,0 +1,80 @@
+import logging
+
+import requests
+
+from lib.cache import ResponseCache, make_response
+from lib.engine import Engine
+
+WORKERS = 4
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_cache_revalidate(stub, tmp_path):
+    path = "/config/namespaces/system/sites/site-a"
+    cache = ResponseCache(path=str(tmp_path), ttl_by_kind={"sites": 0})
+    # one engine per run
+    results = list()
+    for _ in range(2):
+        engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, cache=cache)
+        results.append(engine.get(f"{stub.url}{path}"))
+        engine.close()
+    first, second = results
+    cache.close()
+    assert second.json() == first.json()
+    assert stub.count(path) == 2
+    assert cache.stats()["revalidated"] == 1
+
+    # entries survive restarts
+    cache = ResponseCache(path=str(tmp_path))
+    assert cache.lookup(f"{stub.url}{path}").etag
+    cache.close()
+
+
+def test_cache_ttl(stub, tmp_path):
+    path = "/config/namespaces/default/http_loadbalancers/lb1"
+    cache = ResponseCache(path=str(tmp_path), ttl=60)
+    for _ in range(2):
+        engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, cache=cache)
+        assert engine.get(f"{stub.url}{path}").json()["metadata"]["name"] == "lb1"
+        engine.close()
+    assert stub.count(path) == 1
+    assert cache.lookup(f"{stub.url}{path}").resource_version == "1"
+    cache.close()
+
+
+def test_cache_lru(tmp_path):
+    cache = ResponseCache(path=str(tmp_path), max_bytes=250)
+
+    for name in ["a", "b", "c"]:
+        cache.store(f"http://stub/{name}", make_response(body=b"x" * 100))
+        cache.lookup("http://stub/a")
+
+    assert cache.lookup("http://stub/a") is not None
+    assert cache.lookup("http://stub/b") is None
+    assert cache.size == 200
+    cache.close()
+
+
+def test_cache_resource_version(stub, tmp_path):
+    path = "/config/namespaces/default/http_loadbalancers"
+    cache = ResponseCache(path=str(tmp_path), ttl_by_kind={"http_loadbalancers": 0})
+
+    def run():
+        engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, cache=cache)
+        engine.get(f"{stub.url}{path}")
+        assert engine.get(f"{stub.url}{path}/lb1").json()["metadata"]["name"] == "lb1"
+        engine.close()
+
+    stub.tenant[path]["items"][0]["metadata"] = {"resource_version": "1"}
+    run()
+    # list item still has the cached resource_version. Object is served without revalidation
+    run()
+    assert stub.count(f"{path}/lb1") == 1
+    stub.tenant[path]["items"][0]["metadata"]["resource_version"] = "2"
+    stub.tenant[f"{path}/lb1"]["metadata"]["resource_version"] = "2"
+    run()
+    assert stub.count(f"{path}/lb1") == 2
+    assert cache.lookup(f"{stub.url}{path}/lb1").resource_version == "2"
+    cache.close()
@@ -0,0 +1,20 @@
+import asyncio
+
+from lib.concurrency import AimdWindow
+
+
+def test_aimd_window():
+    async def run():
+        window = AimdWindow(name="test", initial=2, minimum=1, maximum=4)
+        for _ in range(10):
+            await window.acquire()
+            await window.release(latency=0.1)
+        grown = window.window
+        await window.acquire()
+        await window.release(latency=0.1, congested=True)
+        return grown, window.window, [size for ts, size, reason in window.history]
+
+    grown, shrunk, history = asyncio.run(run())
+    assert grown == 4
+    assert shrunk == 2
+    assert history == [2, 3, 4, 2]
@@ -0,0 +1,93 @@
+import copy
+import logging
+import multiprocessing
+import time
+
+from lib.api import Api
+from lib.distributed import Coordinator, DirectoryQueue, Worker
+
+WORKERS = 4
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def serve_partitions(url: str = None, path: str = None):
+    api = Api(logger=logger, api_url=url, api_token="token", namespace=None, site=None, workers=WORKERS)
+    Worker(queue=DirectoryQueue(path), process=api.run_partition, logger=logger).serve(idle=5)
+    api.close()
+
+
+def test_api_run_distributed(stub, tmp_path):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS)
+    expected = api.run()
+    api.close()
+
+    path = str(tmp_path / "queue")
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=serve_partitions, args=(stub.url, path)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+
+    coordinator = Coordinator(queue=DirectoryQueue(path), partitions=4, timeout=60, claim_wait=60, logger=logger)
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS, coordinator=coordinator)
+    assert api.run() == expected
+    assert coordinator.stats == {"remote": min(4, len(expected["namespaces"])), "local": 0}
+    api.close()
+
+    for worker in workers:
+        worker.join()
+
+    # partitions nobody picks up are run by coordinator long before timeout
+    coordinator = Coordinator(queue=DirectoryQueue(path), partitions=4, timeout=600, claim_wait=0, logger=logger)
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS, coordinator=coordinator)
+    start = time.monotonic()
+    assert api.run() == expected
+    assert time.monotonic() - start < 60
+    assert coordinator.stats["remote"] == 0
+    api.close()
+
+
+def test_queue_take_back(tmp_path):
+    queue = DirectoryQueue(str(tmp_path))
+    queue.put("t0", {"n": 0})
+    queue.put("t1", {"n": 1})
+    assert queue.claim() == ("t0", {"n": 0})
+    # claimed task can not be withdrawn, only taken back
+    assert not queue.withdraw("t0")
+    assert queue.take_back("t0")
+    assert not queue.done("t0", {"data": {}})
+    assert queue.result("t0") is None
+    # delivered result can not be taken back
+    assert queue.claim() == ("t1", {"n": 1})
+    assert queue.done("t1", {"data": {"x": 1}})
+    assert not queue.take_back("t1")
+    assert queue.result("t1") == {"data": {"x": 1}}
+    assert queue.claim() is None
+
+
+def test_worker_partitions_fresh(stub, tmp_path):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS)
+    data = api.run()
+    context = copy.deepcopy({key: data[key] for key in ["site", "virtual_site", "failed"]})
+    queue = DirectoryQueue(str(tmp_path))
+
+    for task_id in ["t0", "t1"]:
+        queue.put(task_id, {"run": "r0", "site": None, "processors": ["lb"], "data": dict(copy.deepcopy(context), namespaces=["ns1"])})
+
+    def process(task: dict = None) -> dict:
+        result = api.run_partition(task)
+        # load balancer added between the partitions served by the same worker
+        stub.tenant["/config/namespaces/ns1/http_loadbalancers"] = {"items": [{"name": "lb2"}]}
+        stub.tenant["/config/namespaces/ns1/http_loadbalancers/lb2"] = dict(stub.tenant["/config/namespaces/default/http_loadbalancers/lb1"],
+                                                                          metadata={"name": "lb2", "namespace": "ns1"})
+        return result
+
+    assert Worker(queue=queue, process=process, logger=logger).serve(idle=1) == 2
+    api.close()
+
+    def lbs(result: dict = None) -> dict:
+        return result["data"]["site"]["site-a"].get("namespaces", dict()).get("ns1", dict()).get("loadbalancer", dict()).get("http", dict())
+
+    assert "lb2" not in lbs(queue.result("t0"))
+    assert "lb2" in lbs(queue.result("t1"))
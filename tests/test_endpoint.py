@@ -0,0 +1,15 @@
+import pytest
+
+from lib.endpoint import family, parse
+
+
+@pytest.mark.parametrize("uri, expected", [
+    ("/config/namespaces/default/http_loadbalancers/lb1", ("default", "http_loadbalancers", "lb1", "loadbalancers")),
+    ("/config/namespaces/ns1/origin_pools", ("ns1", "origin_pools", None, "origin_pools")),
+    ("/config/namespaces/system/securemesh_site_v2s/site-a", ("system", "securemesh_site_v2s", "site-a", "sites")),
+    ("/config/namespaces/system/bgps/bgp-a", ("system", "bgps", "bgp-a", "default")),
+    ("/web/namespaces", (None, "namespaces", None, "default")),
+])
+def test_endpoint(uri, expected):
+    url = f"https://tenant.console.ves.volterra.io/api{uri}"
+    assert parse(url) + (family(url),) == expected
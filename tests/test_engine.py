@@ -0,0 +1,308 @@
+import asyncio
+import copy
+import logging
+import time
+
+import pytest
+import requests
+
+from lib.engine import Engine
+from lib.stream import iter_items
+from tests.stub import TENANT, StubApi
+
+WORKERS = 4
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+@pytest.fixture
+def engine(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger)
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def retry_engine(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, retries=2, backoff=0.01, breaker_threshold=0)
+    yield engine
+    engine.close()
+
+
+def test_engine_get(stub, engine):
+    r = engine.get(f"{stub.url}/config/namespaces/system/sites")
+    assert r.json()["items"][0]["name"] == "site-a"
+    assert engine.get(f"{stub.url}/does/not/exist") is False
+
+
+def test_engine_fetch(stub, engine):
+    urls = [f"{stub.url}/config/namespaces/system/sites/{name}" for name in ["site-a", "site-b"]]
+    results = {url: future.result() for url, future in engine.fetch(urls)}
+    assert sorted(results.keys()) == sorted(urls)
+    assert all(results.values())
+
+
+def test_engine_prewarm(stub, engine):
+    assert engine.prewarm(f"{stub.url}/web/namespaces", 3) == 3
+    assert engine.prewarm(f"{stub.url}/web/namespaces", WORKERS + 5) == WORKERS
+    assert engine.prewarm(f"{stub.url}/web/namespaces", 0) == 0
+
+
+def test_engine_shared_session(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, session_mode="shared")
+    urls = [f"{stub.url}/config/namespaces/system/sites/{name}" for name in ["site-a", "site-b"]]
+    assert all(future.result() for url, future in engine.fetch(urls))
+    assert engine.session.get_adapter(stub.url)._pool_maxsize == WORKERS
+    engine.close()
+
+
+def test_engine_retry(stub, retry_engine):
+    path = "/config/namespaces/system/sites/site-a"
+    stub.faults[path] = [503, 429]
+    assert retry_engine.get(f"{stub.url}{path}").json()["metadata"]["name"] == "site-a"
+    assert stub.count(path) == 3
+
+
+def test_engine_no_retry_on_client_error(stub, retry_engine):
+    path = "/config/namespaces/system/sites/site-a"
+    stub.faults[path] = [404]
+    assert retry_engine.get(f"{stub.url}{path}") is False
+    assert stub.count(path) == 1
+
+
+def test_engine_fetch_deferred(stub, retry_engine):
+    path = "/config/namespaces/system/sites/site-a"
+    # fails all immediate attempts, succeeds on deferred attempt
+    stub.faults[path] = [503, 503, 503]
+    urls = [f"{stub.url}{path}", f"{stub.url}/config/namespaces/system/sites/site-b"]
+    results = [(url, future.result()) for url, future in retry_engine.fetch(urls)]
+    assert results[-1][0] == urls[0]
+    assert all(result for url, result in results)
+    assert retry_engine.dropped == []
+
+
+def test_engine_fetch_dropped(stub, retry_engine):
+    path = "/config/namespaces/system/sites/site-a"
+    stub.faults[path] = [503] * 6
+    results = [future.result() for url, future in retry_engine.fetch([f"{stub.url}{path}"])]
+    assert results == [False]
+    assert retry_engine.dropped == [f"{stub.url}{path}"]
+
+
+def test_engine_adaptive(stub):
+    engine = Engine(session=requests.Session(), workers=2, logger=logger, adaptive=True, max_workers=8)
+    urls = [f"{stub.url}/config/namespaces/default/http_loadbalancers/lb1"] * 20 + [f"{stub.url}/config/namespaces/system/sites/site-a"]
+    assert all(future.result() for url, future in engine.fetch(urls))
+    assert sorted(engine.windows.keys()) == ["loadbalancers", "sites"]
+    assert all(window.in_flight == 0 for window in engine.windows.values())
+    engine.report()
+    engine.close()
+
+
+def test_engine_adaptive_queued(stub):
+    engine = Engine(session=requests.Session(), workers=2, logger=logger, adaptive=True, max_workers=2)
+    url = f"{stub.url}/config/namespaces/system/sites/site-a"
+    stub.delays["/config/namespaces/system/sites/site-a"] = [0.1] * 8
+    assert all(future.result() for _, future in engine.fetch([f"{url}?i={i}" for i in range(4)]))
+
+    async def hold():
+        # all engine slots taken e.g. by requests of other endpoint families
+        async with engine._semaphore.slot(), engine._semaphore.slot():
+            await asyncio.sleep(0.5)
+
+    held = asyncio.run_coroutine_threadsafe(hold(), engine._loop)
+    time.sleep(0.1)
+    assert all(future.result() for _, future in engine.fetch([f"{url}?j={i}" for i in range(4)]))
+    held.result()
+    # time queued for a slot is not taken for server latency
+    assert [reason for _, _, reason in engine.windows["sites"].history if "spike" in reason] == []
+    engine.close()
+
+
+def test_engine_coalesce(stub, engine):
+    path = "/config/namespaces/shared/virtual_sites/vs-prod"
+    results = [future.result() for url, future in engine.fetch([f"{stub.url}{path}"] * 5)]
+    assert engine.get(f"{stub.url}{path}").json()["metadata"]["name"] == "vs-prod"
+    assert all(results)
+    assert stub.count(path) == 1
+    assert engine.memo_stats == {"hit": 5, "miss": 1, "primed": 0}
+
+
+def test_engine_coalesce_failed(stub, engine):
+    path = "/config/namespaces/system/sites/site-c"
+    assert engine.get(f"{stub.url}{path}") is False
+    assert engine.get(f"{stub.url}{path}") is False
+    assert stub.count(path) == 2
+
+
+def test_engine_bulk(stub):
+    stub.specless.add("lb1")
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, bulk=True)
+    path = "/config/namespaces/ns1/origin_pools"
+    assert engine.get(f"{stub.url}{path}").json()["items"][0]["name"] == "pool1"
+    assert engine.get(f"{stub.url}{path}/pool1").json()["spec"]["origin_servers"]
+    assert stub.count(f"{path}/pool1") == 0
+    # items without spec fall back to per object GET
+    path = "/config/namespaces/default/http_loadbalancers"
+    engine.get(f"{stub.url}{path}")
+    assert engine.get(f"{stub.url}{path}/lb1").json()["metadata"]["name"] == "lb1"
+    assert stub.count(f"{path}/lb1") == 1
+    assert engine.memo_stats["primed"] == 1
+    # processors iterate the items decoded for priming
+    r = engine.get(f"{stub.url}/config/namespaces/ns1/origin_pools")
+    r._content = b"not json"
+    assert [item["name"] for item in iter_items(r)] == ["pool1"]
+    engine.close()
+
+
+def test_engine_bulk_primed_kept():
+    tenant = copy.deepcopy(TENANT)
+    path = "/config/namespaces/ns1/origin_pools"
+    tenant[path] = {"items": [{"name": f"pool{i}"} for i in range(50)]}
+    tenant.update({f"{path}/pool{i}": dict(tenant[f"{path}/pool1"], metadata={"name": f"pool{i}", "namespace": "ns1"}) for i in range(50)})
+
+    with StubApi(tenant=tenant) as stub:
+        engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, bulk=True, memo_size=20)
+        engine.get(f"{stub.url}{path}")
+        # primed responses outnumber memo_size and are still served without a request
+        assert all(future.result() for url, future in engine.fetch([f"{stub.url}{path}/pool{i}" for i in range(50)]))
+        assert sum(stub.count(f"{path}/pool{i}") for i in range(50)) == 0
+        assert engine.memo_stats["primed"] == 50
+        engine.close()
+
+        # bodies of objects never requested are bounded, oldest are released and requested again
+        engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, bulk=True, primed_size=10)
+        engine.get(f"{stub.url}{path}")
+        assert len(engine._primed) == 10
+        assert all(future.result() for url, future in engine.fetch([f"{stub.url}{path}/pool{i}" for i in range(50)]))
+        assert sum(stub.count(f"{path}/pool{i}") for i in range(50)) == 40
+        engine.close()
+
+
+def test_engine_fetch_expand(stub, retry_engine):
+    path = "/config/namespaces/ns1/origin_pools"
+    # list request of ns1 is deferred, its object request must still be issued
+    stub.faults[path] = [503, 503, 503]
+    urls = [f"{stub.url}/config/namespaces/{namespace}/origin_pools" for namespace in ["default", "ns1"]]
+    expand = lambda url, r: [f"{url}/{item['name']}" for item in r.json()["items"]] if r else []
+    results = [(url, future.result()) for url, future in retry_engine.fetch(urls, expand=expand)]
+    assert [url for url, result in results] == [f"{stub.url}{path}/pool1"]
+    assert results[0][1].json()["metadata"]["name"] == "pool1"
+
+
+def test_engine_bounded_fetch(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, max_pending=2, memo_size=3)
+    path = "/config/namespaces/system/sites/site-a"
+    urls = (f"{stub.url}{path}?i={i}" for i in range(20))
+    assert sum(1 for url, future in engine.fetch(urls) if future.result()) == 20
+    assert engine.queue_depth_peak <= 2
+    assert engine.queue_depth == 0
+    # oldest responses were released from memo
+    assert engine.get(f"{stub.url}{path}?i=0")
+    assert stub.count(path) == 21
+    engine.close()
+
+
+def test_engine_timeout(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, retries=0, timeouts={"default": (1, 0.2)})
+    path = "/config/namespaces/system/bgps/bgp-a"
+    stub.delays[path] = [1, 1]
+    assert engine.get(f"{stub.url}{path}") is False
+    assert engine.dropped == [f"{stub.url}{path}"]
+    engine.close()
+
+
+def test_engine_hedge(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, hedge=1.0)
+    path = "/config/namespaces/system/bgps/bgp-a"
+    # collect latency samples
+    assert all(future.result() for url, future in engine.fetch(f"{stub.url}{path}?i={i}" for i in range(20)))
+    stub.delays[path] = [2]
+    start = time.monotonic()
+    assert engine.get(f"{stub.url}{path}").json()["metadata"]["name"] == "bgp-a"
+    assert time.monotonic() - start < 1
+    assert engine.hedge_stats["hedged"] == 1
+    assert engine.hedge_stats["won"] == 1
+    engine.close()
+
+
+def test_engine_breaker(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, retries=0, backoff=0.01, breaker_threshold=2, breaker_cooldown=0.2)
+    path = "/config/namespaces/default/http_loadbalancers/lb1"
+    stub.faults[path] = [503] * 10
+    assert engine.get(f"{stub.url}{path}?i=0") is False
+    assert engine.get(f"{stub.url}{path}?i=1") is False
+    assert stub.count(path) == 2
+    assert engine.degraded == {"default": {"http_loadbalancers": {"skipped": [f"{stub.url}{path}?i=1"], "opened": 1}}}
+    # other collections are not affected
+    assert engine.get(f"{stub.url}/config/namespaces/ns1/origin_pools/pool1")
+    time.sleep(0.3)
+    stub.faults[path] = []
+    assert engine.get(f"{stub.url}{path}?i=2")
+    assert engine.breakers[("http_loadbalancers", "default")].state == "closed"
+    engine.close()
+
+
+def test_engine_breaker_probe_without_verdict(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, retries=0, backoff=0.01, breaker_threshold=1, breaker_cooldown=0.2)
+    path = "/config/namespaces/default/http_loadbalancers/lb1"
+    stub.faults[path] = [503, 429]
+    assert engine.get(f"{stub.url}{path}?i=0") is False
+    time.sleep(0.3)
+    # throttled probe neither closes nor opens the breaker, the retry of the request probes again
+    assert engine.get(f"{stub.url}{path}?i=1")
+    assert engine.breakers[("http_loadbalancers", "default")].state == "closed"
+    assert stub.count(path) == 3
+    engine.close()
+
+
+def test_engine_tokens(stub):
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, tokens=["t0", "t1", "t2"], retries=0)
+    urls = [f"{stub.url}/config/namespaces/system/sites/site-a?i={i}" for i in range(9)]
+    assert all(future.result() for url, future in engine.fetch(urls))
+    assert sorted(set(stub.tokens)) == ["t0", "t1", "t2"]
+    assert [credential.requests for credential in engine.credentials.credentials] == [3, 3, 3]
+    # rejected token is taken out of rotation without failing the request
+    stub.rejected.add("t1")
+    urls = [f"{stub.url}/config/namespaces/system/sites/site-b?i={i}" for i in range(6)]
+    assert all(future.result() for url, future in engine.fetch(urls))
+    assert [credential.name for credential in engine.credentials.active] == ["token0", "token2"]
+    assert stub.tokens.count("t1") > 3
+    engine.report()
+    engine.close()
+
+
+def test_engine_fetch_expand_lazy(stub):
+    engine = Engine(session=requests.Session(), workers=2, logger=logger, max_pending=2)
+    pulled = list()
+
+    def expand(url, result):
+        for item in iter_items(result):
+            pulled.append(item["name"])
+            yield f"{url}/{item['name']}"
+
+    stub.tenant["/config/namespaces/system/sites"] = {"items": [{"name": f"site-{i}"} for i in range(20)]}
+    results = engine.fetch([f"{stub.url}/config/namespaces/system/sites"], expand=expand)
+    next(results)
+    # list items are decoded only as object requests are submitted
+    assert len(pulled) < 20
+    assert len(list(results)) == 19
+    assert len(pulled) == 20
+    engine.close()
+
+
+def test_engine_priority(stub):
+    engine = Engine(session=requests.Session(), workers=1, logger=logger)
+    busy = "/config/namespaces/default/http_loadbalancers/lb1"
+    stub.delays[busy] = [0.3]
+    futures = [engine.submit(f"{stub.url}{busy}")]
+    time.sleep(0.1)
+    # queued while the only slot is busy. Sites go first
+    for path in ["/config/namespaces/system/enhanced_firewall_policys/efp1", "/config/namespaces/default/origin_pools/pool1", "/config/namespaces/system/sites/site-a"]:
+        futures.append(engine.submit(f"{stub.url}{path}"))
+    for future in futures:
+        future.result()
+    assert stub.requests == [busy, "/config/namespaces/system/sites/site-a", "/config/namespaces/default/origin_pools/pool1",
+                             "/config/namespaces/system/enhanced_firewall_policys/efp1"]
+    engine.close()
@@ -0,0 +1,26 @@
+import time
+from unittest.mock import patch
+
+from lib.cache import make_response
+from lib.journal import Journal
+
+
+def test_journal_sync_does_not_block(tmp_path):
+    journal = Journal(path=str(tmp_path / "journal"), run={"api_url": "x"})
+    url = "http://x/config/namespaces/default/http_loadbalancers/lb1"
+    journal.record(url, make_response(url=url, body=b'{"name": "lb1"}'))
+    journal._queue.join()
+    assert journal.replayable(url)
+
+    with patch("lib.journal.os.fsync", side_effect=lambda fd: time.sleep(1)):
+        journal.milestone("lb", {"x": 1})
+        # writer is syncing the processor record, lookups and recording go on
+        time.sleep(0.1)
+        start = time.monotonic()
+        assert journal.response(url).json() == {"name": "lb1"}
+        journal.record(f"{url}2", make_response(url=f"{url}2", body=b"{}"))
+        assert time.monotonic() - start < 0.5
+        journal._queue.join()
+
+    assert journal.replayable(f"{url}2") and journal.stats == {"replayed": 1, "recorded": 2}
+    journal.close()
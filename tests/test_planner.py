@@ -0,0 +1,59 @@
+import json
+import logging
+
+import pytest
+
+from lib.api import Api
+from lib.endpoint import parse
+
+WORKERS = 4
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_api_plan(stub, tmp_path):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS)
+    plan = api.plan()
+    api.close()
+    # Only list requests, no object is fetched
+    assert all(parse(stub.url + path)[2] is None for path in stub.requests)
+    processors = plan["processors"]
+    # failed site-b gets no site details
+    assert processors["site"]["listed"] == 2 and processors["site"]["requests"] == 3
+    assert processors["lb"]["lists"] == 6 and processors["lb"]["requests"] == 1
+    assert processors["proxy"]["requests"] == 0 and processors["originpool"]["requests"] == 1
+    assert plan["total"]["requests"] == 8 and processors["lb"]["phase"] > processors["site"]["phase"]
+
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS, bulk=True)
+    api.run()
+    profile = str(tmp_path / "get-sites.json.profile")
+    assert api.write_profile(profile)
+    api.close()
+    with open(profile) as fd:
+        assert json.load(fd)["http_loadbalancers"]["list"]["requests"] == 2
+
+    # Bulk runs get listed objects with list responses. Bytes are taken from profile of the last run
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS, rate_limit=2)
+    plan = api.plan(bulk=True, profile=profile)
+    api.close()
+    assert plan["total"]["requests"] == 3 and plan["rate"] == 2
+    assert plan["wall_time"] >= plan["total"]["requests"] / 2
+
+
+@pytest.mark.parametrize("options", [dict(), dict(bulk=True), dict(processors=["site", "smg"]), dict(bulk=True, processors=["site", "smg"])])
+def test_api_plan_exact(stub, options):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS, **dict(options, bulk=False))
+    plan = api.plan(bulk=options.get("bulk", False))
+    api.close()
+
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS, **options)
+    start = len(stub.requests)
+    api.run()
+    api.close()
+    sent = [parse(stub.url + path) for path in stub.requests[start:]]
+
+    assert len(sent) == plan["total"]["lists"] + plan["total"]["requests"]
+    assert len([url for url in sent if url[2] is not None]) == plan["total"]["requests"]
+    # site mesh group is served from its list in bulk mode. Without virtual site processor it fetches its virtual site
+    assert plan["processors"]["smg"]["requests"] == (0 if options.get("bulk") else 1) + (0 if "vs" in plan["processors"] else 1)
@@ -0,0 +1,17 @@
+import pytest
+
+from lib.ratelimit import TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert TokenBucket(rate=0).reserve() == 0
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=0)
+    bucket.pause(1)
+    assert bucket.reserve() == pytest.approx(1, abs=0.05)
@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from lib.processor.lb import Lb
+from lib.scheduler import Scheduler, merge
+
+logger = logging.getLogger(__name__)
+
+
+def test_merge():
+    dst = {"site": {"a": {"kind": "sms", "vsites": ["vs1"]}}, "failed": {}}
+    src = {"site": {"a": {"bgp": {"b1": {}}, "vsites": ["vs1", "vs2"]}, "b": {}}, "failed": {"c": "DOWN"}}
+    assert merge(dst, src) == {"site": {"a": {"kind": "sms", "vsites": ["vs1", "vs2"], "bgp": {"b1": {}}}, "b": {}}, "failed": {"c": "DOWN"}}
+
+
+def test_merge_lists():
+    dst = {"namespaces": ["a", "b"], "items": [{"name": "x"}]}
+    merge(dst, {"namespaces": ["b", "c", "c"], "items": [{"name": "x"}, {"name": "y"}]})
+    assert dst == {"namespaces": ["a", "b", "c"], "items": [{"name": "x"}, {"name": "y"}]}
+
+
+def test_processor_result():
+    data = {"namespaces": ["default"], "failed": {}, "versions": {"/old": "1"}, "virtual_site": {},
+            "site": {"a": {"kind": "sms", "namespaces": {"default": {"origin_pools": {"p1": {}}}}}}}
+    workspace = Lb.workspace(data)
+    keys = set(workspace)
+    workspace["site"]["a"]["namespaces"]["default"]["loadbalancer"] = {"http": {"lb1": {}}}
+    workspace["site"]["a"]["kind"] = "changed"
+    workspace.setdefault("versions", dict())["/lb1"] = "2"
+    assert "loadbalancer" not in data["site"]["a"]["namespaces"]["default"]
+    assert Lb.result(workspace, keys) == {"versions": {"/lb1": "2"}, "virtual_site": {},
+                                          "site": {"a": {"namespaces": {"default": {"loadbalancer": {"http": {"lb1": {}}}}}}}}
+
+
+def test_scheduler():
+    order = list()
+    running = set()
+    overlap = list()
+    lock = threading.Lock()
+
+    def task(name):
+        def run():
+            with lock:
+                running.add(name)
+                overlap.append(set(running))
+            time.sleep(0.05)
+            with lock:
+                running.discard(name)
+            return name
+        return run
+
+    scheduler = Scheduler(logger=logger)
+    scheduler.add("site", ["namespaces"], ["site"], task("site"))
+    scheduler.add("vs", [], ["virtual_site"], task("vs"))
+    scheduler.add("lb", ["site", "virtual_site"], ["loadbalancer"], task("lb"))
+    scheduler.add("bgp", ["site", "virtual_site"], ["bgp"], task("bgp"))
+    scheduler.run(available=["namespaces"], complete=lambda name, result: order.append(result))
+
+    assert set(order[:2]) == {"site", "vs"}
+    assert set(order[2:]) == {"lb", "bgp"}
+    assert {"site", "vs"} in overlap or {"lb", "bgp"} in overlap
+
+
+def test_scheduler_prepare():
+    data = {"count": 0}
+    threads = list()
+
+    def prepare():
+        threads.append(threading.current_thread())
+        return dict(data)
+
+    def run(snapshot):
+        time.sleep(0.05)
+        return {"count": snapshot["count"] + 1}
+
+    scheduler = Scheduler(logger=logger)
+    scheduler.add("first", [], ["first"], run, prepare=prepare)
+    scheduler.add("second", ["first"], ["second"], run, prepare=prepare)
+    scheduler.run(complete=lambda name, result: data.update(result))
+
+    assert data["count"] == 2
+    assert threads == [threading.current_thread()] * 2
+
+
+def test_scheduler_unsatisfiable():
+    scheduler = Scheduler(logger=logger)
+    scheduler.add("lb", ["site"], ["loadbalancer"], lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.run(complete=lambda name, result: None)
@@ -0,0 +1,31 @@
+import pytest
+
+from lib.cache import make_response
+from lib.stream import iter_items, list_items
+
+
+@pytest.mark.parametrize("body, expected", [
+    (b'{"items": [{"name": "a"}, {"name": "b"}]}', [{"name": "a"}, {"name": "b"}]),
+    (b' { "errors": {"x": [1, "]"]} , "items" : [ 1 , [2] ], "more": "}" } ', [1, [2]]),
+    (b'{"items": []}', []),
+    (b'{}', []),
+])
+def test_iter_items(body, expected):
+    assert list(iter_items(make_response(body=body))) == expected
+
+
+def test_iter_items_malformed():
+    items = iter_items(make_response(body=b'{"items": [{"name": "a"}, {"name":'))
+    assert next(items) == {"name": "a"}
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_list_items_decoded_once():
+    response = make_response(body=b'{"items": [{"name": "a"}, {"name": "b"}]}')
+    items = list_items(response)
+    # later consumers share the decoded items, the body is not decoded again
+    response._content = b"not json"
+    assert list_items(response) is items
+    assert list(iter_items(response)) == [{"name": "a"}, {"name": "b"}]
+    assert list_items(False) == []
@@ -0,0 +1,46 @@
+import json
+import logging
+
+import pytest
+
+from lib.api import Api, NamespaceError
+from lib.tenants import Tenants
+from tests.stub import StubApi
+
+WORKERS = 4
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def test_tenants_run(stub, tmp_path):
+    api = Api(logger=logger, api_url=stub.url, api_token="token", namespace=None, site=None, workers=WORKERS)
+    expected = api.run()
+    api.close()
+
+    with StubApi() as other:
+        del other.tenant["/config/namespaces/system/sites"]["items"][1:]
+        tenants = [{"name": name, "api_url": url, "api_token": "token", "file": str(tmp_path / f"get-sites-{name}.json")} for name, url in [("a", stub.url), ("b", other.url)]]
+        t = Tenants(logger=logger, tenants=tenants, workers=WORKERS, options={"namespace": None, "site": None})
+        index = t.run()
+
+    assert json.load(open(tmp_path / "get-sites-a.json")) == expected
+    assert index["a"]["site"] == sorted(expected["site"])
+    assert index["a"]["failed"] == ["site-b"]
+    assert index["b"]["site"] == ["site-a"]
+    assert index["b"]["failed"] == []
+    assert "error" not in index["b"]
+    t.write_index(str(tmp_path / "index.json"))
+    assert sorted(json.load(open(tmp_path / "index.json"))["tenants"]) == ["a", "b"]
+
+
+def test_tenants_namespaces_failed(stub, tmp_path):
+    with pytest.raises(NamespaceError):
+        Api(logger=logger, api_url=stub.url, api_token="token", namespace="missing", site=None, workers=WORKERS, retries=0)
+
+    tenants = [{"name": "a", "api_url": stub.url, "api_token": "token", "file": str(tmp_path / "get-sites-a.json")}]
+    t = Tenants(logger=logger, tenants=tenants, workers=WORKERS, options={"namespace": "missing", "site": None, "retries": 0})
+    index = t.run()
+
+    assert index["a"]["error"] == "validating namespace <missing> failed"
+    assert not (tmp_path / "get-sites-a.json").exists()
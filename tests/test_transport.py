@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+import requests
+
+import lib.const as c
+from lib.cache import ResponseCache
+from lib.engine import Engine
+from lib.transport import RequestsTransport
+from tests.stub import StubApi
+
+WORKERS = 4
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def check_transport(stub: StubApi = None, tmp_path=None, transport: str = None):
+    cache = ResponseCache(path=str(tmp_path), ttl=0)
+    path = "/config/namespaces/system/sites/site-a"
+    for _ in range(2):
+        engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, transport=transport, cache=cache, retries=0,
+                        timeouts={"default": (1, 0.2)}, breaker_threshold=0)
+        urls = [f"{stub.url}{path}", f"{stub.url}/config/namespaces/system/sites/site-b"]
+        results = {url: future.result() for url, future in engine.fetch(urls)}
+        assert results[urls[0]].json()["metadata"]["name"] == "site-a"
+        assert engine.get(f"{stub.url}/does/not/exist") is False
+        engine.close()
+    # second run revalidated with 304
+    assert cache.stats()["revalidated"] == 2
+    cache.close()
+
+    engine = Engine(session=requests.Session(), workers=WORKERS, logger=logger, transport=transport, retries=0, timeouts={"default": (1, 0.2)})
+    path = "/config/namespaces/system/bgps/bgp-a"
+    stub.delays[path] = [1, 1]
+    assert engine.get(f"{stub.url}{path}") is False
+    assert engine.prewarm(f"{stub.url}/web/namespaces", 2) == 2
+    engine.close()
+
+
+@pytest.mark.parametrize("transport", ["requests", "urllib3", "httpx"])
+def test_engine_transport(stub, tmp_path, transport):
+    if transport == "httpx":
+        pytest.importorskip("httpx")
+    check_transport(stub, tmp_path, transport)
+
+
+def test_engine_transport_http2(h2stub, tmp_path):
+    pytest.importorskip("httpx")
+    # the server speaks h2 only, every request was multiplexed over few connections
+    check_transport(h2stub, tmp_path, "http2")
+    assert 0 < h2stub.connections <= 3 * c.TRANSPORT_HTTP2_CONNECTIONS
+    path = "/config/namespaces/system/sites/site-a"
+    h2stub.delays[path] = [0.3] * 8
+    engine = Engine(session=requests.Session(), workers=8, logger=logger, transport="http2", breaker_threshold=0)
+    connections = h2stub.connections
+    start = time.monotonic()
+    assert all(future.result() for url, future in engine.fetch([f"{h2stub.url}{path}?i={i}" for i in range(8)]))
+    assert time.monotonic() - start < 1.5
+    assert h2stub.connections - connections <= c.TRANSPORT_HTTP2_CONNECTIONS
+    engine.close()
+
+
+def test_engine_transport_without_threads(stub):
+    pytest.importorskip("httpx")
+    path = "/config/namespaces/system/sites/site-a"
+    stub.delays[path] = [0.3] * 8
+    engine = Engine(session=requests.Session(), workers=8, logger=logger, transport="httpx", breaker_threshold=0)
+    start = time.monotonic()
+    assert all(future.result() for url, future in engine.fetch([f"{stub.url}{path}?i={i}" for i in range(8)]))
+    # requests were in flight concurrently without an executor thread each
+    assert time.monotonic() - start < 1.5
+    assert not engine._executor._threads
+    engine.close()
+
+
+def test_engine_transport_budget_cancelled(stub):
+    pytest.importorskip("httpx")
+    budget = threading.Semaphore(1)
+    engine = Engine(session=requests.Session(), workers=2, logger=logger, transport="httpx", breaker_threshold=0, budget=budget)
+    # request waits for the budget held by another tenant and is cancelled meanwhile
+    assert budget.acquire(timeout=1)
+    request = asyncio.run_coroutine_threadsafe(engine._arequest(f"{stub.url}/web/namespaces", None, engine.credentials.credentials[0]), engine._loop)
+    time.sleep(0.2)
+    request.cancel()
+    time.sleep(0.2)
+    budget.release()
+    time.sleep(0.2)
+    # slot taken by the waiting executor thread after cancellation is given back
+    assert budget.acquire(timeout=1)
+    budget.release()
+    engine.close()
+
+
+@pytest.mark.parametrize("session_mode", ["thread", "shared"])
+def test_requests_transport_close(stub, session_mode):
+    transport = RequestsTransport(session=requests.Session(), workers=2, session_mode=session_mode)
+    threads = [threading.Thread(target=transport.get, args=(f"{stub.url}/web/namespaces",)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    adapters = [session.get_adapter(stub.url) for session in transport._sessions] or [transport._adapter]
+    assert all(adapter.poolmanager.pools for adapter in adapters)
+    transport.close()
+    # pooled connections of all sessions created by the transport are released
+    assert not any(adapter.poolmanager.pools for adapter in adapters)